@@ -14,6 +14,7 @@
 # along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
 """Provides the AbstractRecipe class"""
 
+import json
 import multiprocessing
 import os
 
@@ -50,6 +51,15 @@ class AbstractRecipe(utils.abkhazia_base.AbkhaziaBase):
     delete_recipe (bool): delete the recipe directory after execution
       (default is True)
 
+    use_cache (bool): if True and a cache directory is configured,
+      restore the recipe results from the cache when they have
+      already been computed with the same corpus, options and inputs
+      (default is True, see utils.cache.StageCache)
+
+    resume (bool): if True, continue a previously failed computation
+      in `recipe_dir`, skipping the stages it completed (default is
+      False, see the _checkpoint method)
+
 
     Methods:
     --------
@@ -79,6 +89,17 @@ class AbstractRecipe(utils.abkhazia_base.AbkhaziaBase):
         # if True, delete the recipe_dir on instance destruction
         self.delete_recipe = True
 
+        # measure the resources used by the recipe, see compute()
+        self.profiler = utils.profiler.Profiler()
+
+        # reuse cached results, see compute()
+        self.use_cache = True
+
+        # skip the stages completed by a previous run, see _checkpoint()
+        self.resume = False
+        self._checkpoints = {}
+        self._checkpoints_options = None
+
         # init the abkhazia2kaldi converter
         self.a2k = Abkhazia2Kaldi(
             self.corpus, self.recipe_dir, name=self.name, log=self.log)
@@ -90,16 +111,39 @@ class AbstractRecipe(utils.abkhazia_base.AbkhaziaBase):
         except AttributeError:  # if raised from __init__
             pass
 
-    def _run_command(self, command, verbose=True):
+    def _run_command(self, command, verbose=True, timeout=None):
         """Run the command as a subprocess in a Kaldi environment"""
+        return self._run_commands([command], verbose=verbose,
+                                  timeout=timeout)[0]
+
+    def _run_commands(self, commands, verbose=True, timeout=None):
+        """Run the commands concurrently in a Kaldi environment
+
+        At most self.njobs commands are running simultaneously. As
+        soon as a command fails or exceeds `timeout` seconds, the
+        other ones are cancelled and a RuntimeError is raised.
+
+        Return the list of the executed utils.jobs.Job. Their
+        resources usage is registered in self.profiler.
+
+        """
         if verbose is True:
-            self.log.info('running %s', command)
+            for command in commands:
+                self.log.info('running %s', command)
 
-        utils.jobs.run(
-            command,
-            stdout=self.log.debug,
-            env=kaldi_path(),
-            cwd=self.recipe_dir)
+        jobs = []
+        try:
+            with utils.jobs.JobRunner(
+                    njobs=self.njobs, stdout=self.log.debug,
+                    env=kaldi_path(), cwd=self.recipe_dir) as runner:
+                jobs.extend(runner.submit(command, timeout=timeout)
+                            for command in commands)
+                runner.wait(jobs)
+        finally:
+            for job in jobs:
+                self.profiler.add_job(job)
+
+        return jobs
 
     def _check_njobs(self, local=False):
         """Garanties a valid njobs parameter
@@ -180,7 +224,187 @@ class AbstractRecipe(utils.abkhazia_base.AbkhaziaBase):
         self.meta.save(os.path.join(self.output_dir, 'meta.txt'))
 
     def compute(self):
-        """Create, run and export the recipe"""
-        self.create()
-        self.run()
-        self.export()
+        """Create, run and export the recipe
+
+        If the recipe results are in the cache, they are restored in
+        `output_dir` instead, else they are stored in the cache once
+        computed.
+
+        The resources used by the three steps and by the commands they
+        executed are saved in `output_dir`/profile.json, even if a
+        step failed.
+
+        The completed stages are recorded in `recipe_dir`. If the
+        computation fails, `recipe_dir` is kept so that it can be
+        continued with `resume` set to True.
+
+        """
+        cache = self._cache()
+        try:
+            self._load_checkpoints()
+
+            if cache is not None:
+                with self.profiler.stage('cache'):
+                    key = self._cache_key(
+                        cache, 'compute', self.corpus.fingerprint(),
+                        self._cache_options())
+                    restored = cache.get(key, self.output_dir)
+                if restored:
+                    self.log.info('%s restored from cache', self.name)
+                    return
+
+            for step in ('create', 'run', 'export'):
+                with self.profiler.stage(step):
+                    if step == 'create':
+                        self._create()
+                    else:
+                        getattr(self, step)()
+
+            if cache is not None:
+                with self.profiler.stage('cache'):
+                    cache.put(key, self.output_dir,
+                              exclude=cache.ignored, name=self.name)
+        except BaseException:
+            if self.delete_recipe:
+                self.delete_recipe = False
+                self.log.error(
+                    '%s failed, the recipe is kept in %s to be resumed',
+                    self.name, self.recipe_dir)
+            raise
+        finally:
+            self.profiler.save(os.path.join(self.output_dir, 'profile.json'))
+
+    def _create(self):
+        """Create the recipe, unless it has been created before resuming"""
+        if 'create' in self._checkpoints:
+            self.log.info('resuming %s in %s', self.name, self.recipe_dir)
+            self.check_parameters()
+
+            # the options are compared once checked, as they are when
+            # recorded
+            if self._checkpoints_options != self._checkpoint_options():
+                raise IOError(
+                    'cannot resume {}: it has been computed with other '
+                    'options'.format(self.recipe_dir))
+        else:
+            self._checkpoint('create', self.create)
+
+    def _checkpoint(self, stage, function, *args, **kwargs):
+        """Call `function` as the resumable `stage` of the recipe
+
+        Return `function(*args, **kwargs)`. Once it returned, the
+        `stage` is recorded as completed with its result in
+        `recipe_dir`/checkpoints.json. When resuming a recipe, an
+        already completed `stage` is skipped and its recorded result
+        is returned instead.
+
+        The result must be serializable in JSON (None, a path...).
+        The `stage` names must be unique within a recipe.
+
+        """
+        if stage in self._checkpoints:
+            self.log.info('skipping %s (completed before resuming)', stage)
+            return self._checkpoints[stage]
+
+        result = function(*args, **kwargs)
+
+        self._checkpoints[stage] = result
+        with open(self._checkpoints_file(), 'w') as fout:
+            json.dump({'options': self._checkpoint_options(),
+                       'stages': self._checkpoints}, fout, indent=2)
+        return result
+
+    def _checkpoints_file(self):
+        return os.path.join(self.recipe_dir, 'checkpoints.json')
+
+    def _checkpoint_options(self):
+        """Return the recipe options as recorded in the checkpoints"""
+        return json.loads(json.dumps(
+            self._cache_options(), sort_keys=True,
+            default=lambda value: getattr(value, 'value', repr(value))))
+
+    def _load_checkpoints(self):
+        """Load the completed stages if resuming, else forget them"""
+        self._checkpoints = {}
+        checkpoints = self._checkpoints_file()
+
+        if not self.resume:
+            if os.path.isfile(checkpoints):
+                os.remove(checkpoints)
+            return
+
+        if not os.path.isfile(checkpoints):
+            self.log.warning(
+                'nothing to resume in %s, starting from scratch',
+                self.recipe_dir)
+            return
+
+        data = json.load(open(checkpoints, 'r'))
+        self._checkpoints = data['stages']
+        self._checkpoints_options = data['options']
+
+    def _cache(self):
+        """Return the configured utils.cache.StageCache or None"""
+        if not self.use_cache:
+            return None
+        return utils.cache.StageCache.from_config(log=self.log)
+
+    def _cache_options(self):
+        """Return a dict of the options the recipe results depend on
+
+        By default these are the public attributes of the recipe,
+        except the ones which do not alter the results (such as njobs)
+        and the paths in the output directory. The input directories
+        are hashed by content.
+
+        """
+        ignored = ('corpus', 'log', 'meta', 'a2k', 'profiler', 'njobs',
+                   'delete_recipe', 'use_cache', 'resume', 'output_dir',
+                   'recipe_dir')
+
+        options = {}
+        for name, value in vars(self).iteritems():
+            if name.startswith('_') or name in ignored:
+                continue
+            if isinstance(value, basestring) and (
+                    value == self.output_dir or
+                    value.startswith(self.output_dir + os.sep)):
+                continue
+            options[name] = value
+
+        # the acoustic models options are class attributes
+        if isinstance(getattr(self, 'options', None), dict):
+            options['options'] = self.options
+        return options
+
+    def _cache_key(self, cache, stage, *inputs):
+        """Return the cache key of the `stage` of the recipe
+
+        The key depends on the recipe class, the stage name and its
+        `inputs`, see utils.cache.StageCache.memoized_key.
+
+        """
+        return cache.memoized_key(
+            type(self).__module__ + '.' + type(self).__name__,
+            stage, *inputs)
+
+    def _cached_stage(self, stage, target, function, *inputs):
+        """Run `function` unless the `target` directory is cached
+
+        If the `stage` results are cached for `inputs` (see the
+        _cache_key method), restore them in `target`. Else run
+        `function` (with no arguments) that fills the `target`
+        directory and store it in the cache.
+
+        """
+        cache = self._cache()
+        if cache is None:
+            return function()
+
+        key = self._cache_key(cache, stage, *inputs)
+        if cache.get(key, target):
+            self.log.info('%s restored from cache', stage)
+            return
+
+        function()
+        cache.put(key, target, exclude=cache.ignored, name=stage)
@@ -81,7 +81,7 @@ class Monophone(AbstractAcousticModel):
         features.Features.check_features(self.input_dir, cmvn=True)
 
     def run(self):
-        self._train_mono()
+        self._checkpoint('train_mono', self._train_mono)
 
     def _train_mono(self):
         # Flat start and monophone training, with delta-delta features.
@@ -164,7 +164,7 @@ class NeuralNetwork(AbstractAcousticModel):
             'pnorm-input-dim={} and pnorm-output-dim={}'.format(idim, odim))
 
     def run(self):
-        self._train_pnorm_fast()
+        self._checkpoint('train_pnorm_fast', self._train_pnorm_fast)
 
     def _train_pnorm_fast(self):
         message = 'training neural network'
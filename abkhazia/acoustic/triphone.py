@@ -97,8 +97,8 @@ class Triphone(AbstractAcousticModel):
 
     def run(self):
         align_dir = os.path.join(self.recipe_dir, 'exp', 'mono_ali')
-        self._align_si(align_dir)
-        self._train_deltas(align_dir)
+        self._checkpoint('align_si', self._align_si, align_dir)
+        self._checkpoint('train_deltas', self._train_deltas, align_dir)
 
     def _align_si(self, output_dir):
         """Wrapper on steps/align_si.sh
@@ -107,8 +107,8 @@ class TriphoneSpeakerAdaptive(AbstractAcousticModel):
 
     def run(self):
         align_dir = os.path.join(self.recipe_dir, 'exp', 'tri_ali_fmllr')
-        self._align_fmllr(align_dir)
-        self._train_sat(align_dir)
+        self._checkpoint('align_fmllr', self._align_fmllr, align_dir)
+        self._checkpoint('train_sat', self._train_sat, align_dir)
 
     def _align_fmllr(self, align_dir):
         """Wrapper on steps/align_fmllr.sh
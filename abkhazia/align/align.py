@@ -33,21 +33,19 @@ two alignment recipes, the Align recipe seems to add more silences.
 import gzip
 import os
 import shutil
-import operator
-import time
 import numpy as np
 
-from collections import defaultdict
 from joblib import Parallel, delayed
-from operator import itemgetter
 
 import abkhazia.utils as utils
 import abkhazia.abstract_recipe as abstract_recipe
-from abkhazia.utils.best_path_dtw import dtw
+from abkhazia.align import binary
+from abkhazia.utils.best_path_dtw import dtw, word_alignments
 
 from abkhazia.language import check_language_model, read_int2phone
 from abkhazia.acoustic import check_acoustic_model
 from abkhazia.features import Features
+from abkhazia.kaldi.ark import read_posteriors
 
 
 # TODO check alignment: which utt have been transcribed, have silence
@@ -60,6 +58,12 @@ class Align(abstract_recipe.AbstractRecipe):
     _align_script = 'steps/align_fmllr_lats.sh'
     """The alignment recipe in Kaldi"""
 
+    _words_chunk_size = 10000
+    """Number of utterances processed at once for word alignment"""
+
+    _dtw_job_cells = 10000000
+    """Minimal number of DTW cells computed by a parallel job"""
+
     def __init__(self, corpus, output_dir=None,
                  log=utils.logger.null_logger()):
         super(Align, self).__init__(corpus, output_dir, log=log)
@@ -74,6 +78,10 @@ class Align(abstract_recipe.AbstractRecipe):
         self.acoustic_scale = 0.1
         self.with_posteriors = False
 
+        # write alignment.h5 in the binary format (see
+        # abkhazia.align.binary) instead of alignment.txt
+        self.binary = False
+
     def check_parameters(self):
         super(Align, self).check_parameters()
         self._check_level()
@@ -96,32 +104,36 @@ class Align(abstract_recipe.AbstractRecipe):
 
     def run(self):
         # build alignment lattice
-        self._align_fmllr()
+        self._checkpoint('align_fmllr', self._align_fmllr)
 
         # extract phone level best path
-        self._best_path()
-        self._ali_to_phones()
+        self._checkpoint('best_path', self._best_path)
+        self._checkpoint('ali_to_phones', self._ali_to_phones)
 
         # extract posteriors if asked
         if self.with_posteriors:
-            self._post_to_phones()
+            self._checkpoint('post_to_phones', self._post_to_phones)
 
     def export(self):
         int2phone = read_int2phone(self.lm_dir)
-        ali = self._read_result_utts('ali')
-        post = self._read_result_utts('post') if self.with_posteriors else None
+        phones = self._read_phones(int2phone)
 
         # retrieve the export function according to `level`
         func = {'phones': self._export_phones,
                 'words': self._export_words,
                 'both': self._export_phones_and_words}[self.level]
-        aligned = func(int2phone, ali, post)
 
-        # write it to the target file
-        target = os.path.join(self.output_dir, 'alignment.txt')
-        with utils.open_utf8(target, 'w') as out:
-            for line in aligned:
-                out.write(line.strip() + '\n')
+        # write it to the target file, as it is computed
+        if self.binary:
+            binary.write_binary(
+                func(phones), os.path.join(self.output_dir, 'alignment.h5'),
+                level=self.level, with_posteriors=self.with_posteriors,
+                utt2spk=self.corpus.utt2spk)
+        else:
+            target = os.path.join(self.output_dir, 'alignment.txt')
+            with utils.open_utf8(target, 'w') as out:
+                for line in func(phones):
+                    out.write(line.strip() + u'\n')
 
         super(Align, self).export()
 
@@ -189,7 +201,9 @@ class Align(abstract_recipe.AbstractRecipe):
     def _ali_to_phones(self):
         """Run ali-to-phones Kaldi binary
 
-        Read _target_dir/{best.*.gz, final.mdl}, write _target_dir/ali.*.gz
+        Read _target_dir/{best.*.gz, final.mdl}, write
+        _target_dir/ali.*.gz. The per-frame phones are not computed
+        here but expanded from the phone lengths by read_alignment.
 
         """
         self.log.info('aligning best path to phones')
@@ -204,99 +218,63 @@ class Align(abstract_recipe.AbstractRecipe):
                 os.path.join(self._target_dir(), 'final.mdl')))
 
     def _post_to_phones(self):
-        """Compute alignment posteriors from lattice best path
+        """Compute phone posteriors from the alignment lattices
 
-        Read _target_dir/{best, lat}.*.gz, write _target_dir/post.*.gz
+        Read _target_dir/lat.*.gz, write the per-frame phone posteriors
+        as binary arks in _target_dir/phone_post.*.ark. They are joined
+        to the aligned phones by read_alignment.
 
         """
         self.log.info('extracting alignment posterior probabilities')
-
-        # First we need to rerun ali-to-phones with the --per-frame
-        # option. If this appears to slow, we can optimize with only
-        # one call to ali-phone and a custom conversion frame -> phone
-        # (in this case be carefull not to loose word boundaries).
         self._run_command(
-            '{0} JOB=1:{1} {2}/log/frame-ali-to-phones.JOB.log '
-            'ali-to-phones --per-frame=true {3} '
-            '"ark:gunzip -c {2}/best.JOB.gz|" '
-            '"ark:|gzip -c >{2}/frame_ali.JOB.gz"'.format(
-                os.path.join('utils', utils.config.get('kaldi', 'train-cmd')),
-                self.njobs,
-                self._target_dir(),
-                os.path.join(self._target_dir(), 'final.mdl')))
-
-        self._run_command(
-            '{0} JOB=1:{1} {2}/log/post-on-ali.JOB.log '
+            '{0} JOB=1:{1} {2}/log/phone-post.JOB.log '
             'lattice-to-post --acoustic-scale={3} '
             '"ark:gunzip -c {2}/lat.JOB.gz|" ark:- | '
-            'post-to-phone-post {4} ark:- ark:- | '
-            'get-post-on-ali ark:- "ark:gunzip -c {2}/frame_ali.JOB.gz|" '
-            '"ark,t:|gzip -c >{2}/post.JOB.gz"'.format(
+            'post-to-phone-post {4} ark:- ark:{2}/phone_post.JOB.ark'.format(
                 os.path.join('utils', utils.config.get('kaldi', 'train-cmd')),
                 self.njobs,
                 self._target_dir(),
                 self.acoustic_scale,
                 os.path.join(self._target_dir(), 'final.mdl')))
 
-    def _read_result_utts(self, start):
-        """Read kaldi output files as utt_ids indexed dict
+    def _read_phones(self, int2phone):
+        """Yield the phone alignment lines from Kaldi outputs
 
-        read from _target_dir/start.*.gz, return a dict[utt-id] ->
-        file content.
+        Read _target_dir/ali.*.gz and phone_post.*.ark. The Kaldi jobs
+        outputs are decoded in parallel to _target_dir/alignment.*.txt
+        (see read_alignment), which are then read in sequence.
 
         """
         path = self._target_dir()
-        data = []
-        for _file in sorted(
-                [os.path.join(path, f) for f in os.listdir(path)
-                 if f.startswith(start)]):
-            data += gzip.open(_file, 'r').readlines()
-
-        return {line[0]: ' '.join(line[1:]) for line in
-                (l.replace('[', '').replace(']', '').split() for l in data)}
-
-    @staticmethod
-    def _read_alignment(phonemap, ali, post,
-                        first_frame_center_time=.0125, frame_width=0.025, frame_spacing=0.01):
-        """Tokenize raw kaldi alignment output"""
-        for utt_id, line in ali.iteritems():
-            # TODO make this a parameter (with the 0.01 above), or
-            # read it from the features instance. This is the center
-            # time of the first window, as specified when computing
-            # the features.
-            start = first_frame_center_time - frame_width/2.
-            current_frame_center_time = first_frame_center_time
-
-            if post:
-                utt_post = [float(p) for p in post[utt_id].split()]
-
-            pairs = line.strip().split(' ; ')
-            nb_pairs = len(pairs)
-            for i, pair in enumerate(pairs):
-                code, nframes = pair.split(' ')
-                nframes = int(nframes)
-                if i == nb_pairs-1:
-                    # last phone
-                    stop = current_frame_center_time + frame_spacing*(nframes-1.) + frame_width/2.
-                    current_frame_center_time = None
-                else:
-                    stop = current_frame_center_time + frame_spacing*(nframes-0.5)
-                    current_frame_center_time = stop + 0.5*frame_spacing
-
-                if post:
-                    mpost = sum(utt_post[:nframes]) / nframes
-                    utt_post = utt_post[nframes:]
-                    yield (utt_id, str(start), str(stop),
-                           str(mpost), phonemap[code])
-                else:
-                    yield (utt_id, str(start), str(stop), phonemap[code])
-
-                start = stop
+        jobs = sorted(
+            int(f.split('.')[1]) for f in os.listdir(path)
+            if f.startswith('ali.') and f.endswith('.gz'))
+
+        phonemap = [None] * (max(int(c) for c in int2phone) + 1)
+        for code, phone in int2phone.iteritems():
+            phonemap[int(code)] = phone
+
+        outputs = [os.path.join(path, 'alignment.{}.txt'.format(j))
+                   for j in jobs]
+        Parallel(n_jobs=self.njobs)(
+            delayed(_write_alignment)(
+                output,
+                os.path.join(path, 'ali.{}.gz'.format(j)),
+                (os.path.join(path, 'phone_post.{}.ark'.format(j))
+                 if self.with_posteriors else None),
+                phonemap)
+            for j, output in zip(jobs, outputs))
+
+        for output in outputs:
+            with utils.open_utf8(output, 'r') as fin:
+                for line in fin:
+                    yield line.rstrip(u'\n')
 
     @staticmethod
     def _read_splited(path):
         """Read lines from a file, each line being striped and split"""
-        lines = path if isinstance(path, list) else utils.open_utf8(path, 'r')
+        lines = (utils.open_utf8(path, 'r') if isinstance(path, basestring)
+                 else path)
         return (l.strip().split() for l in lines)
 
     @classmethod
@@ -318,7 +296,16 @@ class Align(abstract_recipe.AbstractRecipe):
 
     @classmethod
     def _read_words(cls, path):
-        """Yield words alignement from a 'phone and words' alignment file"""
+        """Yield words alignement from a 'phone and words' alignment file
+
+        `path` is a text or binary alignment file, or text lines.
+
+        """
+        if isinstance(path, basestring) and binary.is_binary(path):
+            for line in cls._read_binary_words(path):
+                yield line
+            return
+
         word = None
         utt_id = None
         start = 0
@@ -337,83 +324,153 @@ class Align(abstract_recipe.AbstractRecipe):
         if word is not None:
             yield ' '.join([utt_id, start, stop, word])
 
-    def _export_phones(self, int2phone, ali, post):
+    @staticmethod
+    def _read_binary_words(path):
+        """Yield words alignment from a binary 'both' alignment file
+
+        A word stops at the end of the row preceding the next word in
+        the utterance, or at the end of the utterance.
+
+        """
+        with binary.BinaryAlignment(path) as alignment:
+            for utt_id, rows in alignment:
+                starts = np.flatnonzero(rows.word >= 0)
+                if not len(starts):
+                    continue
+                stops = np.append(starts[1:], len(rows)) - 1
+                for start, stop, word in zip(
+                        map(str, rows.tstart[starts]),
+                        map(str, rows.tstop[stops]),
+                        rows.word[starts].tolist()):
+                    yield u' '.join(
+                        (utt_id, start, stop, alignment.words[word]))
+
+    @staticmethod
+    def _export_phones(phones):
         """Export alignment at phone level"""
-        return [' '.join(seq) for seq
-                in self._read_alignment(int2phone, ali, post)]
+        return phones
 
-    def _export_phones_and_words(self, int2phone, ali, post):
-        """Export alignment at both phone and word levels"""
-        # phone level alignment
-        phones = self._export_phones(int2phone, ali, post)
+    def _export_phones_and_words(self, phones):
+        """Export alignment at both phone and word levels
 
-        # text[utt_id] = list of words
-        text = {k: v.strip().split()
-                for k, v in self.corpus.text.iteritems()}
+        Yield the phone level alignment with each word appended to its
+        first phone. When the aligned phones (silences excepted) match
+        the pronunciations of the transcription, the words are read
+        along the phones. Else they are recovered by DTW (see
+        abkhazia.utils.best_path_dtw), computed in parallel by chunks
+        of utterances.
 
-        # lexicon[word] = list of phones
-        lexicon = {k: v.strip().split()
-                   for k, v in self.corpus.lexicon.iteritems()}
+        """
+        # integer coded pronunciations and silences
+        codes = {}
+        lexicon = {
+            word: [codes.setdefault(p, len(codes)) for p in pron.split()]
+            for word, pron in self.corpus.lexicon.iteritems()}
+        silences = set(codes.setdefault(p, len(codes))
+                       for p in self.corpus.silences)
+
+        oovs = set()
+        chunk = []
+        for utt_id, utt_align in self._read_utts(phones):
+            if utt_id is None:  # no alignment at all
+                continue
+
+            words = []
+            for word in self.corpus.text.get(utt_id, '').split():
+                if word in lexicon:
+                    words.append(word)
+                elif word not in oovs:
+                    self.log.warning(
+                        'ignoring out of lexicon word: %s', word)
+                    oovs.add(word)
+
+            chunk.append(self._align_words(
+                utt_align, words, lexicon, codes, silences))
+            if len(chunk) == self._words_chunk_size:
+                for line in self._dtw_words(chunk):
+                    yield line
+                chunk = []
+
+        for line in self._dtw_words(chunk):
+            yield line
 
-        words = []
+    @staticmethod
+    def _align_words(utt_align, words, lexicon, codes, silences):
+        """Return the aligned phones of an utterance with their words
 
-        t0=time.time()
-        #try:
-        utts = [(utt_id, utt_align) for utt_id, utt_align in self._read_utts(phones)]
+        `utt_align` are the phone alignment lines of the utterance and
+        `words` its transcription. Return the lines with the words if
+        the aligned phones match the lexicon, else return the
+        arguments of best_path_dtw.dtw as a tuple, the phones being
+        coded as integers.
 
-        list_phones = defaultdict(list)
-        word_pos = defaultdict(list)
-        utt_alignment = [aligned.split(' ')[-1] for aligned in utt_align]
+        """
+        if not words:
+            return utt_align
+
+        aligned = [codes.setdefault(line.rsplit(' ', 1)[-1], len(codes))
+                   for line in utt_align]
+
+        # the number of non silent phones in each word
+        lengths = [sum(1 for p in lexicon[word] if p not in silences)
+                   for word in words]
+        if not all(lengths) or [p for p in aligned if p not in silences] != [
+                p for word in words for p in lexicon[word]
+                if p not in silences]:
+            return (aligned,
+                    [p for word in words for p in lexicon[word]],
+                    [word for word in words for _ in lexicon[word]],
+                    utt_align)
+
+        # the words are appended to their first phone
+        lines = []
+        word_iter = iter(zip(words, lengths))
+        remaining = 0
+        for line, phone in zip(utt_align, aligned):
+            if phone in silences:
+                lines.append(line)
+            elif remaining:
+                lines.append(line)
+                remaining -= 1
+            else:
+                word, length = next(word_iter)
+                lines.append(u'{} {}'.format(line, word))
+                remaining = length - 1
+        return lines
 
-        # create list of all the phones using the lexicon
-        for word in text[utt_id]:
-            try:
-                list_phones[utt_id] += lexicon[word]
-                word_pos[utt_id] += [word] * len(lexicon[word])
-            except KeyError:
-                continue
+    def _dtw_words(self, chunk):
+        """Yield the lines of the utterances in `chunk`, computing DTW
+
+        `chunk` is a list of the values returned by _align_words, the
+        DTW of the mismatching utterances is computed in parallel.
 
-        try:
-            for utt_id, utt_align in self._read_utts(phones):
-                idx = 0
-                # for each word in transcription, parse it's aligned
-                # phones and add the word after the first phone belonging
-                # to that word.
-                for word in text[utt_id]:
-                    try:
-                        wlen = len(lexicon[word])
-                    except KeyError:  # the word isn't in lexicon
-                        self.log.warning(
-                            'ignoring out of lexicon word: %s', word)
-
-                    # from idx, we eat wlen phones (+ any silence phone)
-                    begin = True
-
-                    while wlen > 0 and idx<len(utt_align):
-                        aligned = utt_align[idx]
-                        if aligned.split()[-1] in self.corpus.silences:
-                            words.append('{}'.format(aligned))
-                        else:
-                            words.append('{} {}'.format(
-                                aligned, word if begin else ''))
-                            wlen -= 1
-                            begin = False
-                        idx += 1
-        except IndexError:
-            Parallel(self.njobs)(
-                delayed(dtw)([aligned.split(' ')[-1]
-                                          for aligned in utt_align],
-                                          list_phones[utt_id],
-                                          word_pos[utt_id], utt_align)
-                                         for utt_id, utt_align in utts)
-            t1=time.time()
-            print "dtw took",t1-t0
-        return words
-
-    def _export_words(self, int2phone, ali, post):
+        """
+        todo = [n for n, utt in enumerate(chunk) if isinstance(utt, tuple)]
+        if todo:
+            self.log.debug(
+                'recovering words by DTW on %s utterances', len(todo))
+            # a job process is worth it only for large DTW matrices
+            cells = sum(len(chunk[n][0]) * len(chunk[n][1]) for n in todo)
+            njobs = max(1, min(self.njobs, cells // self._dtw_job_cells))
+            groups = [[chunk[n] for n in todo[k::njobs]]
+                      for k in range(njobs)]
+            if njobs == 1:
+                results = [word_alignments(groups[0])]
+            else:
+                results = Parallel(n_jobs=njobs)(
+                    delayed(word_alignments)(group) for group in groups)
+
+            for k, result in enumerate(results):
+                for n, lines in zip(todo[k::njobs], result):
+                    chunk[n] = lines
+
+        for lines in chunk:
+            for line in lines:
+                yield line
+
+    def _export_words(self, phones):
         """Export alignment at word level only"""
-        return [w for w in self._read_words(
-            self._export_phones_and_words(int2phone, ali, post))]
+        return self._read_words(self._export_phones_and_words(phones))
 
     @staticmethod
     def phone_word_dtw(self, utt_align, text):
@@ -424,7 +481,6 @@ class Align(abstract_recipe.AbstractRecipe):
 
         list_phones = []
         word_pos = []
-        word_alignment = []
         alignment = [aligned.split(' ')[-1] for aligned in utt_align]
 
         # create list of all the phones using the lexicon
@@ -435,61 +491,7 @@ class Align(abstract_recipe.AbstractRecipe):
             except KeyError:
                 continue
 
-        # init dtw matrix
-        dtw = np.zeros((len(alignment),len(list_phones)))
-        dtw[0,:] = np.inf
-        dtw[:,0] = np.inf
-        dtw[0,0] = 0
-
-        # compute dtw costs
-        for i in range(1,len(alignment)):
-            for j in range(1,len(list_phones)):
-                cost = int(not alignment[i] == list_phones[j])
-                dtw[i,j] = cost + min([dtw[i-1,j], dtw[i,j-1], dtw[i-1, j-1]])
-        word_alignment.append(word_pos[-1])
-
-        # go backward to get the best path
-        i = len(alignment) - 1
-        j = len(list_phones) - 1
-        path = []
-        while (not i == 0 and not j == 0):
-            options = [dtw[i-1,j], dtw[i,j-1], dtw[i-1, j-1]]
-            idx, val = min(enumerate(options), key=itemgetter(1))
-            if idx == 0:
-                i = i-1
-                word_alignment.append(word_pos[j])
-                path.append((i,j,word_pos[j]))
-                continue
-            elif idx == 1:
-                word_alignment.pop()
-                word_alignment.append(word_pos[j-1])
-                j = j-1
-                path.append((i,j,word_pos[j]))
-                continue
-            elif idx == 2:
-                word_alignment.append(word_pos[j-1])
-                i = i-1
-                j = j-1
-                path.append((i,j,word_pos[j]))
-                continue
-
-        # return alignment with words
-        word_alignment.reverse()
-
-        prev_word = ''
-        complete_alignment = []
-        for utt,word in zip(utt_align, word_alignment):
-            if word == prev_word:
-                prev_word = word
-                complete_alignment.append(utt)
-                continue
-            else:
-                prev_word = word
-                complete_alignment.append(u'{} {}'.format(utt,word))
-
-        #complete_alignment = ['{} {}'.format(utt,word)
-        #        for utt, word in zip(utt_align,word_alignment)]
-        return complete_alignment
+        return dtw(alignment, list_phones, word_pos, utt_align)
 
 
 class AlignNoLattice(Align):
@@ -504,6 +506,10 @@ class AlignNoLattice(Align):
             self.with_posteriors = False
 
     def run(self):
+        self._checkpoint('align_fmllr', self._align_fmllr_best)
+        self._checkpoint('ali_to_phones', self._ali_to_phones)
+
+    def _align_fmllr_best(self):
         self._align_fmllr()
 
         # the previous script output ali.*.gz instead of lats.*.gz, rename
@@ -514,7 +520,93 @@ class AlignNoLattice(Align):
                 os.path.join(path, ali_file),
                 os.path.join(path, ali_file.replace('ali', 'best')))
 
-        self._ali_to_phones()
+
+def read_alignment(ali_file, post_file, phonemap,
+                   first_frame_center_time=.0125, frame_width=0.025,
+                   frame_spacing=0.01):
+    """Yield the phone alignment lines decoded from a Kaldi job output
+
+    ali_file : the gzipped text ark written by ali-to-phones
+        --write_lengths, each line is 'utt phone nframes ; phone
+        nframes ; ...'
+
+    post_file : the binary ark of the per-frame phone posteriors
+        written by post-to-phone-post, in the same order of
+        utterances, or None
+
+    phonemap : a list of the phones indexed by their Kaldi code
+
+    The timestamps are computed from the centers of the frames (as
+    specified when computing the features). Yield 'utt tstart tstop
+    [post] phone' lines, the posterior being the mean over the frames
+    of the phone of its posterior on each frame (0 on the frames it
+    has no posterior). The files are read in streaming.
+
+    """
+    def _next_posterior(utt_id):
+        # a bare next() would silently stop the generator
+        post = next(posts, None)
+        if post is None:
+            raise IOError('utterance {} missing in {}'.format(
+                utt_id, post_file))
+        if post[0] != utt_id:
+            raise IOError(
+                'utterances mismatch in {} and {}: {} != {}'.format(
+                    ali_file, post_file, utt_id, post[0]))
+        return post[1]
+
+    posts = read_posteriors(post_file) if post_file else None
+    for utt_id, runs in _read_ark(ali_file):
+        runs = np.fromstring(
+            runs.replace(';', ' '), dtype=np.int64, sep=' ').reshape((-1, 2))
+        phones, nframes = runs[:, 0], runs[:, 1]
+        if not len(runs):
+            if posts is not None:
+                _next_posterior(utt_id)
+            continue
+        ends = np.cumsum(nframes)
+
+        # a phone stops at half the spacing after its last frame
+        # center, the last one at the end of its last frame
+        stops = first_frame_center_time + frame_spacing * (ends - 0.5)
+        stops[-1] = (first_frame_center_time + frame_spacing * (ends[-1] - 1)
+                     + frame_width / 2.)
+        starts = np.concatenate(
+            ([first_frame_center_time - frame_width / 2.], stops[:-1]))
+
+        columns = [starts.tolist(), stops.tolist()]
+        if posts is not None:
+            frames, ids, weights = _next_posterior(utt_id)
+
+            # the per-frame aligned phones, by run-length expansion,
+            # and their posteriors on each frame
+            frames = frames[frames < ends[-1]]
+            aligned = ids[:len(frames)] == np.repeat(phones, nframes)[frames]
+            post = np.bincount(
+                frames[aligned], weights=weights[:len(frames)][aligned],
+                minlength=ends[-1])
+            columns.append((np.add.reduceat(post, ends - nframes)
+                            / nframes).tolist())
+
+        for i, code in enumerate(phones.tolist()):
+            yield u'{} {} {}'.format(
+                utt_id, ' '.join(str(c[i]) for c in columns), phonemap[code])
+
+
+def _read_ark(ark_file):
+    """Yield (utt_id, content) for each line of a gzipped text ark"""
+    with gzip.open(ark_file, 'r') as fin:
+        for line in fin:
+            line = line.decode('utf8').strip().split(None, 1)
+            if line:
+                yield line[0], line[1] if len(line) == 2 else ''
+
+
+def _write_alignment(output, ali_file, post_file, phonemap):
+    """Write the lines of read_alignment in `output`"""
+    with utils.open_utf8(output, 'w') as out:
+        for line in read_alignment(ali_file, post_file, phonemap):
+            out.write(line + u'\n')
 
 
 def utterances_posterior_scoring(alignment_file, score_fun=np.prod):
@@ -526,6 +618,7 @@ def utterances_posterior_scoring(alignment_file, score_fun=np.prod):
     :param alignmement_file: The path to an alignment file with
       posteriors.  Each line in the must must be: "utt-id tstart tstop
       posterior phone [word]", we consider only column 1 and column 4.
+      A binary alignment file with posteriors is read directly.
 
     :param score_fun: any function (list of floats) -> float
 
@@ -533,6 +626,15 @@ def utterances_posterior_scoring(alignment_file, score_fun=np.prod):
       score for each utterance defined in the alignment file.
 
     """
+    if binary.is_binary(alignment_file):
+        with binary.BinaryAlignment(alignment_file) as alignment:
+            if not alignment.with_posteriors:
+                raise IOError('{}: no posteriors in the alignment file'
+                              .format(alignment_file))
+            for utt, rows in alignment:
+                yield utt, score_fun(rows.posterior.tolist())
+        return
+
     for utt, alignment in Align._read_utts(alignment_file):
         posteriors = [float(line.split(' ')[3]) for line in alignment]
         yield utt, score_fun(posteriors)
@@ -0,0 +1,339 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Binary alignment files
+
+The text alignment files have a line 'utt tstart tstop [post] phone
+[word]' per aligned phone (or 'utt tstart tstop word' per aligned word
+for word level alignments). The binary alignment files store the same
+data by columns in a HDF5 file:
+
+* tstart, tstop and posterior (if any) as float32 datasets with one
+  row per line,
+
+* phone and word as int32 datasets coding the phones and words in the
+  'phones' and 'words' vocabularies, the word is -1 on the rows
+  without word,
+
+* the utterances ids, their first row in 'offsets' (with the total
+  number of rows appended) and their speakers (if known).
+
+The BinaryAlignment class gives access to the rows of an utterance,
+of a speaker or of a phone. The write_binary, text2binary and
+binary2text functions convert between the two formats.
+
+"""
+
+import h5py
+import numpy as np
+
+import abkhazia.utils as utils
+
+
+_STR = h5py.special_dtype(vlen=unicode)
+"""The HDF5 type of the utterances, speakers, phones and words"""
+
+_LEVELS = ('phones', 'words', 'both')
+"""The alignment levels, as in Align.level"""
+
+
+def is_binary(alignment_file):
+    """Return True if `alignment_file` is a binary alignment file"""
+    return h5py.is_hdf5(alignment_file)
+
+
+def columns(level, with_posteriors=False):
+    """Return the names of the columns of a `level` alignment"""
+    if level not in _LEVELS:
+        raise IOError('unknown alignment level {}, choose in {}'.format(
+            level, ', '.join(_LEVELS)))
+    return (['tstart', 'tstop']
+            + (['posterior'] if with_posteriors else [])
+            + {'phones': ['phone'], 'words': ['word'],
+               'both': ['phone', 'word']}[level])
+
+
+def write_binary(lines, alignment_file, level='both', with_posteriors=False,
+                 utt2spk=None, chunk_size=100000):
+    """Write the text alignment `lines` to a binary `alignment_file`
+
+    lines : an iterable of text alignment lines, the lines of an
+        utterance must be contiguous
+
+    level : the level of the alignment, 'phones', 'words' or 'both'
+
+    with_posteriors : True if the lines have posteriors
+
+    utt2spk : an optional dict utterance -> speaker, when given the
+        speakers can be selected from the binary file
+
+    chunk_size : the number of rows buffered before being written
+
+    Raise IOError if a line is badly formatted or if the lines of an
+    utterance are not contiguous.
+
+    """
+    names = columns(level, with_posteriors)
+    nfloats = 3 if with_posteriors else 2
+    vocabularies = {'phone': {}, 'word': {}}
+    utterances, offsets = [], [0]
+    seen = set()
+    buffers = {name: [] for name in names}
+
+    with h5py.File(alignment_file, 'w') as h5:
+        h5.attrs['level'] = level
+        h5.attrs['with_posteriors'] = with_posteriors
+        for name in names:
+            h5.create_dataset(
+                name, (0,), maxshape=(None,), chunks=(chunk_size,),
+                dtype=np.float32 if name.startswith('t')
+                or name == 'posterior' else np.int32)
+
+        def _flush():
+            for name in names:
+                data = h5[name]
+                data.resize((len(data) + len(buffers[name]),))
+                data[len(data) - len(buffers[name]):] = buffers[name]
+                del buffers[name][:]
+
+        nrows = 0
+        for line in lines:
+            fields = line.split()
+            if not fields:
+                continue
+
+            utt_id = fields[0]
+            if not utterances or utterances[-1] != utt_id:
+                if utt_id in seen:
+                    raise IOError(
+                        'lines of utterance {} are not contiguous'
+                        .format(utt_id))
+                seen.add(utt_id)
+                utterances.append(utt_id)
+                offsets.append(nrows)
+
+            labels = fields[1 + nfloats:]
+            if len(labels) not in (1, 2 if level == 'both' else 1):
+                raise IOError('bad alignment line: {}'.format(line))
+            try:
+                for name, value in zip(names, fields[1:1 + nfloats]):
+                    buffers[name].append(float(value))
+            except ValueError:
+                raise IOError('bad alignment line: {}'.format(line))
+
+            if level != 'words':
+                buffers['phone'].append(
+                    vocabularies['phone'].setdefault(
+                        labels[0], len(vocabularies['phone'])))
+            if level != 'phones':
+                buffers['word'].append(
+                    vocabularies['word'].setdefault(
+                        labels[-1], len(vocabularies['word']))
+                    if len(labels) == 2 or level == 'words' else -1)
+
+            nrows += 1
+            if len(buffers[names[0]]) == chunk_size:
+                _flush()
+        _flush()
+
+        # the offsets are the first row of each utterance, the number
+        # of rows closes the last one
+        offsets = offsets[1:] + [nrows]
+        h5.create_dataset(
+            'utterances', data=np.asarray(utterances, dtype=object),
+            dtype=_STR)
+        h5.create_dataset('offsets', data=np.asarray(offsets, dtype=np.int64))
+        if utt2spk is not None:
+            h5.create_dataset(
+                'speakers', dtype=_STR, data=np.asarray(
+                    [utt2spk[u] for u in utterances], dtype=object))
+        for name, vocabulary in vocabularies.iteritems():
+            if name in names:
+                words = [None] * len(vocabulary)
+                for word, code in vocabulary.iteritems():
+                    words[code] = word
+                h5.create_dataset(
+                    name + 's', data=np.asarray(words, dtype=object),
+                    dtype=_STR)
+
+
+def text2binary(text_file, binary_file, level='both', with_posteriors=False,
+                utt2spk=None):
+    """Convert a text alignment file to binary, see write_binary"""
+    with utils.open_utf8(text_file, 'r') as lines:
+        write_binary(lines, binary_file, level=level,
+                     with_posteriors=with_posteriors, utt2spk=utt2spk)
+
+
+def binary2text(binary_file, text_file):
+    """Convert a binary alignment file to text"""
+    with BinaryAlignment(binary_file) as alignment:
+        with utils.open_utf8(text_file, 'w') as fout:
+            for line in alignment.lines():
+                fout.write(line + u'\n')
+
+
+class BinaryAlignment(object):
+    """Read access to a binary alignment file
+
+    The rows of the alignment are returned as numpy record arrays
+    with a field per column, as listed in `columns`, and the phones
+    and words coded as integers in the `phones` and `words` lists.
+
+    Parameters:
+    -----------
+
+    alignment_file (str): the binary alignment file to read
+
+    chunk_size (int): the number of rows read at once when iterating
+        on the utterances
+
+    Example:
+    --------
+
+    >>> with BinaryAlignment('alignment.h5') as alignment:
+    ...     rows = alignment['utt1']
+    ...     durations = rows.tstop - rows.tstart
+    ...     for utt_id, rows in alignment.speaker('spk1'):
+    ...         pass
+
+    Iterating on the alignment yields (utt_id, rows) pairs in the
+    order of the file.
+
+    """
+    def __init__(self, alignment_file, chunk_size=100000):
+        self.alignment_file = alignment_file
+        self.chunk_size = chunk_size
+
+        self._h5 = h5py.File(alignment_file, 'r')
+        try:
+            self.level = self._h5.attrs['level']
+            self.with_posteriors = bool(self._h5.attrs['with_posteriors'])
+            self.columns = columns(self.level, self.with_posteriors)
+            self.utterances = list(self._h5['utterances'][...])
+            self._offsets = self._h5['offsets'][...]
+        except KeyError as err:
+            self._h5.close()
+            raise IOError('{}: not an alignment file, {}'.format(
+                alignment_file, err))
+
+        self.speakers = self._read_list('speakers')
+        self.phones = self._read_list('phones')
+        self.words = self._read_list('words')
+        self._index = {utt: n for n, utt in enumerate(self.utterances)}
+
+    def _read_list(self, name):
+        return list(self._h5[name][...]) if name in self._h5 else None
+
+    def close(self):
+        self._h5.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.utterances)
+
+    def __contains__(self, utt_id):
+        return utt_id in self._index
+
+    def __getitem__(self, utt_id):
+        """Return the rows of the utterance `utt_id`"""
+        n = self._index[utt_id]
+        return self.rows(self._offsets[n], self._offsets[n + 1])
+
+    def __iter__(self):
+        """Yield (utt_id, rows) for all the utterances, in order"""
+        return self._iter_utterances(range(len(self.utterances)))
+
+    def rows(self, start, stop):
+        """Return the rows in [start, stop) as a record array"""
+        return np.rec.fromarrays(
+            [self._h5[name][start:stop] for name in self.columns],
+            names=self.columns)
+
+    def speaker(self, speaker):
+        """Yield (utt_id, rows) for the utterances of `speaker`
+
+        Raise IOError if the speakers are not stored in the file.
+
+        """
+        if self.speakers is None:
+            raise IOError('{}: no speakers in the alignment file'.format(
+                self.alignment_file))
+        return self._iter_utterances(
+            [n for n, spk in enumerate(self.speakers) if spk == speaker])
+
+    def phone(self, phone):
+        """Return (utterances, rows) for all the rows of `phone`
+
+        `utterances` is the list of the utterance of each row. Raise
+        IOError if the phones are not stored in the file.
+
+        """
+        if self.phones is None:
+            raise IOError('{}: no phones in the alignment file'.format(
+                self.alignment_file))
+        try:
+            code = self.phones.index(phone)
+        except ValueError:
+            return [], self.rows(0, 0)
+
+        index = np.flatnonzero(self._h5['phone'][...] == code)
+        utts = np.searchsorted(self._offsets, index, side='right') - 1
+        rows = np.rec.fromarrays(
+            [self._h5[name][...][index] for name in self.columns],
+            names=self.columns)
+        return [self.utterances[n] for n in utts.tolist()], rows
+
+    def lines(self):
+        """Yield the alignment as text lines"""
+        # the words are indexed by -1 on the rows without word
+        labels = {'phone': np.asarray(self.phones or [], dtype=object),
+                  'word': np.asarray((self.words or []) + [u''],
+                                     dtype=object)}
+
+        for utt_id, rows in self:
+            # the floats are written in their shortest representation
+            fields = [labels[name][rows[name]] if name in labels
+                      else map(str, rows[name]) for name in self.columns]
+            for line in zip(*fields):
+                yield u' '.join((utt_id,) + line).rstrip()
+
+    def _iter_utterances(self, utterances):
+        """Yield (utt_id, rows) for the utterances given by index
+
+        The rows are read by chunks of consecutive utterances.
+
+        """
+        utterances = list(utterances)
+        i = 0
+        while i < len(utterances):
+            # take the consecutive utterances fitting in a chunk
+            first = last = utterances[i]
+            i += 1
+            while (i < len(utterances) and utterances[i] == last + 1 and
+                   self._offsets[last + 2] - self._offsets[first]
+                   <= self.chunk_size):
+                last = utterances[i]
+                i += 1
+
+            start = self._offsets[first]
+            chunk = self.rows(start, self._offsets[last + 1])
+            for n in range(first, last + 1):
+                yield self.utterances[n], chunk[
+                    self._offsets[n] - start:self._offsets[n + 1] - start]
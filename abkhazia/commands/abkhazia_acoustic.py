@@ -140,7 +140,7 @@ class _AmBase(AbstractKaldiCommand):
                 pass
 
         # finally train the acoustic model
-        recipe.compute()
+        cls._compute(recipe, args)
 
 
 class _AmMono(_AmBase):
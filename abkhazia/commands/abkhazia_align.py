@@ -59,6 +59,10 @@ class AbkhaziaAlign(AbstractKaldiCommand):
         out_group = parser.add_argument_group('alignment format', description=(
             'by default the output alignement file is phone aligned and '
             'include both words and phones'))
+        out_group.add_argument(
+            '--binary', action='store_true',
+            help='write the alignment in the binary file alignment.h5 '
+            'instead of the text file alignment.txt')
         out_group = out_group.add_mutually_exclusive_group()
         out_group.add_argument(
             '--phones-only', action='store_true',
@@ -127,6 +131,7 @@ class AbkhaziaAlign(AbstractKaldiCommand):
         recipe.njobs = args.njobs
         recipe.level = level
         recipe.with_posteriors = args.post
+        recipe.binary = args.binary
         recipe.acoustic_scale = args.acoustic_scale
         recipe.lm_dir = lang
         recipe.feat_dir = feat
@@ -134,6 +139,4 @@ class AbkhaziaAlign(AbstractKaldiCommand):
         recipe.delete_recipe = False if args.recipe else True
 
         # finally compute the alignments
-        recipe.create()
-        recipe.run()
-        recipe.export()
+        cls._compute(recipe, args)
@@ -105,7 +105,7 @@ class _DecodeBase(AbstractKaldiCommand):
                 pass
 
         # finally decode the corpus
-        recipe.compute()
+        cls._compute(recipe, args)
 
 
 class _DecodeSi(_DecodeBase):
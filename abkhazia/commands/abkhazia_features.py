@@ -66,6 +66,12 @@ class _FeatBase(AbstractKaldiCommand):
             delta-order is set to 0, deltas are not computed. Default
             is %(default)s.""")
 
+        parser.add_argument(
+            '--backend', choices=['kaldi', 'numpy'], default='kaldi',
+            help="""compute the features with the Kaldi executables or
+            in process with numpy (no pitch support), default is
+            %(default)s""")
+
         cls.add_kaldi_options(
             parser.add_argument_group(
                 '{} features options'.format(cls.feat_name)))
@@ -107,17 +113,19 @@ class _FeatBase(AbstractKaldiCommand):
         recipe.use_pitch = utils.str2bool(args.pitch)  # 'true' to True
         recipe.use_cmvn = utils.str2bool(args.cmvn)
         recipe.delta_order = args.delta_order
+        recipe.backend = args.backend
         recipe.features_options = cls.parsed_options
         recipe.njobs = args.njobs
         recipe.delete_recipe = False if args.recipe else True
-        recipe.compute()
+        cls._compute(recipe, args)
 
         # export to h5features if asked for
         if args.h5f:
             recipe.log.info('exporting Kaldi ark features to h5features...')
             kaldi.scp_to_h5f(
                 os.path.join(recipe.output_dir, 'feats.scp'),
-                os.path.join(recipe.output_dir, 'feats.h5f'))
+                os.path.join(recipe.output_dir, 'feats.h5f'),
+                njobs=args.njobs, log=recipe.log)
 
 
 class _FeatMfcc(_FeatBase):
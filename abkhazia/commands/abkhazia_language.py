@@ -74,4 +74,4 @@ class AbkhaziaLanguage(AbstractKaldiCommand):
             position_dependent_phones=args.word_position_dependent,
             silence_probability=args.silence_probability)
         recipe.delete_recipe = False if args.recipe else True
-        recipe.compute()
+        cls._compute(recipe, args)
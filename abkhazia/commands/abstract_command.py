@@ -178,6 +178,9 @@ class AbstractCoreCommand(AbstractCommand):
         if name is None:
             name = cls.name
 
+        if getattr(args, 'resume', False) and args.force:
+            raise IOError('options --force and --resume are incompatible')
+
         _input = cls._parse_corpus_dir(args.corpus)
         _output = cls._parse_output_dir(
             args.output_dir, _input, name, args.force)
@@ -196,7 +199,10 @@ class AbstractKaldiCommand(AbstractCoreCommand):
     """Base class for commands relying on Kaldi recipes
 
     Adds a --recipe option that do not remove the Kaldi recipe
-    directory and a --njobs option for parallel processing
+    directory, a --njobs option for parallel processing, a --profile
+    option displaying the resources used by the recipe, a --no-cache
+    option disabling the results cache and a --resume option
+    continuing a failed recipe
 
     """
     @classmethod
@@ -224,4 +230,35 @@ class AbstractKaldiCommand(AbstractCoreCommand):
             min(<njobs>, corpus.nspeakers). Default is to launch
             %(default)s jobs.""")
 
+        # add a --profile option
+        parser.add_argument(
+            '--profile', action='store_true', help="""
+            print a summary of the time, memory and disk usage of the
+            recipe, the detailed profile is always saved in
+            <output_dir>/profile.json""")
+
+        # add a --no-cache option
+        parser.add_argument(
+            '--no-cache', action='store_true', help="""
+            do not restore the results from the cache, nor store them
+            in it, even if a cache directory is configured""")
+
+        # add a --resume option
+        parser.add_argument(
+            '--resume', action='store_true', help="""
+            continue a failed computation from the last completed stage,
+            the recipe of a failed computation is kept in
+            <output_dir>/recipe""")
+
         return parser, dir_group
+
+    @staticmethod
+    def _compute(recipe, args):
+        """Compute the `recipe`, print its profile if --profile is set"""
+        recipe.use_cache = not args.no_cache
+        recipe.resume = args.resume
+        try:
+            recipe.compute()
+        finally:
+            if args.profile:
+                print recipe.profiler.summary()
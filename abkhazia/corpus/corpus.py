@@ -16,6 +16,7 @@
 # along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
 """Provides the Corpus class"""
 
+import hashlib
 import os
 
 from abkhazia.corpus.corpus_saver import CorpusSaver
@@ -28,6 +29,17 @@ from abkhazia.corpus.corpus_trimmer import CorpusTrimmer
 import abkhazia.utils as utils
 
 
+def _tracked(name):
+    """Return a property storing the assigned dicts as utils.TrackedDict"""
+    attr = '_' + name
+
+    def _set(self, value):
+        setattr(self, attr, value if isinstance(value, utils.TrackedDict)
+                else utils.TrackedDict(value))
+
+    return property(lambda self: getattr(self, attr), _set)
+
+
 class Corpus(utils.abkhazia_base.AbkhaziaBase):
     """Speech corpus in the abkhazia format
 
@@ -96,25 +108,43 @@ class Corpus(utils.abkhazia_base.AbkhaziaBase):
     - alternative phones variants (not yet implemented)
     - exemple: []
 
+    Derived views
+    =============
+
+    The views derived from segments, utt2spk and wav_folder (namely
+    spk2utt, wav2utt, overlaps and utt2duration) are computed once and
+    cached until their source data is modified. To make this possible,
+    segments and utt2spk are stored as utils.TrackedDict, so assigning
+    a dict to them stores a copy. The returned views are shared
+    between calls and must not be modified.
+
     """
 
     @classmethod
-    def load(cls, corpus_dir, validate=False, log=utils.logger.null_logger()):
+    def load(cls, corpus_dir, validate=False, use_cache=True,
+             log=utils.logger.null_logger()):
         """Return a corpus initialized from `corpus_dir`
 
         If validate is True, make sure the corpus is valid before
         returning it.
 
+        If use_cache is True, load the corpus from its binary cache
+        when it is up to date with the text files.
+
         Raise IOError if corpus_dir if an invalid directory, the
         output corpus is not validated.
 
         """
-        return CorpusLoader.load(cls, corpus_dir, validate=validate, log=log)
+        return CorpusLoader.load(
+            cls, corpus_dir, validate=validate, use_cache=use_cache, log=log)
 
     def __init__(self, log=utils.logger.null_logger()):
         """Initialize an empty corpus"""
         super(Corpus, self).__init__(log=log)
 
+        # cached derived views, see the _view() method
+        self._views = {}
+
         self.wav_folder = ''
         self.wavs = set()
         self.lexicon = dict()
@@ -125,7 +155,46 @@ class Corpus(utils.abkhazia_base.AbkhaziaBase):
         self.silences = []
         self.variants = []
 
-    def save(self, path, no_wavs=False, copy_wavs=True, force=False):
+        # metadata on the wavs, see the wav_index() method
+        self._wav_index = None
+
+        # the directory the corpus is loaded from, None if built in
+        # memory. The Kaldi data of the corpus is stored there (see
+        # kaldi.KaldiData)
+        self.directory = None
+
+    # the dicts the views and fingerprint are derived from
+    segments = _tracked('segments')
+    utt2spk = _tracked('utt2spk')
+    text = _tracked('text')
+    lexicon = _tracked('lexicon')
+    phones = _tracked('phones')
+
+    def _view(self, name, compute, *sources):
+        """Return the derived view `name`, cached until `sources` change
+
+        `compute` is a function with no argument returning the view,
+        `sources` are the data the view is derived from, either
+        utils.TrackedDict instances or immutable values. The view is
+        computed again only if a source has been replaced or modified
+        since the last call.
+
+        """
+        key = tuple((src, getattr(src, 'version', None)) for src in sources)
+        try:
+            cached_key, value = self._views[name]
+            if all((a is b and va == vb) if va is not None else a == b
+                   for (a, va), (b, vb) in zip(cached_key, key)):
+                return value
+        except KeyError:
+            pass
+
+        value = compute()
+        self._views[name] = (key, value)
+        return value
+
+    def save(self, path, no_wavs=False, copy_wavs=True, force=False,
+             binary_cache=True):
         """Save the corpus to the directory `path`
 
         :param str path: The output directory is assumed to be a non
@@ -140,6 +209,9 @@ class Corpus(utils.abkhazia_base.AbkhaziaBase):
         :param bool force: when True, overwrite `path` if it is
             already existing
 
+        :param bool binary_cache: when True, write a binary cache of
+            the corpus in `path`/cache, making Corpus.load faster
+
         :raise: OSError if force=False and `path` already exists
 
         """
@@ -149,7 +221,8 @@ class Corpus(utils.abkhazia_base.AbkhaziaBase):
             self.log.warning('overwriting existing path: %s', path)
             utils.remove(path)
 
-        CorpusSaver.save(self, path, no_wavs=no_wavs, copy_wavs=copy_wavs)
+        CorpusSaver.save(self, path, no_wavs=no_wavs, copy_wavs=copy_wavs,
+                         binary_cache=binary_cache)
 
     def validate(self, njobs=utils.default_njobs()):
         """Validate speech corpus data
@@ -184,6 +257,9 @@ class Corpus(utils.abkhazia_base.AbkhaziaBase):
         egs/wsj/s5/utils/utt2spk_to_spk2utt.pl.
 
         """
+        return self._view('spk2utt', self._spk2utt, self.utt2spk)
+
+    def _spk2utt(self):
         # init an empty list for all speakers
         spk2utt = {spk: [] for spk in set(self.utt2spk.itervalues())}
 
@@ -199,28 +275,89 @@ class Corpus(utils.abkhazia_base.AbkhaziaBase):
         tend). Built on self.segments.
 
         """
-        # init an empty list for all wavs
-        wav2utt = {wav: [] for wav, _, _ in self.segments.values()}
-
-        def _float(t):
-            return None if t is None else float(t)
+        return self._view('wav2utt', self._wav2utt, self.segments)
 
-        # populate lists with utterance ids and timestamps
+    def _wav2utt(self):
+        wav2utt = dict()
         for utt, (wav, tstart, tend) in self.segments.iteritems():
-            wav2utt[wav].append((utt, _float(tstart), _float(tend)))
+            wav2utt.setdefault(wav, []).append((
+                utt,
+                None if tstart is None else float(tstart),
+                None if tend is None else float(tend)))
         return wav2utt
 
+    def overlaps(self):
+        """Return a dict of wav-ids mapped to their overlapping utterances
+
+        The values of the returned dict are lists of tuples (utt1,
+        utt2, duration) where the utterances utt1 and utt2 overlap in
+        time during `duration` seconds, utt1 starting first. Only the
+        wavs with overlapping utterances are returned, the utterances
+        without timestamps are ignored. Built on self.wav2utt().
+
+        """
+        return self._view('overlaps', self._overlaps, self.segments)
+
+    def _overlaps(self):
+        overlaps = dict()
+        for wav, utts in self.wav2utt().iteritems():
+            utts = [u for u in utts if u[1] is not None and u[2] is not None]
+            if len(utts) < 2:
+                continue
+
+            first, second, duration = utils.overlapping_intervals(
+                [u[1] for u in utts], [u[2] for u in utts])
+            if duration.size:
+                overlaps[wav] = [
+                    (utts[i][0], utts[j][0], d) for i, j, d in zip(
+                        first.tolist(), second.tolist(), duration.tolist())]
+        return overlaps
+
+    def wav_index(self):
+        """Return the index of metadata on the corpus wavs
+
+        The returned utils.wav.WavIndex is persistent for corpora
+        loaded from (or saved to) a directory: the wav headers are
+        read only once and stored in the corpus directory. The index
+        is renewed when the wav_folder is changed.
+
+        """
+        if (self._wav_index is None or
+                self._wav_index.wav_folder != self.wav_folder):
+            self._wav_index = utils.wav.WavIndex(self.wav_folder)
+        return self._wav_index
+
+    def wav_metadata(self, wavs=None, njobs=1):
+        """Return a dict of wav-ids mapped to metadata on the wav file
+
+        The metadata are read from the corpus wav index (see the
+        wav_index method) for the wavs in `wavs` (default is all the
+        corpus wavs). See utils.wav.scan for details on the values.
+
+        """
+        return self.wav_index().scan(
+            self.wavs if wavs is None else wavs, njobs=njobs)
+
     def utt2duration(self):
         """Return a dict of utterances ids mapped to their duration
 
         Durations are floats expressed in second, read from wav files
 
         """
+        return self._view(
+            'utt2duration', self._utt2duration,
+            self.segments, self.wav_folder)
+
+    def _utt2duration(self):
+        # durations of the wavs containing a single utterance
+        meta = self.wav_metadata(
+            set(wav for wav, _, stop in self.segments.itervalues()
+                if stop is None))
+
         utt2dur = dict()
         for utt, (wav, start, stop) in self.segments.iteritems():
             start = 0 if start is None else start
-            wav_path = os.path.join(self.wav_folder, wav)
-            stop = utils.wav.duration(wav_path) if stop is None else stop
+            stop = meta[wav].duration if stop is None else stop
             utt2dur[utt] = stop - start
         return utt2dur
 
@@ -263,6 +400,51 @@ class Corpus(utils.abkhazia_base.AbkhaziaBase):
                 return True
         return False
 
+    def fingerprint(self):
+        """Return a hexadecimal hash of the corpus contents
+
+        The hash covers the corpus data (wavs, segments, text,
+        utt2spk, lexicon, phones, silences and variants) and the size
+        and modification time of the wav files. It does not depend on
+        the corpus location or metadata, so two copies of a corpus
+        have the same fingerprint.
+
+        The fingerprint is cached until the corpus data changes (see
+        the _view method), the wav files modified in the meantime are
+        not detected.
+
+        """
+        return self._view(
+            'fingerprint', self._fingerprint,
+            self.segments, self.text, self.utt2spk, self.lexicon,
+            self.phones, frozenset(self.wavs), tuple(self.silences),
+            tuple(self.variants), self.wav_folder)
+
+    def _fingerprint(self):
+        sha = hashlib.sha1()
+
+        def _update(name, items):
+            sha.update(name + '\0')
+            for item in items:
+                sha.update(u' '.join(
+                    u'{}'.format(i) for i in item).encode('utf8') + '\n')
+
+        def _stat(wav):
+            try:
+                info = os.stat(os.path.join(self.wav_folder, wav))
+                return info.st_size, int(info.st_mtime)
+            except OSError:
+                return None, None
+
+        _update('wavs', ((w,) + _stat(w) for w in sorted(self.wavs)))
+        _update('segments', ((u,) + tuple(s) for u, s in sorted(
+            self.segments.iteritems())))
+        for name in ('text', 'utt2spk', 'lexicon', 'phones'):
+            _update(name, sorted(getattr(self, name).iteritems()))
+        _update('silences', ((s,) for s in self.silences))
+        _update('variants', ((v,) for v in self.variants))
+        return sha.hexdigest()
+
     def subcorpus(self, utt_ids, prune=True, name=None, validate=True):
         """Return a subcorpus made of utterances in `utt_ids`
 
@@ -289,14 +471,18 @@ class Corpus(utils.abkhazia_base.AbkhaziaBase):
 
         corpus.wav_folder = self.wav_folder
         corpus.wavs = self.wavs
+        corpus._wav_index = self._wav_index
+
+        corpus.segments = {utt: self.segments[utt] for utt in utt_ids}
+        corpus.text = {utt: self.text[utt] for utt in utt_ids}
+        corpus.utt2spk = {utt: self.utt2spk[utt] for utt in utt_ids}
 
-        corpus.segments = dict()
-        corpus.text = dict()
-        corpus.utt2spk = dict()
-        for utt in utt_ids:
-            corpus.segments[utt] = self.segments[utt]
-            corpus.text[utt] = self.text[utt]
-            corpus.utt2spk[utt] = self.utt2spk[utt]
+        # durations are already known if computed on self
+        if 'utt2duration' in self._views:
+            utt2dur = self.utt2duration()
+            corpus._view(
+                'utt2duration', lambda: {u: utt2dur[u] for u in utt_ids},
+                corpus.segments, corpus.wav_folder)
 
         if prune:
             corpus.prune()
@@ -449,6 +635,7 @@ class Corpus(utils.abkhazia_base.AbkhaziaBase):
         corpus.meta.name = 'phonemized version of ' + self.meta.name
         corpus.wav_folder = self.wav_folder
         corpus.wavs = self.wavs
+        corpus._wav_index = self._wav_index
         corpus.segments = self.segments
         corpus.phones = self.phones
         corpus.utt2spk = self.utt2spk
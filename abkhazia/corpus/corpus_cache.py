@@ -0,0 +1,262 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Provides the CorpusCache class"""
+
+import os
+
+import numpy as np
+
+from abkhazia.utils import open_utf8, append_ext, remove
+
+
+class CorpusCache(object):
+    """Binary columnar cache of an abkhazia corpus directory
+
+    Parsing the text files of a big corpus (lexicon, segments, text,
+    utt2spk and phones) is slow. This class stores the same data in a
+    compact binary form, in the 'cache' subdirectory of a corpus:
+
+    - the strings (utterances, speakers, wavs, words, etc...) are
+      stored once in string tables, as newline terminated UTF-8 files,
+
+    - the relations between them (utt -> spk, utt -> wav) are stored
+      as arrays of integer indices in those tables,
+
+    - the segments timestamps are stored as float64 arrays, with NaN
+      for utterances without timestamps.
+
+    The numeric arrays are saved as .npy files and memory-mapped on
+    loading. The cache is used only if the text files it replaces
+    did not change since it was saved, see the is_fresh() method.
+
+    The cached values are normalized exactly as the CorpusLoader does
+    when parsing the text files, so loading a corpus from its cache
+    or from its text files gives the same result.
+
+    """
+    directory = 'cache'
+    """Name of the cache subdirectory in a corpus directory"""
+
+    version = '2'
+    """Version of the cache format, the cache is ignored on mismatch"""
+
+    cached_files = ('lexicon', 'phones', 'segments', 'text', 'utt2spk')
+    """The corpus text files replaced by the cache"""
+
+    wav_index = 'wavs_index.txt'
+    """Name of the wavs metadata index (see utils.wav.WavIndex)"""
+
+    @classmethod
+    def wav_index_file(cls, corpus_dir):
+        """Return the path to the wavs metadata index of `corpus_dir`"""
+        return os.path.join(corpus_dir, cls.directory, cls.wav_index)
+
+    @classmethod
+    def save(cls, corpus, corpus_dir):
+        """Write the cache of `corpus` in `corpus_dir`/cache
+
+        This method must be called after the text files have been
+        saved in `corpus_dir`, so that the cache is considered fresh.
+
+        """
+        path = os.path.join(corpus_dir, cls.directory)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        # the index is written last and removed first, so that an
+        # interrupted save leaves an unusable cache
+        index = os.path.join(path, 'index.txt')
+        remove(index, safe=True)
+
+        def _path(f):
+            return os.path.join(path, f)
+
+        # utterances are the union of all the utterance indexed data,
+        # missing values are indexed by -1 or masked out
+        utts = sorted(set(corpus.segments.keys())
+                      | set(corpus.text.keys())
+                      | set(corpus.utt2spk.keys()))
+        cls._save_strings(_path('utts.str'), utts)
+
+        spks, utt2spk = cls._intern(
+            [corpus.utt2spk.get(utt) for utt in utts])
+        cls._save_strings(_path('spks.str'), spks)
+        np.save(_path('utt2spk.npy'), utt2spk)
+
+        segments = [corpus.segments.get(utt) for utt in utts]
+        wavs, utt2wav = cls._intern(
+            [None if s is None else append_ext(s[0], '.wav')
+             for s in segments])
+        cls._save_strings(_path('wavs.str'), wavs)
+        np.save(_path('utt2wav.npy'), utt2wav)
+        np.save(_path('tstart.npy'), cls._times(segments, 1))
+        np.save(_path('tend.npy'), cls._times(segments, 2))
+
+        has_text = np.asarray([utt in corpus.text for utt in utts], dtype=bool)
+        np.save(_path('has_text.npy'), has_text)
+        cls._save_strings(_path('text.str'), (
+            u' '.join(corpus.text[utt].split())
+            for utt in utts if utt in corpus.text))
+
+        words = sorted(corpus.lexicon.keys())
+        cls._save_strings(_path('words.str'), words)
+        cls._save_strings(_path('prons.str'), (
+            u' '.join(corpus.lexicon[w].split()) for w in words))
+
+        phones = sorted(corpus.phones.keys())
+        cls._save_strings(_path('phones.str'), phones)
+        cls._save_strings(_path('ipas.str'), (
+            corpus.phones[p].split()[0] for p in phones))
+
+        with open(index, 'w') as out:
+            out.write('version {}\n'.format(cls.version))
+            out.write('utterances {}\n'.format(len(utts)))
+            for name, (size, mtime) in sorted(
+                    cls._stats(corpus_dir).iteritems()):
+                out.write('file {} {} {!r}\n'.format(name, size, mtime))
+
+    @classmethod
+    def is_fresh(cls, corpus_dir):
+        """Return True if the cache in `corpus_dir` can be loaded
+
+        The cache is fresh if it exists, has the expected version and
+        if the text files it replaces have the size and modification
+        time recorded when it was saved. Comparing the stats (and not
+        only the modification times with the cache ones) detects the
+        files modified within the time granularity of the filesystem.
+
+        """
+        index = os.path.join(corpus_dir, cls.directory, 'index.txt')
+        if not os.path.isfile(index):
+            return False
+
+        lines = [line.split() for line in open(index, 'r')]
+        try:
+            if lines[0][1] != cls.version:
+                return False
+            stats = {line[1]: (int(line[2]), float(line[3]))
+                     for line in lines if line[0] == 'file'}
+        except (IndexError, ValueError):
+            return False
+
+        try:
+            return stats == cls._stats(corpus_dir)
+        except OSError:  # a missing text file
+            return False
+
+    @classmethod
+    def _stats(cls, corpus_dir):
+        """Return the (size, mtime) of the text files replaced by the cache"""
+        stats = {}
+        for name in cls.cached_files:
+            stat = os.stat(os.path.join(corpus_dir, name + '.txt'))
+            stats[name] = (stat.st_size, stat.st_mtime)
+        return stats
+
+    @classmethod
+    def load(cls, corpus_dir):
+        """Return the cached data of `corpus_dir` as a dict
+
+        The returned dict has the keys 'lexicon', 'phones',
+        'segments', 'wavs', 'text' and 'utt2spk', with values
+        formatted as in the Corpus class.
+
+        Raise IOError if the cache is not fresh.
+
+        """
+        if not cls.is_fresh(corpus_dir):
+            raise IOError(
+                'no valid binary cache in {}'.format(corpus_dir))
+
+        path = os.path.join(corpus_dir, cls.directory)
+
+        def _path(f):
+            return os.path.join(path, f)
+
+        def _array(f):
+            return np.load(_path(f), mmap_mode='r')
+
+        utts = np.asarray(cls._load_strings(_path('utts.str')), dtype=object)
+        data = {}
+
+        # utt2spk
+        idx = _array('utt2spk.npy')
+        spks = np.asarray(cls._load_strings(_path('spks.str')), dtype=object)
+        mask = idx >= 0
+        data['utt2spk'] = dict(zip(
+            utts[mask].tolist(), spks[idx[mask]].tolist()))
+
+        # segments and wavs
+        idx = _array('utt2wav.npy')
+        wavs = np.asarray(cls._load_strings(_path('wavs.str')), dtype=object)
+        mask = idx >= 0
+        tstart = _array('tstart.npy')[mask].tolist()
+        tend = _array('tend.npy')[mask].tolist()
+        data['segments'] = {
+            utt: (wav, None, None) if start != start  # NaN
+            else (wav, start, stop) for utt, wav, start, stop in zip(
+                utts[mask].tolist(), wavs[idx[mask]].tolist(), tstart, tend)}
+        data['wavs'] = set(wavs[np.unique(idx[mask])].tolist())
+
+        # text
+        mask = _array('has_text.npy')
+        data['text'] = dict(zip(
+            utts[mask].tolist(), cls._load_strings(_path('text.str'))))
+
+        data['lexicon'] = dict(zip(
+            cls._load_strings(_path('words.str')),
+            cls._load_strings(_path('prons.str'))))
+
+        data['phones'] = dict(zip(
+            cls._load_strings(_path('phones.str')),
+            cls._load_strings(_path('ipas.str'))))
+
+        return data
+
+    @staticmethod
+    def _intern(values):
+        """Return (table, indices) from a list of str or None
+
+        `table` is the sorted list of unique strings in `values` and
+        `indices` a numpy array such as values[i] == table[indices[i]],
+        or indices[i] == -1 if values[i] is None.
+
+        """
+        table = sorted(set(v for v in values if v is not None))
+        position = {v: i for i, v in enumerate(table)}
+        position[None] = -1
+        return table, np.fromiter(
+            (position[v] for v in values), dtype=np.int32, count=len(values))
+
+    @staticmethod
+    def _times(segments, column):
+        """Return a float64 array of timestamps, NaN for None"""
+        return np.fromiter(
+            (np.nan if s is None or s[column] is None
+             # round-trip to str as in the segments.txt file
+             else float(u'{}'.format(s[column])) for s in segments),
+            dtype=np.float64, count=len(segments))
+
+    @staticmethod
+    def _save_strings(path, strings):
+        """Write `strings` as newline terminated UTF-8 lines"""
+        with open_utf8(path, 'w') as out:
+            out.write(u''.join(u'{}\n'.format(s) for s in strings))
+
+    @staticmethod
+    def _load_strings(path):
+        """Return the list of unicode strings stored in `path`"""
+        with open(path, 'rb') as fin:
+            return fin.read().decode('UTF-8').split(u'\n')[:-1]
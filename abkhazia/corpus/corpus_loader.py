@@ -16,6 +16,7 @@
 
 import os
 import abkhazia.utils as utils
+from abkhazia.corpus.corpus_cache import CorpusCache
 
 
 class CorpusLoader(object):
@@ -29,10 +30,15 @@ class CorpusLoader(object):
     """
 
     @classmethod
-    def load(cls, corpus_cls, corpus_dir,
-             validate=False, log=utils.logger.null_logger()):
+    def load(cls, corpus_cls, corpus_dir, validate=False,
+             use_cache=True, log=utils.logger.null_logger()):
         """Return a corpus initialized from `corpus_dir`
 
+        If `use_cache` is True and `corpus_dir` contains a binary
+        cache newer than the text files, the lexicon, segments, text,
+        phones and utt2spk are read from the cache (see CorpusCache),
+        else they are parsed from the text files.
+
         Raise IOError if corpus_dir if an invalid abkhazia corpus
         directory.
 
@@ -44,13 +50,29 @@ class CorpusLoader(object):
         corpus = corpus_cls()
         corpus.log = log
         corpus.meta = data['meta']
+        corpus.directory = os.path.abspath(corpus_dir)
         corpus.wav_folder = data['wavs']
-        corpus.lexicon = cls.load_lexicon(data['lexicon'])
-        corpus.segments, corpus.wavs = cls.load_segments(data['segments'])
-        corpus.text = cls.load_text(data['text'])
-        corpus.phones = cls.load_phones(data['phones'])
+        corpus._wav_index = utils.wav.WavIndex(
+            data['wavs'], CorpusCache.wav_index_file(corpus_dir))
+
+        if use_cache and CorpusCache.is_fresh(corpus_dir):
+            log.debug('loading corpus from binary cache')
+            cached = CorpusCache.load(corpus_dir)
+            corpus.lexicon = cached['lexicon']
+            corpus.segments = cached['segments']
+            corpus.wavs = cached['wavs']
+            corpus.text = cached['text']
+            corpus.phones = cached['phones']
+            corpus.utt2spk = cached['utt2spk']
+        else:
+            corpus.lexicon = cls.load_lexicon(data['lexicon'])
+            corpus.segments, corpus.wavs = cls.load_segments(
+                data['segments'])
+            corpus.text = cls.load_text(data['text'])
+            corpus.phones = cls.load_phones(data['phones'])
+            corpus.utt2spk = cls.load_utt2spk(data['utt2spk'])
+
         corpus.silences = cls.load_silences(data['silences'])
-        corpus.utt2spk = cls.load_utt2spk(data['utt2spk'])
         corpus.variants = cls.load_variants(data['variants'])
 
         if validate:
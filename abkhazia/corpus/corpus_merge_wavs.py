@@ -67,16 +67,6 @@ class CorpusMergeWavs(object):
                        self.size, len(self.speakers))
 
 
-    def get_wav_duration(self, wav):
-        with contextlib.closing(wave.open(wav, 'r')) as wav_file:
-            frames = wav_file.getnframes()
-            rate = wav_file.getframerate()
-        duration = frames / float(rate)
-        self.log.debug('wav file {} has a duration of {}'.format(wav,
-                                                                 duration))
-        return duration
-
-
     def get_per_spk_data(self):
         # get following corpus info per speaker:
         #   total duration
@@ -84,6 +74,7 @@ class CorpusMergeWavs(object):
         #   list of wav durs
         #   list of utts  
         self.spk_data = {'total_dur': {}, 'wavs': {}, 'wav_durs': {}, 'utts': {}}
+        wav_meta = self.corpus.wav_metadata()
         for spkr in self.speakers:
             spk_utts = [utt_id for utt_id, utt_speaker in self.utts
                                 if utt_speaker == spkr]
@@ -99,9 +90,8 @@ class CorpusMergeWavs(object):
             self.spk_data['wavs'][spkr] = wavs
             self.spk_data['wav_durs'][spkr] = []         
             for wav in wavs:
-                wav_path = os.path.join(self.corpus.wav_folder, wav)
-                duration = self.get_wav_duration(wav_path)
-                self.spk_data['wav_durs'][spkr].append(duration)
+                self.spk_data['wav_durs'][spkr].append(
+                    wav_meta[wav].duration)
 
 
     def merge_wavs(self, output_dir, padding=0.):
@@ -189,9 +179,9 @@ class CorpusMergeWavs(object):
         self.corpus.wavs = {spkr+'.wav' for spkr in self.speakers}
 
         # check that created file length is what we expect
+        wav_meta = self.corpus.wav_metadata()
         for wav in self.corpus.wavs:
-            wav_file = os.path.join(self.corpus.wav_folder, wav)
-            duration = self.get_wav_duration(wav_file)
+            duration = wav_meta[wav].duration
             print(duration)
             print(expected_duration[wav])
             assert abs(duration - expected_duration[wav]) < 1e-5, \
@@ -18,18 +18,23 @@ import os
 import shutil
 
 from abkhazia.utils import open_utf8, append_ext
+from abkhazia.corpus.corpus_cache import CorpusCache
 
 
 class CorpusSaver(object):
     """Save a corpus to a directory"""
     @classmethod
-    def save(cls, corpus, path, no_wavs=False, copy_wavs=True):
+    def save(cls, corpus, path, no_wavs=False, copy_wavs=True,
+             binary_cache=True):
         """Save the `corpus` to the directory `path`
 
         `path` is assumed to be a non existing directory.
 
         `corpus` is a instance of Corpus
 
+        If `binary_cache` is True, also write a binary cache of the
+        corpus in `path`/cache for faster loading (see CorpusCache).
+
         """
         if not os.path.exists(path):
             os.makedirs(path)
@@ -48,6 +53,16 @@ class CorpusSaver(object):
         cls.save_variants(corpus, _path('variants.txt'))
         corpus.meta.save(_path('meta.txt'))
 
+        # the wavs in `path` are the same as in the corpus (links or
+        # copies keeping mtime), so its wav index is still valid
+        if not no_wavs:
+            corpus.wav_index().save(
+                CorpusCache.wav_index_file(path), safe=True)
+
+        # must be written after the text files to be fresh
+        if binary_cache:
+            CorpusCache.save(corpus, path)
+
     @staticmethod
     def save_wavs(corpus, path, copy_wavs=False):
         """Save the corpus wavs in `path`
@@ -70,7 +85,7 @@ class CorpusSaver(object):
             os.makedirs(path)
             for w in corpus.wavs:
                 wav = os.path.realpath(os.path.join(corpus.wav_folder, w))
-                shutil.copy(wav, os.path.join(path, w))
+                shutil.copy2(wav, os.path.join(path, w))
         else:
             source = os.path.realpath(corpus.wav_folder)
             link_name = path
@@ -94,9 +94,10 @@ class CorpusSplit(object):
 
         train_utt_ids = []
         test_utt_ids = []
+        spk2utt = self.corpus.spk2utt()
         for speaker in self.speakers:
-            spk_utts = [utt_id for utt_id, utt_speaker in self.utts
-                        if utt_speaker == speaker]
+            # copy because the list is shuffled in place
+            spk_utts = list(spk2utt[speaker])
 
             # if len(spk_utts) <= 1:
             #     self.log.warning(
@@ -170,9 +171,9 @@ class CorpusSplit(object):
 
         train_utt_ids = []
         test_utt_ids = []
+        spk2utt = self.corpus.spk2utt()
         for speaker in self.speakers:
-            spk_utts = [utt_id for utt_id, utt_speaker in self.utts
-                        if utt_speaker == speaker]
+            spk_utts = spk2utt[speaker]
 
             if speaker in train_speakers:
                 train_utt_ids += spk_utts
@@ -15,9 +15,12 @@
 """Provides the CorpusValidation class"""
 
 import collections
+import multiprocessing.pool
 import os
 
-from abkhazia.utils import duplicates, logger, wav, default_njobs, append_ext
+import numpy as np
+
+from abkhazia.utils import duplicates, logger, default_njobs, append_ext
 
 
 def resume_list(l, n=10):
@@ -72,7 +75,7 @@ class CorpusValidation(object):
         returns without raising, this means the corpus is compatible
         with abkhazia.
 
-        Return metainformation on the wavs (from utils.wav.scan)
+        Return metainformation on the wavs (from Corpus.wav_metadata)
 
         If meta is not None, it is assumed that it comes from a
         previous call to validate(). This trick is used during
@@ -84,15 +87,12 @@ class CorpusValidation(object):
         if len(self.corpus.utts()) == 0:
             raise IOError('corpus is empty')
 
-        if meta is None:
-            meta = self.validate_wavs()
-        self.validate_segments(meta)
-
-        self.validate_speakers()
-        self.validate_transcription()
-
-        inventory = self.validate_phones()
-        self.validate_lexicon(inventory)
+        # the checks are grouped by dependency, the groups are
+        # independent and run concurrently
+        meta = self._run_concurrently(
+            lambda: self._validate_audio(meta),
+            lambda: (self.validate_speakers(), self.validate_transcription()),
+            lambda: self.validate_lexicon(self.validate_phones()))[0]
 
         self.log.debug("corpus validated: ready for use with abkhazia")
         self.log.info(
@@ -101,6 +101,33 @@ class CorpusValidation(object):
             self.corpus.duration(format='datetime'))
         return meta
 
+    def _run_concurrently(self, *checks):
+        """Call the functions in `checks` and return their results
+
+        The functions are called concurrently in up to `njobs`
+        threads. If several of them raise, the error of the first one
+        is raised, so the reported error does not depend on the
+        threads scheduling.
+
+        """
+        if self.njobs == 1 or len(checks) == 1:
+            return [check() for check in checks]
+
+        pool = multiprocessing.pool.ThreadPool(min(self.njobs, len(checks)))
+        try:
+            results = [pool.apply_async(check) for check in checks]
+            return [result.get() for result in results]
+        finally:
+            pool.close()
+            pool.join()
+
+    def _validate_audio(self, meta=None):
+        """Validate wavs (if `meta` is None) and segments, return meta"""
+        if meta is None:
+            meta = self.validate_wavs()
+        self.validate_segments(meta)
+        return meta
+
     def validate_wavs(self):
         """Corpus wavs must be mono 16KHz, 16 bit PCM"""
         self.log.debug("checking wavs")
@@ -126,9 +153,9 @@ class CorpusValidation(object):
                 "The following wavs do not exist: {}".format(
                     resume_list(not_here)))
 
-        # get meta information on the wavs
-        meta = wav.scan(wavs, njobs=self.njobs)
-        meta = {os.path.basename(k): v for k, v in meta.iteritems()}
+        # get meta information on the wavs, from the corpus wav index
+        # to avoid reading again the headers of unchanged files
+        meta = self.corpus.wav_metadata(njobs=self.njobs)
 
         missing_meta = set.difference(self.corpus.wavs, meta.keys())
         if missing_meta:
@@ -176,47 +203,39 @@ class CorpusValidation(object):
         """Checking utterances list in segments"""
         self.log.debug("checking segments")
         segments = self.corpus.segments
-        utt_ids = segments.keys()
-        utt_wavs = [w[0] for w in segments.values()]
-        starts = [w[1] for w in segments.values()]
-        stops = [w[2] for w in segments.values()]
+
+        # the wav-ids referenced in segments, with their utterances
+        wav2utt = self.corpus.wav2utt()
 
         # wav extension in segments
-        _no_wavs_extension = [w for w in utt_wavs if not w.endswith('.wav')]
+        _no_wavs_extension = [w for w in wav2utt if not w.endswith('.wav')]
         if _no_wavs_extension:
             raise IOError(
                 'There is wav-ids in segmetns without .wav extension: {}'
                 .format(resume_list(_no_wavs_extension)))
 
-        # unique utterance-ids
-        _duplicates = duplicates(utt_ids)
-        if _duplicates:
-            raise IOError(
-                "There is utterance-ids in segments used several times: {}"
-                .format(_duplicates))
+        # utterance-ids are unique by construction, as the keys of
+        # the segments dict
 
         # all referenced wavs are in wav folder
-        ref_wavs = set(utt_wavs)
-        missing_wavefiles = set.difference(ref_wavs, self.corpus.wavs)
+        missing_wavefiles = set.difference(set(wav2utt), self.corpus.wavs)
         if missing_wavefiles:
             raise IOError(
                 "The following wavefiles are referenced "
                 "in segments but are not in wavs {}"
                 .format(missing_wavefiles))
 
-        if(len(ref_wavs) == len(utt_wavs) and
-           all([e is None for e in starts]) and
-           all([e is None for e in stops])):
+        if(len(wav2utt) == len(segments) and
+           all(start is None and stop is None
+               for _, start, stop in segments.itervalues())):
             # simple case, with one utterance per file and no explicit
             # timestamps provided just get list of files that are very
             # short (less than 0.1s)
-            short_wavs = [utt_id for utt_id, w in zip(utt_ids, utt_wavs)
+            short_wavs = [utt_id for utt_id, (w, _, _) in segments.iteritems()
                           if meta[w].duration < self.wav_min_duration]
         else:
-            # more complicated case :find all utterances (plus
-            # timestamps) associated to each wavefile and for each
-            # wavefile, check consistency of the timestamps of all
-            # utterances inside it
+            # more complicated case : check the consistency of the
+            # timestamps of all the utterances, grouped by wavefile
             warning, short_wavs = self._check_timestamps(meta)
             if warning:
                 self.log.warning(
@@ -233,84 +252,65 @@ class CorpusValidation(object):
         """Checking speakers from corpus.utt2spk"""
         self.log.debug("checking speakers")
 
-        utt_ids_spk = self.corpus.utt2spk.keys()
-        speakers = self.corpus.utt2spk.values()
-        utt_ids = self.corpus.segments.keys()
+        # utterance-ids are unique by construction as dict keys, so
+        # the keys views are compared as sets, without sorting
+        utt2spk = self.corpus.utt2spk
+        utt_ids_spk = utt2spk.viewkeys()
+        utt_ids = self.corpus.segments.viewkeys()
 
         # same utterance-ids in segments and utt2spk
-        if sorted(utt_ids_spk) != sorted(utt_ids):
-            _duplicates = duplicates(utt_ids_spk)
-            if _duplicates:
-                raise IOError(
-                    "The following utterance-ids are used several times "
-                    "in utt2spk: {}".format(_duplicates))
-            else:
-                e_spk = set(utt_ids_spk)
-                e_seg = set(utt_ids)
-
-                self.log.debug(
-                    "Utterances in utt2spk that are not in segments: {}"
-                    .format(set.difference(e_spk, e_seg)))
+        if utt_ids_spk != utt_ids:
+            self.log.debug(
+                "Utterances in utt2spk that are not in segments: {}"
+                .format(set(utt_ids_spk - utt_ids)))
 
-                self.log.debug(
-                    "Utterances in segments that are not in utt2spk: {}"
-                    .format(set.difference(e_seg, e_spk)))
+            self.log.debug(
+                "Utterances in segments that are not in utt2spk: {}"
+                .format(set(utt_ids - utt_ids_spk)))
 
-                raise IOError(
-                    "Utterance-ids in segments and utt2spk are "
-                    "not consistent, see details in log")
+            raise IOError(
+                "Utterance-ids in segments and utt2spk are "
+                "not consistent, see details in log")
 
         # speaker ids must have a fixed length
-        default_len = len(speakers[0])
-        if not all([len(s) == default_len for s in speakers]):
+        lengths = set(len(s) for s in self.corpus.spks())
+        if len(lengths) > 1:
             self.log.debug(
                 "Speaker-ids length observed in utt2spk with associated "
                 "frequencies: {0}".format(
-                    collections.Counter([len(s) for s in speakers])))
+                    collections.Counter(
+                        [len(s) for s in utt2spk.itervalues()])))
 
             raise IOError(
                 "All speaker-ids must have the same length.")
 
         # each speaker id must be prefix of corresponding utterance-id
-        for utt, spk in zip(utt_ids, speakers):
-            if not utt[:default_len] == spk:
-                raise IOError(
-                    "All utterance-ids must be prefixed by the "
-                    "corresponding speaker-id")
+        default_len = lengths.pop()
+        if any(utt[:default_len] != spk for utt, spk in utt2spk.iteritems()):
+            raise IOError(
+                "All utterance-ids must be prefixed by the "
+                "corresponding speaker-id")
 
     def validate_transcription(self):
         """Checking transcriptions"""
         self.log.debug("checking transcriptions")
 
-        utt_ids = sorted(self.corpus.segments.keys())
-        utt_ids_txt = sorted(self.corpus.text.keys())
+        utt_ids = self.corpus.segments.viewkeys()
+        utt_ids_txt = self.corpus.text.viewkeys()
 
         # we will check that the words are mostly in the lexicon later
         # same utterance-ids in segments and text
         if utt_ids_txt != utt_ids:
-            _duplicates = duplicates(utt_ids_txt)
-            if _duplicates:
-                self.log.debug(
-                    "utterance-ids used several times in text: {}"
-                    .format(len(_duplicates)))
-
-                raise IOError(
-                    "utterance-ids used several times in text: {}"
-                    .format(_duplicates))
-            else:
-                e_txt = set(utt_ids_txt)
-                e_seg = set(utt_ids)
-
-                self.log.debug(
-                    "utterances in text but not in segments: {}"
-                    .format(set.difference(e_txt, e_seg)))
+            self.log.debug(
+                "utterances in text but not in segments: {}"
+                .format(set(utt_ids_txt - utt_ids)))
 
-                self.log.debug(
-                    "utterances in segments but not in text: {}"
-                    .format(set.difference(e_seg, e_txt)))
+            self.log.debug(
+                "utterances in segments but not in text: {}"
+                .format(set(utt_ids - utt_ids_txt)))
 
-                raise IOError(
-                    "utterance-ids in segments and text are not consistent")
+            raise IOError(
+                "utterance-ids in segments and text are not consistent")
 
     def validate_phones(self):
         """Checks phones, silences and variants, return phones inventory"""
@@ -415,55 +415,40 @@ class CorpusValidation(object):
     def validate_lexicon(self, inventory):
         self.log.debug("checking lexicon")
 
-        dict_words = self.corpus.lexicon.keys()
-        transcriptions = [t.split() for t in self.corpus.lexicon.values()]
+        lexicon = self.corpus.lexicon
 
         # checks all words have a non empty transcription
-        empties = {k: v for k, v in self.corpus.lexicon.iteritems()
-                   if v.strip() == ''}
+        empties = [w for w, t in lexicon.iteritems() if t.strip() == '']
         if empties:
             raise IOError(
                 'the following words have no transcription in lexicon: {}'
-                .format(empties.keys()))
+                .format(empties))
 
-        # unique word entries (alternative pronunciations are not
-        # currently supported)
-        _duplicates = duplicates(dict_words)
-        if _duplicates:
-            raise IOError(
-                "Alternative pronunciations are not currently supported. "
-                "Following words have several transcriptions in lexicon: {}"
-                .format(_duplicates))
+        # words are unique by construction as keys of the lexicon
+        # dict, so alternative pronunciations cannot be defined
 
         # OOV item
-        if u"<unk>" not in dict_words:
+        if u"<unk>" not in lexicon:
             self.log.debug("adding '<unk>' word to lexicon")
-            dict_words.append("<unk>")
-            transcriptions.append(["SPN"])
-            self.corpus.lexicon['<unk>'] = 'SPN'
-        else:
-            if transcriptions[dict_words.index("<unk>")] != ["SPN"]:
-                raise IOError(
-                    "'<unk>' word is reserved for mapping "
-                    "OOV items and should always be transcribed "
-                    "as 'SPN' (vocal) noise'")
+            lexicon['<unk>'] = 'SPN'
+        elif lexicon[u"<unk>"].split() != ["SPN"]:
+            raise IOError(
+                "'<unk>' word is reserved for mapping "
+                "OOV items and should always be transcribed "
+                "as 'SPN' (vocal) noise'")
         # TODO should we log a warning for all words containing silence phones?
 
-        # unused words
-        used_words = [word for utt in self.corpus.text.itervalues()
-                      for word in utt.split()]
-        dict_words_set = set(dict_words)
+        # unused words, the tokens are counted only for OOV words
+        used_words = u' '.join(self.corpus.text.itervalues()).split()
         used_word_types = set(used_words)
-        used_word_counts = collections.Counter(used_words)
-        used_dict_words = set.intersection(dict_words_set, used_word_types)
-        self.log.debug("{} dictionary words used out of {}"
-                       .format(len(used_dict_words), len(dict_words_set)))
+        oov_word_types = used_word_types - lexicon.viewkeys()
+        self.log.debug("{} dictionary words used out of {}".format(
+            len(used_word_types) - len(oov_word_types), len(lexicon)))
 
         # oov words
-        oov_word_types = set.difference(used_word_types, dict_words_set)
         oov_word_counts = collections.Counter(
-            {oov: used_word_counts[oov] for oov in oov_word_types})
-        nb_oov_tokens = sum(oov_word_counts.values())
+            filter(oov_word_types.__contains__, used_words))
+        nb_oov_tokens = sum(oov_word_counts.itervalues())
         nb_oov_types = len(oov_word_types)
 
         self.log.debug(
@@ -496,7 +481,7 @@ class CorpusValidation(object):
 
         # homophones (issue warnings only)
         counts = collections.Counter(
-            [u" ".join(phone_trans) for phone_trans in transcriptions])
+            u" ".join(t.split()) for t in lexicon.itervalues())
 
         duplicate_transcripts = collections.Counter(
             {trans: counts[trans] for trans in counts if counts[trans] > 1})
@@ -562,10 +547,9 @@ class CorpusValidation(object):
             #     .format(resume_list(l)))
 
         # ooi phones
-        used_phones = [phone for trans_phones in transcriptions
-                       for phone in trans_phones]
+        used_phones = set(u" ".join(lexicon.itervalues()).split())
 
-        ooi_phones = [phone for phone in set(used_phones)
+        ooi_phones = [phone for phone in used_phones
                       if phone not in inventory]
 
         if ooi_phones:
@@ -581,81 +565,111 @@ class CorpusValidation(object):
                 "in the transcriptions: {}".format(unused_phones))
 
     def _check_timestamps(self, meta):
-        """Check for utterances overlap and timestamps consistency"""
+        """Check for utterances overlap and timestamps consistency
+
+        The segments are flattened in arrays sorted by wav and start
+        time, so that all the checks are vectorized.
+
+        """
         self.log.debug("checking timestamps consistency")
 
-        short_utts = []
-        warning = False
-        for _wav, utts in self.corpus.wav2utt().iteritems():
-            duration = meta[_wav].duration
-
-            # check all utterances are within wav boundaries
-            for utt_id, start, stop in utts:
-                if start == stop:
-                    raise IOError(
-                        'utterance {} have a duration of 0'.format(utt_id))
-
-                if not (start >= 0 and stop >= 0 and start <= stop and
-                        start <= duration + (1.0/16000) and
-                        stop <= duration + (1.0/16000)):
-                    raise IOError(
-                        "utterance {} is not whithin boudaries in wav {} "
-                        "({} not in {})"
-                        .format(utt_id, _wav,
-                                '[{}, {}]'.format(start, stop),
-                                '[0, {}]'.format(duration)))
-
-                if stop - start < self.wav_min_duration:  # .015:
-                    short_utts.append(utt_id)
-
-            # then check if there is overlap in time between the
-            # different utterances and if there is, issue a
-            # warning (not an error)
-            wav_starts = [start for _, start, _ in utts]
-            counts = collections.Counter(wav_starts)
-            same_start = {}
-            for start in counts:
-                if counts[start] > 1:
-                    same_start[start] = [
-                        utt for utt, sta, _ in utts if sta == start]
-
-            wav_stops = [stop for _, _, stop in utts]
-            counts = collections.Counter(wav_stops)
-            same_stop = {}
-            for stop in counts:
-                if counts[stop] > 1:
-                    same_stop[stop] = [
-                        utt for utt, _, sto in utts if sto == stop]
-
-            if same_start:
-                warning = True
+        wav2utt = self.corpus.wav2utt()
+        wavs = sorted(wav2utt)
+        utts = [utt for w in wavs for utt, _, _ in wav2utt[w]]
+        nutts = np.fromiter((len(wav2utt[w]) for w in wavs),
+                            dtype=np.int64, count=len(wavs))
+        wav_index = np.repeat(np.arange(len(wavs)), nutts)
+
+        # None timestamps are converted to NaN
+        timestamps = np.array(
+            [(start, stop) for w in wavs for _, start, stop in wav2utt[w]],
+            dtype=np.float64).reshape(-1, 2)
+        starts, stops = timestamps[:, 0], timestamps[:, 1]
+        durations = np.fromiter(
+            (meta[w].duration for w in wavs),
+            dtype=np.float64, count=len(wavs))[wav_index]
+
+        # check all utterances are within wav boundaries
+        with np.errstate(invalid='ignore'):
+            null = (starts == stops) | (np.isnan(starts) & np.isnan(stops))
+            outside = ~((starts >= 0) & (stops >= 0) & (starts <= stops) &
+                        (starts <= durations + (1.0/16000)) &
+                        (stops <= durations + (1.0/16000)))
+            short = stops - starts < self.wav_min_duration  # .015:
+
+        invalid = np.flatnonzero(null | outside)
+        if invalid.size:
+            i = invalid[0]
+            utt_id, _wav = utts[i], wavs[wav_index[i]]
+            if null[i]:
+                raise IOError(
+                    'utterance {} have a duration of 0'.format(utt_id))
+
+            _, start, stop = self.corpus.segments[utt_id]
+            raise IOError(
+                "utterance {} is not whithin boudaries in wav {} "
+                "({} not in {})"
+                .format(utt_id, _wav,
+                        '[{}, {}]'.format(start, stop),
+                        '[0, {}]'.format(meta[_wav].duration)))
+
+        short_utts = [utts[i] for i in np.flatnonzero(short)]
+
+        # then check if there is overlap in time between the
+        # different utterances and if there is, issue a warning (not
+        # an error)
+        same_start = self._same_times(wav_index, starts)
+        same_stop = self._same_times(wav_index, stops)
+        for i in sorted(set(same_start) | set(same_stop)):
+            if i in same_start:
                 self.log.warning(
                     "The following utterances start at the same time "
-                    "in wavefile {}: {}".format(_wav, sorted(same_start)))
+                    "in wavefile {}: {}".format(wavs[i], same_start[i]))
 
-            if same_stop:
-                warning = True
+            if i in same_stop:
                 self.log.warning(
                     "The following utterances stop at the same time "
-                    "in wavefile {}: {}".format(_wav, sorted(same_stop)))
-
-            # TODO overlap checking is buggy
-            # timestamps = list(set(wav_starts)) + list(set(wav_stops))
-            # timestamps.sort()
-            #
-            # overlapped = [
-            #     (utt, timestamps.index(stop) - timestamps.index(start))
-            #     for utt, start, stop in utts
-            #     if timestamps.index(stop) - timestamps.index(start) > 2]
-            #
-            # if overlapped:
-            #     warning = True
-            #     self.log.warning(
-            #         "The following utterances from file {} are "
-            #         "overlapping in time: {}".format(wav, overlapped))
+                    "in wavefile {}: {}".format(wavs[i], same_stop[i]))
+
+        # finally detect all the overlapping utterances
+        overlaps = self.corpus.overlaps()
+        for _wav in sorted(overlaps):
+            self.log.debug(
+                "The following utterances from file {} are "
+                "overlapping in time: {}".format(
+                    _wav, resume_list(overlaps[_wav])))
 
+        if overlaps:
+            self.log.warning(
+                "{} pairs of utterances are overlapping in time in {} wavs"
+                .format(sum(len(v) for v in overlaps.itervalues()),
+                        len(overlaps)))
+
+        warning = bool(same_start or same_stop or overlaps)
         return warning, short_utts
 
+    @staticmethod
+    def _same_times(wav_index, times):
+        """Return the timestamps shared by several utterances of a wav
+
+        `wav_index` and `times` are arrays of the wav indices and
+        timestamps of the utterances. Return a dict of wav indices
+        mapped to the sorted list of their duplicated timestamps.
+
+        """
+        order = np.lexsort((times, wav_index))
+        wav_index, times = wav_index[order], times[order]
+
+        # duplicates are consecutive in the sorted arrays
+        dup = np.flatnonzero(
+            (wav_index[1:] == wav_index[:-1]) & (times[1:] == times[:-1])) + 1
+
+        same = collections.defaultdict(list)
+        for i, t in zip(wav_index[dup].tolist(), times[dup].tolist()):
+            if not same[i] or same[i][-1] != t:
+                same[i].append(t)
+        return dict(same)
+
     @staticmethod
     def _strcounts2unicode(strcounts):
         """Return a str representing strcounts"""
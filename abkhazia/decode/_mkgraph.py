@@ -61,6 +61,12 @@ def mkgraph(decoder, verbose=True):
             model=decoder.am_dir,
             graph=target))
 
-    decoder._run_command(command, verbose=verbose)
+    # the graph depends only on the language and acoustic models, it
+    # is reused from the cache when possible
+    decoder._cached_stage(
+        'mkgraph', target,
+        lambda: decoder._run_command(command, verbose=verbose),
+        decoder.lm_dir, decoder.am_dir, decoder.am_type,
+        {k: v.value for k, v in opts.iteritems()})
 
     return target
@@ -105,10 +105,10 @@ class Decode(abstract_recipe.AbstractRecipe):
     def run(self):
         """Run the created recipe and decode speech data"""
         # build the full decoding graph
-        graph_dir = _mkgraph.mkgraph(self)
+        graph_dir = self._checkpoint('mkgraph', _mkgraph.mkgraph, self)
 
         # decode the corpus according to input am type
-        self._decoder.decode(self, graph_dir)
+        self._checkpoint('decode', self._decoder.decode, self, graph_dir)
 
     def export(self):
         """Copy the whole <recipe-dir>/decode to <output-dir>, copy
@@ -20,10 +20,20 @@ import joblib
 
 import abkhazia.utils as utils
 import abkhazia.abstract_recipe as abstract_recipe
+import abkhazia.kaldi.ark as ark
+from abkhazia.features import numpy_features
 
 
 class Features(abstract_recipe.AbstractRecipe):
-    """Compute speech features from an abkhazia corpus"""
+    """Compute speech features from an abkhazia corpus
+
+    The features are computed either by the Kaldi scripts (with the
+    'kaldi' backend) or in process (with the 'numpy' backend, see
+    abkhazia.features.numpy_features). The numpy backend does not
+    require Kaldi, but does not support pitch. With both backends,
+    the deltas and CMVN statistics are computed in process.
+
+    """
     name = 'features'
 
     @staticmethod
@@ -58,13 +68,14 @@ class Features(abstract_recipe.AbstractRecipe):
 
     def __init__(self, corpus, output_dir,
                  type='mfcc', use_pitch=False, use_cmvn=False, delta_order=0,
-                 log=utils.logger.null_logger()):
+                 backend='kaldi', log=utils.logger.null_logger()):
         super(Features, self).__init__(corpus, output_dir, log=log)
 
         self.type = type
         self.use_pitch = use_pitch
         self.use_cmvn = use_cmvn
         self.delta_order = delta_order
+        self.backend = backend
 
         # overload a kaldi default parameter
         self.features_options = [('use-energy', 'false')]
@@ -72,6 +83,10 @@ class Features(abstract_recipe.AbstractRecipe):
         if self.type not in ['mfcc', 'plp', 'fbank']:
             raise IOError('unknown feature type "{}"'.format(self.type))
 
+        if self.backend not in ['kaldi', 'numpy']:
+            raise IOError('unknown features backend "{}"'.format(
+                self.backend))
+
     def _setup_conf_dir(self):
         """Setup the configurtion files for feature extraction
 
@@ -125,52 +140,118 @@ class Features(abstract_recipe.AbstractRecipe):
                 self.output_dir),
             verbose=False)
 
-    def _compute_delta(self):
-        """Wrapper on add-deltas Kaldi executable
+    def _compute_features_numpy(self):
+        """Compute the features in process with the numpy backend
 
-        The order of the computed deltas is given by the attribute
-        self.delta_order. Raise IOError if self.delta_order == 0
+        The utterances are sorted and split in self.njobs parts,
+        computed in parallel. As with the Kaldi scripts, each job
+        writes the raw_*type*_features.*job*.ark and .scp files in
+        the output directory.
 
         """
-        if self.delta_order <= 0:
-            raise IOError(
-                'Cannot compute deltas because order is lower than 1')
-        self.log.info('computing deltas (order %s)', self.delta_order)
+        self.log.info('computing %s features with the numpy backend',
+                      self.type)
+
+        extractor = numpy_features.FeaturesExtractor(
+            self.type, dict(self.features_options))
+
+        # the utterances retained by Abkhazia2Kaldi, as in the recipe
+        corpus = self.a2k.corpus
+        utterances = [
+            (utt, os.path.join(corpus.wav_folder, wav), tstart, tstop)
+            for utt, (wav, tstart, tstop) in sorted(
+                corpus.segments.iteritems())]
+
+        njobs = max(1, min(self.njobs, len(utterances)))
+        size = len(utterances) / float(njobs)
+        jobs = [utterances[int(round(n * size)):int(round((n + 1) * size))]
+                for n in range(njobs)]
+
+        joblib.Parallel(n_jobs=njobs, verbose=0)(
+            joblib.delayed(numpy_features.compute_job)(
+                extractor, job, *self._raw_files(n))
+            for n, job in enumerate(jobs, 1))
+
+    def _raw_files(self, job):
+        """Return the raw ark and scp files written by the job `job`"""
+        base = os.path.join(self.output_dir, 'raw_{}_{}.{}'.format(
+            self.type, self.name, job))
+        return base + '.ark', base + '.scp'
+
+    def _compute_delta_cmvn(self):
+        """Compute deltas and CMVN statistics in process
+
+        The raw ark files are read once, in parallel. If
+        self.delta_order > 0 they are rewritten with the deltas
+        appended (as Kaldi add-deltas). If self.use_cmvn is True, the
+        per-speaker CMVN statistics are accumulated on the raw
+        features (as Kaldi compute-cmvn-stats) and written in
+        'cmvn_features.ark' and 'cmvn.scp'.
+
+        """
+        if self.delta_order:
+            self.log.info('computing deltas (order %s)', self.delta_order)
+        if self.use_cmvn:
+            self.log.info('computing CMVN statistics')
 
         inputs = [f for f in utils.list_files_with_extension(
             self.output_dir, '.scp', abspath=True, recursive=False)
                   if 'raw_' in f]
+        utt2spk = self.corpus.utt2spk if self.use_cmvn else None
 
-        # compute deltas in parallel, one job per scp file
-        joblib.Parallel(n_jobs=self.njobs, verbose=1, backend='threading')(
-            joblib.delayed(_delta_joblib_fnc)(scp, self) for scp in inputs)
-
-    def _compute_cmvn_stats(self):
-        """Wrapper on steps/compute_cmvn_stats.sh"""
-        self.log.info('computing CMVN statistics')
-        self._run_command(
-            'steps/compute_cmvn_stats.sh {0} {1} {2}'.format(
-                os.path.join('data', self.name),
-                os.path.join('exp', 'make_{}'.format(self.type), self.name),
-                self.output_dir),
-            verbose=False)
+        stats = joblib.Parallel(n_jobs=self.njobs, verbose=0)(
+            joblib.delayed(numpy_features.delta_cmvn_job)(
+                scp.replace('.scp', '.ark'), scp, self.delta_order, utt2spk)
+            for scp in inputs)
 
-        src = os.path.join(self.output_dir, 'cmvn_features.scp')
-        dest = os.path.join(self.output_dir, 'cmvn.scp')
-        shutil.move(src, dest)
+        if self.use_cmvn:
+            # a speaker can be spread over several jobs
+            cmvn = {}
+            for job_stats in stats:
+                for spk, spk_stats in job_stats.iteritems():
+                    if spk in cmvn:
+                        cmvn[spk] += spk_stats
+                    else:
+                        cmvn[spk] = spk_stats
+
+            ark.write_ark(
+                os.path.join(self.output_dir, 'cmvn_features.ark'),
+                ((spk, cmvn[spk]) for spk in sorted(cmvn.iterkeys())),
+                format='binary',
+                scp=os.path.join(self.output_dir, 'cmvn.scp'))
+
+    def check_parameters(self):
+        if self.backend == 'numpy':
+            # the numpy backend always runs locally
+            self._check_njobs(local=True)
+            if self.use_pitch:
+                raise IOError('pitch is not supported by the numpy backend')
+        else:
+            super(Features, self).check_parameters()
+
+        if self.delta_order < 0:
+            raise IOError(
+                'delta order must be positive, it is {}'.format(
+                    self.delta_order))
 
     def create(self):
+        if self.backend == 'numpy':
+            # no Kaldi recipe needed, only wav.scp for export
+            self.check_parameters()
+            self.a2k.setup_wav()
+            return
+
         super(Features, self).create()
         self._setup_conf_dir()
 
     def run(self):
-        self._compute_features()
-
-        if self.use_cmvn:
-            self._compute_cmvn_stats()
+        if self.backend == 'numpy':
+            self._compute_features_numpy()
+        else:
+            self._compute_features()
 
-        if self.delta_order != 0:
-            self._compute_delta()
+        if self.use_cmvn or self.delta_order:
+            self._compute_delta_cmvn()
 
     def export(self):
         super(Features, self).export()
@@ -203,32 +284,3 @@ class Features(abstract_recipe.AbstractRecipe):
                 wav = os.path.join(self.corpus.wav_folder, key)
                 scp.write('{} {}\n'.format(key, wav))
 
-
-def _delta_joblib_fnc(scp, instance):
-    """A tweak to compute deltas inplace and in parallel using joblib
-
-    class methods are not pickable so we pass a Features instance as a
-    parameter instead of using self.
-
-    scp is a str or a 1-length tuple containing the scp to compute delta on
-
-    """
-    # filename of the input
-    if isinstance(scp, tuple):
-        scp = scp[0]
-
-    # temp file for pseudo-inplace operation
-    tmp = scp + '_tmp'
-
-    try:
-        # compute deltas to tmp
-        instance._run_command(
-            'add-deltas --delta-order={0} scp:{1} ark:{2}'.format(
-                instance.delta_order, scp, tmp), verbose=False)
-
-        # move tmp to scp
-        instance._run_command(
-            'copy-feats ark:{} ark,scp:{},{}'.format(
-                tmp, scp.replace('.scp', '.ark'), scp), verbose=False)
-    finally:
-        utils.remove(tmp, safe=True)
@@ -0,0 +1,549 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Pure NumPy implementation of the Kaldi MFCC, PLP and fbank features
+
+This module is a port of the Kaldi feature extraction (from
+kaldi/src/feat) used by the 'numpy' backend of the Features
+recipe. It does not require Kaldi and gives the same features as
+compute-mfcc-feats, compute-plp-feats and compute-fbank-feats with
+the same options, up to float precision and dithering.
+
+The options are named as in Kaldi, see FeaturesExtractor.defaults.
+
+The deltas and CMVN statistics are computed in process as well, see
+add_deltas, cmvn_stats and delta_cmvn_job.
+
+"""
+
+import os
+import struct
+import zlib
+
+import numpy as np
+
+import abkhazia.kaldi.ark as ark
+
+
+# smallest values used as floor by Kaldi, from std::numeric_limits<float>
+_FLT_EPSILON = np.finfo(np.float32).eps
+_FLT_MIN = np.finfo(np.float32).tiny
+
+
+class FeaturesExtractor(object):
+    """Compute MFCC, PLP or fbank features from raw signals
+
+    type (str): the features type, must be 'mfcc', 'plp' or 'fbank'
+
+    options (dict): options overloading the defaults, as name/value
+      pairs. The names are the ones of the Kaldi options, the values
+      can be given as str (as in Kaldi config files).
+
+    Raise IOError on unknown or unsupported options.
+
+    The windows, filterbanks and transformation matrices are computed
+    once at construction. An instance can be pickled to be used in
+    parallel jobs.
+
+    """
+    defaults = {
+        # frame extraction
+        'sample-frequency': 16000.0,
+        'frame-length': 25.0,
+        'frame-shift': 10.0,
+        'dither': 1.0,
+        'preemphasis-coefficient': 0.97,
+        'remove-dc-offset': True,
+        'window-type': 'povey',
+        'round-to-power-of-two': True,
+        'blackman-coeff': 0.42,
+
+        # mel filterbank
+        'num-mel-bins': 23,
+        'low-freq': 20.0,
+        'high-freq': 0.0,
+
+        # energy
+        'use-energy': True,
+        'energy-floor': 0.0,
+        'raw-energy': True,
+
+        # mfcc and plp
+        'num-ceps': 13,
+        'cepstral-lifter': 22.0,
+
+        # plp only
+        'lpc-order': 12,
+        'compress-factor': 0.33333,
+        'cepstral-scale': 1.0,
+
+        # fbank only
+        'use-log-fbank': True,
+        'use-power': True}
+    """Kaldi default values of the supported options"""
+
+    type_defaults = {'fbank': {'use-energy': False}}
+    """Default values specific to a features type"""
+
+    def __init__(self, type='mfcc', options=None):
+        if type not in ('mfcc', 'plp', 'fbank'):
+            raise IOError('unknown feature type "{}"'.format(type))
+        self.type = type
+
+        self.options = dict(self.defaults)
+        self.options.update(self.type_defaults.get(type, {}))
+        for name, value in (options or {}).iteritems():
+            self.options[name] = self._parse_option(name, value)
+        opts = self.options
+
+        # framing
+        rate = opts['sample-frequency']
+        self.frame_length = int(rate * 0.001 * opts['frame-length'])
+        self.frame_shift = int(rate * 0.001 * opts['frame-shift'])
+        self.padded_length = (
+            1 << (self.frame_length - 1).bit_length()
+            if opts['round-to-power-of-two'] else self.frame_length)
+        self.window = self._window(
+            opts['window-type'], self.frame_length, opts['blackman-coeff'])
+
+        # mel filterbank, and mel bins center frequencies
+        self.mel_banks, self.center_freqs = self._mel_banks(
+            opts['num-mel-bins'], self.padded_length, rate,
+            opts['low-freq'], opts['high-freq'])
+
+        nceps = opts['num-ceps']
+        if type == 'mfcc':
+            if nceps > opts['num-mel-bins']:
+                raise IOError('num-ceps cannot exceed num-mel-bins')
+            self.dct = self._dct_matrix(opts['num-mel-bins'])[:nceps]
+        if type == 'plp':
+            if nceps > opts['lpc-order'] + 1:
+                raise IOError('num-ceps cannot exceed lpc-order + 1')
+            self.equal_loudness = self._equal_loudness(self.center_freqs)
+            self.idft_bases = self._idft_bases(
+                opts['lpc-order'] + 1, opts['num-mel-bins'] + 2)
+        if type in ('mfcc', 'plp'):
+            lifter = opts['cepstral-lifter']
+            self.lifter = (
+                1 + 0.5 * lifter * np.sin(np.pi * np.arange(nceps) / lifter)
+                if lifter else np.ones(nceps))
+
+    def dim(self):
+        """Return the dimension of the computed features"""
+        if self.type == 'fbank':
+            return self.options['num-mel-bins'] + int(
+                self.options['use-energy'])
+        return self.options['num-ceps']
+
+    def compute(self, signal, seed=0):
+        """Return the features of `signal` as a float32 matrix
+
+        `signal` is a 1D array of raw samples (int16 values for a wav
+        file). The dither noise is drawn from a random generator
+        initialized with `seed`. Return an array of shape (nframes,
+        dim).
+
+        """
+        frames = self._frames(np.asarray(signal, dtype=np.float64))
+        if frames.shape[0] == 0:
+            return np.zeros((0, self.dim()), dtype=np.float32)
+        opts = self.options
+
+        # process the frames as in FeatureWindowFunction::ProcessWindow
+        if opts['dither']:
+            frames += opts['dither'] * np.random.RandomState(
+                seed).standard_normal(frames.shape)
+        if opts['remove-dc-offset']:
+            frames -= frames.mean(axis=1)[:, None]
+        if opts['raw-energy']:
+            log_energy = self._log_energy(frames)
+        if opts['preemphasis-coefficient']:
+            coeff = opts['preemphasis-coefficient']
+            frames[:, 1:] -= coeff * frames[:, :-1]
+            frames[:, 0] -= coeff * frames[:, 0]
+        frames *= self.window
+        if not opts['raw-energy']:
+            log_energy = self._log_energy(frames)
+
+        if opts['energy-floor'] > 0:
+            log_energy = np.maximum(log_energy, np.log(opts['energy-floor']))
+
+        # power spectrum (batched FFT over all the frames)
+        spectrum = np.abs(np.fft.rfft(frames, n=self.padded_length, axis=1))
+        if self.type != 'fbank' or opts['use-power']:
+            spectrum **= 2
+        mel_energies = np.dot(
+            spectrum[:, :self.padded_length // 2], self.mel_banks.T)
+
+        features = getattr(self, '_' + self.type)(mel_energies)
+        if opts['use-energy']:
+            if self.type == 'fbank':
+                features = np.hstack((log_energy[:, None], features))
+            else:
+                features[:, 0] = log_energy
+        return features.astype(np.float32)
+
+    def _mfcc(self, mel_energies):
+        """MfccComputer::Compute"""
+        log_energies = np.log(np.maximum(mel_energies, _FLT_EPSILON))
+        return np.dot(log_energies, self.dct.T) * self.lifter
+
+    def _fbank(self, mel_energies):
+        """FbankComputer::Compute"""
+        if self.options['use-log-fbank']:
+            return np.log(np.maximum(mel_energies, _FLT_EPSILON))
+        return mel_energies
+
+    def _plp(self, mel_energies):
+        """PlpComputer::Compute"""
+        opts = self.options
+        energies = (mel_energies * self.equal_loudness) ** (
+            opts['compress-factor'])
+
+        # duplicate first and last elements, and compute the
+        # autocorrelation coefficients
+        energies = np.hstack((energies[:, :1], energies, energies[:, -1:]))
+        autocorr = np.dot(energies, self.idft_bases.T)
+
+        lpc, residual_energy = self._durbin(autocorr)
+        cepstrum = self._lpc_to_cepstrum(lpc)
+
+        nceps = opts['num-ceps']
+        features = np.empty((autocorr.shape[0], nceps))
+        features[:, 0] = np.maximum(np.log(residual_energy), _FLT_MIN)
+        features[:, 1:] = cepstrum[:, :nceps - 1]
+        features *= self.lifter * opts['cepstral-scale']
+        return features
+
+    def _frames(self, signal):
+        """Return the frames of `signal` as a (nframes, length) copy"""
+        if signal.size < self.frame_length:
+            return np.zeros((0, self.frame_length))
+
+        nframes = 1 + (signal.size - self.frame_length) // self.frame_shift
+        return np.lib.stride_tricks.as_strided(
+            signal, shape=(nframes, self.frame_length),
+            strides=(signal.strides[0] * self.frame_shift,
+                     signal.strides[0])).copy()
+
+    @staticmethod
+    def _log_energy(frames):
+        return np.log(np.maximum((frames ** 2).sum(axis=1), _FLT_EPSILON))
+
+    @staticmethod
+    def _durbin(autocorr):
+        """Levinson-Durbin recursion, vectorized over frames
+
+        Return the LPC coefficients and the residual energy, as in
+        the Durbin function from kaldi/src/feat/mel-computations.cc
+
+        """
+        order = autocorr.shape[1] - 1
+        lpc = np.zeros((autocorr.shape[0], order))
+        energy = autocorr[:, 0].copy()
+        for i in range(order):
+            k = (autocorr[:, i + 1] + (
+                lpc[:, :i] * autocorr[:, i:0:-1]).sum(axis=1)) / energy
+            energy *= np.maximum(1 - k * k, 1.0e-5)
+            previous = lpc[:, :i].copy()
+            lpc[:, i] = -k
+            lpc[:, :i] = previous - k[:, None] * previous[:, ::-1]
+        return lpc, energy
+
+    @staticmethod
+    def _lpc_to_cepstrum(lpc):
+        """Lpc2Cepstrum from kaldi/src/feat/mel-computations.cc"""
+        cepstrum = np.zeros_like(lpc)
+        for i in range(lpc.shape[1]):
+            weights = np.arange(i, 0, -1, dtype=np.float64)
+            total = (weights * lpc[:, :i] * cepstrum[:, i-1::-1][:, :i]).sum(
+                axis=1) if i else 0
+            cepstrum[:, i] = -lpc[:, i] - total / (i + 1)
+        return cepstrum
+
+    @staticmethod
+    def _window(type, length, blackman_coeff):
+        """FeatureWindowFunction"""
+        a = 2 * np.pi / (length - 1)
+        i = np.arange(length)
+        if type == 'hanning':
+            return 0.5 - 0.5 * np.cos(a * i)
+        if type == 'hamming':
+            return 0.54 - 0.46 * np.cos(a * i)
+        if type == 'povey':
+            return (0.5 - 0.5 * np.cos(a * i)) ** 0.85
+        if type == 'rectangular':
+            return np.ones(length)
+        if type == 'blackman':
+            return (blackman_coeff - 0.5 * np.cos(a * i) +
+                    (0.5 - blackman_coeff) * np.cos(2 * a * i))
+        raise IOError('invalid window-type "{}"'.format(type))
+
+    @staticmethod
+    def _mel(freq):
+        return 1127.0 * np.log(1.0 + np.asarray(freq) / 700.0)
+
+    @classmethod
+    def _mel_banks(cls, nbins, padded_length, rate, low_freq, high_freq):
+        """MelBanks, return the filterbank matrix and center frequencies"""
+        nyquist = 0.5 * rate
+        if high_freq <= 0:
+            high_freq += nyquist
+        if not 0 <= low_freq < high_freq <= nyquist:
+            raise IOError(
+                'invalid low-freq {} and high-freq {} for nyquist {}'
+                .format(low_freq, high_freq, nyquist))
+
+        mel_low, mel_high = cls._mel(low_freq), cls._mel(high_freq)
+        delta = (mel_high - mel_low) / (nbins + 1)
+        left = mel_low + np.arange(nbins)[:, None] * delta
+        center, right = left + delta, left + 2 * delta
+
+        mel = cls._mel(
+            np.arange(padded_length // 2) * rate / float(padded_length))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            banks = np.where(
+                mel <= center, (mel - left) / delta, (right - mel) / delta)
+        banks[(mel <= left) | (mel >= right)] = 0
+        return banks, 700.0 * (np.exp(center[:, 0] / 1127.0) - 1)
+
+    @staticmethod
+    def _dct_matrix(n):
+        """ComputeDctMatrix, a (n, n) normalized DCT-II matrix"""
+        k = np.arange(n)[:, None]
+        dct = np.sqrt(2.0 / n) * np.cos(np.pi / n * (np.arange(n) + 0.5) * k)
+        dct[0] = np.sqrt(1.0 / n)
+        return dct
+
+    @staticmethod
+    def _equal_loudness(freqs):
+        """GetEqualLoudnessVector"""
+        fsq = freqs ** 2
+        fsub = fsq / (fsq + 1.6e5)
+        return fsub * fsub * ((fsq + 1.44e6) / (fsq + 9.61e6))
+
+    @staticmethod
+    def _idft_bases(nbases, dim):
+        """InitIdftBases"""
+        scale = 1.0 / (2.0 * (dim - 1))
+        bases = 2 * scale * np.cos(
+            np.pi / (dim - 1) * np.outer(np.arange(nbases), np.arange(dim)))
+        bases[:, 0] = scale
+        bases[:, -1] /= 2
+        return bases
+
+    def _parse_option(self, name, value):
+        """Return `value` converted to the type of the option `name`"""
+        try:
+            default = self.defaults[name]
+        except KeyError:
+            raise IOError(
+                'option "{}" is not supported by the numpy backend, '
+                'use the kaldi backend instead'.format(name))
+
+        try:
+            if isinstance(default, bool):
+                if isinstance(value, bool):
+                    return value
+                return {'true': True, 'false': False}[str(value).lower()]
+            return type(default)(value)
+        except (KeyError, ValueError):
+            raise IOError('invalid value for option "{}": {}'.format(
+                name, value))
+
+
+def read_wav(wav, sample_frequency=None):
+    """Return the samples of a 16 bits PCM mono `wav` as a memory map
+
+    Raise IOError if `wav` is not a 16 bits PCM mono wav file, or if
+    its sample frequency is not `sample_frequency` (when not None).
+
+    """
+    with open(wav, 'rb') as fin:
+        if fin.read(12)[8:] != 'WAVE':
+            raise IOError('not a wav file: {}'.format(wav))
+
+        # look for the format and data chunks
+        fmt = None
+        while True:
+            header = fin.read(8)
+            if len(header) < 8:
+                raise IOError('no data in wav file: {}'.format(wav))
+            chunk, size = struct.unpack('<4sI', header)
+            if chunk == 'data':
+                break
+            if chunk == 'fmt ':
+                fmt = fin.read(size)
+                fin.seek(size % 2, os.SEEK_CUR)
+            else:
+                fin.seek(size + size % 2, os.SEEK_CUR)
+
+        offset = fin.tell()
+        size = min(size, os.fstat(fin.fileno()).st_size - offset)
+
+    _check_format(wav, fmt, sample_frequency)
+    if size < 2:
+        return np.zeros((0,), dtype='<i2')
+    return np.memmap(wav, dtype='<i2', mode='r', offset=offset,
+                     shape=(size // 2,))
+
+
+def _check_format(wav, fmt, sample_frequency):
+    """Raise IOError if the `fmt` chunk of `wav` is not supported"""
+    if fmt is None or len(fmt) < 16:
+        raise IOError('no format chunk in wav file: {}'.format(wav))
+
+    code, nchannels, rate, _, _, width = struct.unpack_from('<HHIIHH', fmt)
+    if code == 0xFFFE and len(fmt) >= 26:
+        # WAVE_FORMAT_EXTENSIBLE, the format is in the sub-format
+        code, = struct.unpack_from('<H', fmt, 24)
+
+    if code != 1 or nchannels != 1 or width != 16:
+        raise IOError(
+            '{}: only 16 bits PCM mono wavs are supported, found format {} '
+            'with {} channels of {} bits'.format(wav, code, nchannels, width))
+    if sample_frequency is not None and rate != sample_frequency:
+        raise IOError('{}: sample frequency is {}, expected {}'.format(
+            wav, rate, sample_frequency))
+
+
+def _seed(utt):
+    """Return the dither seed of the utterance `utt`"""
+    if isinstance(utt, unicode):
+        utt = utt.encode('utf8')
+    return zlib.crc32(utt) & 0xffffffff
+
+
+def compute_job(extractor, utterances, arkfile, scpfile):
+    """Compute the features of `utterances`, write them in ark and scp
+
+    `extractor` is a FeaturesExtractor, `utterances` is a sorted list
+    of (utt_id, wav_file, tstart, tstop), with tstart and tstop in
+    seconds or None for the whole wav. The utterances are processed
+    one at a time, each wav being memory-mapped. As in Kaldi, the
+    utterances too short to have a single frame are not written.
+
+    The dither seed of an utterance is derived from its id, so the
+    features do not depend on the split of the utterances in jobs.
+
+    """
+    rate = extractor.options['sample-frequency']
+
+    def _features():
+        wavs = {}
+        for utt, wav, tstart, tstop in utterances:
+            if wav not in wavs:
+                wavs = {wav: read_wav(wav, rate)}
+            signal = wavs[wav]
+
+            # same segmentation as Kaldi extract-segments
+            if tstart is not None:
+                signal = signal[int(tstart * rate):int(tstop * rate)]
+            features = extractor.compute(signal, seed=_seed(utt))
+            if features.shape[0]:
+                yield utt, features
+
+    ark.write_ark(arkfile, _features(), format='binary', scp=scpfile)
+
+
+def add_deltas(features, order, window=2):
+    """Return `features` with appended deltas up to `order`
+
+    This is a port of the Kaldi add-deltas executable (see
+    kaldi/src/feat/feature-functions.cc). The delta of order i is the
+    convolution of the delta of order i-1 with the regression filter
+    [-window, ..., window] / normalizer, the first and last frames
+    being replicated at the edges. The returned array has shape
+    (nframes, dim * (order + 1)).
+
+    """
+    regression = np.arange(-window, window + 1, dtype=np.float64)
+    regression /= (regression ** 2).sum()
+
+    # scales[i] is the filter giving the delta of order i
+    scales = [np.ones((1,))]
+    for _ in range(order):
+        scales.append(np.convolve(scales[-1], regression))
+
+    nframes = features.shape[0]
+    padded = np.pad(features, ((window * order, window * order), (0, 0)),
+                    mode='edge')
+
+    output = [features]
+    for scale in scales[1:]:
+        offset = window * order - (scale.shape[0] - 1) // 2
+        delta = np.zeros(features.shape, dtype=np.float64)
+        for j, weight in enumerate(scale):
+            if weight != 0:
+                delta += weight * padded[offset + j:offset + j + nframes]
+        output.append(delta.astype(features.dtype))
+    return np.hstack(output)
+
+
+def cmvn_stats(features):
+    """Return the CMVN statistics of `features` as in compute-cmvn-stats
+
+    The statistics are a float64 array of shape (2, dim + 1): the
+    first row is the sum of the frames followed by the frames count,
+    the second row the sum of the squared frames followed by 0.
+
+    """
+    features = features.astype(np.float64)
+    stats = np.zeros((2, features.shape[1] + 1), dtype=np.float64)
+    stats[0, :-1] = features.sum(axis=0)
+    stats[1, :-1] = np.einsum('ij,ij->j', features, features)
+    stats[0, -1] = features.shape[0]
+    return stats
+
+
+def delta_cmvn_job(arkfile, scpfile, delta_order=0, utt2spk=None):
+    """Add deltas and accumulate CMVN statistics in a single pass
+
+    Read the features in `arkfile` and, if `delta_order` > 0, rewrite
+    them with deltas appended in `arkfile` and `scpfile`. If
+    `utt2spk` is not None, return a dict speaker -> CMVN statistics,
+    computed on the features without deltas, else return None.
+
+    """
+    stats = None if utt2spk is None else {}
+
+    def _process(utterances):
+        for utt, features in utterances:
+            if stats is not None:
+                spk = utt2spk[utt]
+                utt_stats = cmvn_stats(features)
+                if spk in stats:
+                    stats[spk] += utt_stats
+                else:
+                    stats[spk] = utt_stats
+
+            if delta_order > 0:
+                yield utt, add_deltas(features, delta_order)
+
+    if delta_order > 0:
+        # the features are read from a renamed copy of the ark, which
+        # is rewritten with deltas
+        tmp = arkfile + '_tmp'
+        os.rename(arkfile, tmp)
+        try:
+            ark.write_ark(
+                arkfile, _process(ark.read_ark(tmp)),
+                format='binary', scp=scpfile)
+        finally:
+            os.remove(tmp)
+    else:
+        for _ in _process(ark.read_ark(arkfile)):
+            pass
+
+    return stats
@@ -14,6 +14,7 @@
 # along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
 
 from .path import kaldi_path
+from .kaldi_data import KaldiData
 from .abkhazia2kaldi import Abkhazia2Kaldi
 from .options import *
 from .ark import *
@@ -20,6 +20,7 @@ import shutil
 
 from abkhazia.utils import config, logger, open_utf8
 from abkhazia.corpus.corpus_saver import CorpusSaver
+from abkhazia.kaldi.kaldi_data import KaldiData
 
 
 class Abkhazia2Kaldi(object):
@@ -40,12 +41,18 @@ class Abkhazia2Kaldi(object):
     copied to a different machine after its creation, there might be
     some machine-dependent differences in the required orders).
 
+    The data files come from a KaldiData shared by all the recipes on
+    the corpus, so that they are built only once per version of the
+    corpus. The dictionary files, only read by Kaldi, are linked to
+    the shared ones, the utterances files are copied.
+
     '''
     def __init__(self, corpus, recipe_dir,
                  name='recipe', log=logger.null_logger()):
-        # filter out short utterances
-        self.corpus = corpus.subcorpus(
-            self._desired_utterances(corpus), validate=False)
+        # the data files, without short utterances
+        self.data = KaldiData.for_corpus(
+            corpus, os.path.join(recipe_dir, 'kaldi_data'), log=log)
+        self._source = corpus
 
         # init the recipe directory, create it if needed
         self.recipe_dir = recipe_dir
@@ -62,6 +69,11 @@ class Abkhazia2Kaldi(object):
         self.share_dir = pkg_resources.resource_filename(
             pkg_resources.Requirement.parse('abkhazia'), 'abkhazia/share')
 
+    @property
+    def corpus(self):
+        """The corpus without the utterances too short for Kaldi"""
+        return self.data.corpus
+
     def _local_path(self):
         """Return the directory data/local/self.name, create it if needed"""
         dict_path = os.path.join(self.recipe_dir, 'data', 'local', self.name)
@@ -75,25 +87,27 @@ class Abkhazia2Kaldi(object):
             os.makedirs(out)
         return out
 
-    @staticmethod
-    def _desired_utterances(corpus, min_duration=0.015):
-        """Filter out utterances too short for kaldi (less than 15ms)
+    def _copy(self, source, target):
+        """Copy the file `source` of the shared data to `target`
 
-        They result in empty feature files that trigger kaldi
-        warnings. This is used to filter them out of the text,
-        utt2spk, segments and wav.scp files.
+        A copy (not a link) because the Kaldi data directory scripts
+        (such as utils/fix_data_dir.sh) rewrite the files in place.
 
         """
-        # TODO we have already that somewhere in validator (or in
-        # features?)
-        return [utt for utt, dur in corpus.utt2duration().iteritems()
-                if dur >= min_duration]
+        shutil.copyfile(self.data.path(*source), target)
+        return target
+
+    def _link(self, source, target):
+        """Link `target` to the file `source` of the shared data"""
+        if os.path.lexists(target):
+            os.remove(target)
+        os.symlink(self.data.path(*source), target)
+        return target
 
     def setup_lexicon(self):
         """Create data/local/self.name/lexicon.txt"""
-        target = os.path.join(self._local_path(), 'lexicon.txt')
-        CorpusSaver.save_lexicon(self.corpus, target)
-        return target
+        return self._link(('dict', 'lexicon.txt'),
+                          os.path.join(self._local_path(), 'lexicon.txt'))
 
     def setup_phone_lexicon(self):
         """Create data/local/self.name/lexicon.txt"""
@@ -108,7 +122,10 @@ class Abkhazia2Kaldi(object):
             phones += [line.strip()
                        for line in open_utf8(origin, 'r').xreadlines()]
 
-        # create 'phone' lexicon
+        # create 'phone' lexicon, not writing through a link to the
+        # shared data
+        if os.path.lexists(target):
+            os.remove(target)
         with open_utf8(target, 'w') as out:
             for word in phones:
                 out.write(u'{0} {0}\n'.format(word))
@@ -121,63 +138,45 @@ class Abkhazia2Kaldi(object):
 
     def setup_phones(self):
         """Create data/local/self.name/nonsilence_phones.txt"""
-        target = os.path.join(self._local_path(), 'nonsilence_phones.txt')
-        with open_utf8(target, 'w') as out:
-            for symbol in self.corpus.phones.iterkeys():
-                out.write(u"{0}\n".format(symbol))
+        self._link(('dict', 'nonsilence_phones.txt'),
+                   os.path.join(self._local_path(), 'nonsilence_phones.txt'))
 
     def setup_silences(self):
         """Create data/local/self.name/{silences, optional_silence}.txt"""
-        local_path = self._local_path()
-        CorpusSaver.save_silences(
-            self.corpus, os.path.join(local_path, 'silence_phones.txt'))
-
-        target = os.path.join(local_path, 'optional_silence.txt')
-        with open_utf8(target, 'w') as out:
-            out.write(u'SIL\n')
+        for name in ('silence_phones.txt', 'optional_silence.txt'):
+            self._link(('dict', name), os.path.join(self._local_path(), name))
 
     def setup_variants(self):
         """Create data/local/`name`/extra_questions.txt"""
-        target = os.path.join(self._local_path(), 'extra_questions.txt')
-        CorpusSaver.save_variants(self.corpus, target)
+        self._link(('dict', 'extra_questions.txt'),
+                   os.path.join(self._local_path(), 'extra_questions.txt'))
 
     def setup_text(self):
         """Create text in data directory"""
-        target = os.path.join(self._output_path(), 'text')
-        CorpusSaver.save_text(self.corpus, target)
-        return target
+        return self._copy(('data', 'text'),
+                          os.path.join(self._output_path(), 'text'))
 
     def setup_utt2spk(self):
         """Create utt2spk and spk2utt in data directory"""
-        target = os.path.join(self._output_path(), 'utt2spk')
-        CorpusSaver.save_utt2spk(self.corpus, target)
-
-        # create spk2utt
-        target = os.path.join(self._output_path(), 'spk2utt')
-        with open_utf8(target, 'w') as out:
-            for spk, utt in sorted(self.corpus.spk2utt().iteritems()):
-                out.write(u'{} {}\n'.format(spk, ' '.join(sorted(utt))))
+        for name in ('utt2spk', 'spk2utt'):
+            self._copy(('data', name), os.path.join(self._output_path(), name))
 
     def setup_segments(self,):
         """Create segments in data directory"""
-        target = os.path.join(self._output_path(), 'segments')
-        # write only if starts and stops are specified in segments.txt
-        if self.corpus.has_several_utts_per_wav():
-            CorpusSaver.save_segments(self.corpus, target)
+        # present only if starts and stops are specified in segments.txt
+        if os.path.isfile(self.data.path('data', 'segments')):
+            self._copy(('data', 'segments'),
+                       os.path.join(self._output_path(), 'segments'))
 
     def setup_wav(self):
         """Create wav.scp in data directory"""
-        target = os.path.join(self._output_path(), 'wav.scp')
-        wavs = set(w for w, _, _ in self.corpus.segments.itervalues())
-        with open_utf8(target, 'w') as out:
-            for wav in sorted(wavs):
-                wav_path = os.path.join(self.corpus.wav_folder, wav)
-                out.write(u'{} {}\n'.format(wav, wav_path))
+        self._copy(('data', 'wav.scp'),
+                   os.path.join(self._output_path(), 'wav.scp'))
 
     def setup_wav_folder(self):
         """using a symbolic link to avoid copying voluminous data"""
         target = os.path.join(self.recipe_dir, 'wavs')
-        CorpusSaver.save_wavs(self.corpus, target)
+        CorpusSaver.save_wavs(self._source, target)
 
     def setup_kaldi_folders(self):
         """Create steps, utils and conf subdirectories in self.recipe_dir"""
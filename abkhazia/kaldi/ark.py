@@ -16,26 +16,89 @@
 
 Read/write ark files into numpy arrays or h5features file.
 
-Provides the ark_to_dict, ark_to_h5f and scp_to_h5f functions to
-convert Kaldi ark files to Python dictionaries and h5features files
-respectively.
+Provides the read_ark function to iterate over the utterances of a
+Kaldi ark file, the read_posteriors function to iterate over the
+posteriors of a Kaldi binary posterior ark, the ScpReader class for
+random access to utterances indexed in a scp file, and the
+ark_to_dict, ark_to_h5f and scp_to_h5f functions to convert Kaldi ark
+files to Python dictionaries and h5features files respectively.
 
-Provides the dict_to_ark function to write ark files from numpy
-arrays.
+Provides the write_ark and dict_to_ark functions to write ark files
+from numpy arrays.
 
 """
 
+import collections
+import itertools
+import mmap
 import os
+import Queue
 import re
 import struct
-import tempfile
+import sys
+import threading
 
 import numpy as np
 import h5features as h5f
 import h5py
 
 import abkhazia.utils as utils
-from abkhazia.kaldi import kaldi_path
+
+
+def read_ark(arkfile):
+    """Yield (utt_id, array) pairs read from a Kaldi ark file
+
+    The utterances are read lazily, in the order of the ark file.
+
+    The arks are memory-mapped and read natively (without calling
+    Kaldi binaries). They can store float or double matrices (BFM,
+    BDM), float or double vectors (BFV, BDV) and compressed matrices
+    (CM, CM2, CM3). The uncompressed arrays are read-only views on
+    the file, with no copy. The compressed matrices are decompressed
+    as float32 arrays. Text arks are read as float64 arrays.
+
+    Parameters:
+    -----------
+
+    arkfile (str): path to a Kaldi ark file, either in binary or text
+        format.
+
+    Raise:
+    ------
+
+    IOError if the ark file is badly formatted or stores an
+    unsupported type of data.
+
+    """
+    read = _read_binary if _is_binary(arkfile) else _read_text
+    return _read_objects(arkfile, read)
+
+
+def read_posteriors(arkfile):
+    """Yield (utt_id, (frames, ids, weights)) read from a posterior ark
+
+    The posteriors are the ones written by Kaldi binaries such as
+    lattice-to-post or post-to-phone-post, in binary format. For each
+    utterance they are given as three arrays of the same length:
+    `frames` the frame index of each posterior (int64), `ids` the
+    transition or phone id it refers to (int32) and `weights` its
+    value (float32). The utterances are read lazily, in the order of
+    the ark file.
+
+    Parameters:
+    -----------
+
+    arkfile (str): path to a Kaldi binary posterior ark
+
+    Raise:
+    ------
+
+    IOError if the ark file is not a binary posterior ark
+
+    """
+    if not _is_binary(arkfile):
+        raise IOError('{}: binary posterior ark expected'.format(arkfile))
+    return _read_objects(arkfile, _read_posterior)
 
 
 def ark_to_dict(arkfile):
@@ -51,20 +114,15 @@ def ark_to_dict(arkfile):
     -------
 
     A dictionary where keys are utterances ids (as str) and values are
-    features matrices (as 2D numpy arrays).
+    features matrices (as 2D numpy arrays). See read_ark for details.
 
     """
-    if not _is_binary(arkfile):
-        return _ark_to_dict_text(arkfile)
-
-    try:
-        return _ark_to_dict_binary(arkfile)
-    except AssertionError:
-        return _ark_to_dict_binary_bytext(arkfile)
+    return dict(read_ark(arkfile))
 
 
 def ark_to_h5f(ark_files, h5_file, h5_group='features',
                sample_frequency=100, tstart=0.0125,
+               chunk_size=1000, chunk_mb=256, njobs=1,
                log=utils.logger.null_logger()):
     """Convert a sequence of kaldi ark files into a single h5features file
 
@@ -72,6 +130,11 @@ def ark_to_h5f(ark_files, h5_file, h5_group='features',
     extra parameters for specifiying the time labels in the h5features
     file.
 
+    The utterances are read lazily and written by chunks, so the
+    memory usage is bounded whatever the size of the arks. The ark
+    files can be read in parallel, but are always written in the
+    order of `ark_files`.
+
     Parameters:
     -----------
 
@@ -87,6 +150,14 @@ def ark_to_h5f(ark_files, h5_file, h5_group='features',
 
     tstart (float): timestamp of the first feature vector
 
+    chunk_size (int): maximal number of utterances written at once,
+        default is 1000
+
+    chunk_mb (float): maximal size of the features written at once,
+        in MB, default is 256
+
+    njobs (int): number of ark files read in parallel, default is 1
+
     log (logging.Logger): optional log for messages
 
     Raise:
@@ -105,16 +176,19 @@ def ark_to_h5f(ark_files, h5_file, h5_group='features',
               's' if len(ark_files) else '',
               h5_file, h5_group)
 
+    chunks = (
+        _ark_to_data(ark, sample_frequency=sample_frequency, tstart=tstart,
+                     chunk_size=chunk_size, chunk_mb=chunk_mb, log=log)
+        for ark in ark_files)
+
     with h5f.Writer(h5_file) as fout:
-        for ark in ark_files:
-            log.debug('converting {}...'.format(os.path.basename(ark)))
-            fout.write(_ark_to_data(
-                ark, sample_frequency=sample_frequency, tstart=tstart),
-                       h5_group, append=True)
+        for data in _ordered_prefetch(chunks, njobs):
+            fout.write(data, h5_group, append=True)
 
 
 def scp_to_h5f(scp_file, h5_file, h5_group='features',
                sample_frequency=100, tstart=0.0125,
+               chunk_size=1000, chunk_mb=256, njobs=1,
                log=utils.logger.null_logger()):
     """Convert ark files referenced in `scp_file` into a h5features file
 
@@ -137,6 +211,8 @@ def scp_to_h5f(scp_file, h5_file, h5_group='features',
 
     tstart (float): timestamp of the first feature vector
 
+    chunk_size, chunk_mb, njobs: see ark_to_h5f
+
     log (logging.Logger): optional log for messages
 
     Raise:
@@ -148,17 +224,12 @@ def scp_to_h5f(scp_file, h5_file, h5_group='features',
 
     """
     # extract the ark files referenced in the scp
-    ark_files = set()
-    for n, line in enumerate(open(scp_file, 'r').readlines(), 1):
-        matched = re.match('^.* (.*):[0-9]*$', line)
-        if not matched:
-            raise IOError('Bad scp file line {}: {}'.format(n, scp_file))
-        ark_files.add(matched.group(1))
+    with ScpReader(scp_file) as scp:
+        ark_files = scp.arks()
 
     # sort them in natural order to have f.10.ark > f.9.ark. This is
     # important to concatenate features in order because some Kaldi
     # scripts assumes ordered features (with the rspecifier ark,s,cs).
-    ark_files = list(ark_files)
     ark_files.sort(key=utils.natural_sort_keys)
 
     log.info('writing {} ark files to {} in group {}'.format(
@@ -167,14 +238,124 @@ def scp_to_h5f(scp_file, h5_file, h5_group='features',
     # Then deleguate to ark_to_h5f
     ark_to_h5f(ark_files, h5_file, h5_group,
                sample_frequency=sample_frequency, tstart=tstart,
+               chunk_size=chunk_size, chunk_mb=chunk_mb, njobs=njobs,
                log=log)
 
 
-def dict_to_ark(arkfile, data, format='text'):
+class ScpReader(object):
+    """Random access to the utterances indexed in a Kaldi scp file
+
+    Each line of a scp file is 'utt_id ark_file:offset' where offset
+    is the position of the utterance data in the ark file. The reader
+    maps each ark file once, and reads an utterance by going straight
+    to its offset, so reading a subset of the utterances does not
+    touch the rest of the data.
+
+    Parameters:
+    -----------
+
+    scp_file (str): path to the scp file to read
+
+    Raise:
+    ------
+
+    IOError if the scp file is badly formatted
+
+    Example:
+    --------
+
+    >>> with ScpReader('feats.scp') as scp:
+    ...     array = scp['utt1']
+    ...     for utt_id, array in scp.read(['utt2', 'utt3']):
+    ...         pass
+
+    Iterating on the reader yields (utt_id, array) pairs in the order
+    of the scp file. See read_ark for details on the arrays.
+
+    """
+    def __init__(self, scp_file):
+        self.scp_file = scp_file
+
+        # utt_id -> (ark_file, offset) in the scp order
+        self._index = collections.OrderedDict()
+        for n, line in enumerate(open(scp_file, 'r'), 1):
+            matched = re.match('^(\S+) (.*):([0-9]+)$', line.rstrip('\n'))
+            if not matched:
+                raise IOError('Bad scp file line {}: {}'.format(n, scp_file))
+            utt_id, ark, offset = matched.groups()
+            self._index[utt_id] = (ark, int(offset))
+
+        # ark_file -> memory map, opened on first access
+        self._arks = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, utt_id):
+        return utt_id in self._index
+
+    def __getitem__(self, utt_id):
+        ark, offset = self._index[utt_id]
+        return self._read(ark, offset)
+
+    def __iter__(self):
+        return self.read()
+
+    def utts(self):
+        """Return the list of utterance ids in the order of the scp"""
+        return self._index.keys()
+
+    def arks(self):
+        """Return the list of ark files referenced in the scp"""
+        return list(set(ark for ark, _ in self._index.itervalues()))
+
+    def read(self, utt_ids=None):
+        """Yield (utt_id, array) pairs for the utterances in `utt_ids`
+
+        The utterances are read in the order of `utt_ids`, default is
+        all the utterances in the order of the scp. Raise KeyError if
+        an utterance is not in the scp.
+
+        """
+        for utt_id in self.utts() if utt_ids is None else utt_ids:
+            yield utt_id, self[utt_id]
+
+    def close(self):
+        """Release the ark files
+
+        The arrays already read remain valid, the ark files are
+        unmapped when they are no more referenced.
+
+        """
+        self._arks = {}
+
+    def _read(self, ark, offset):
+        try:
+            data = self._arks[ark]
+        except KeyError:
+            data = self._arks[ark] = _mmap(ark)
+
+        if data[offset:offset+2] == '\0B':
+            return _read_binary(data, offset, ark)[0]
+        return _read_text(data, offset, ark)[0]
+
+
+def dict_to_ark(arkfile, data, format='text', scp=None):
     """Write a data dictionary to a Kaldi ark file
 
     TODO for now time information from h5f is lost in ark
 
+    The utterances are written in sorted order, natively (without
+    calling Kaldi binaries). In binary format, float32 arrays are
+    written as BFM matrices (or BFV vectors), other arrays as BDM
+    matrices (or BDV vectors).
+
     Parameters:
     -----------
 
@@ -185,42 +366,180 @@ def dict_to_ark(arkfile, data, format='text'):
     format (str): must be 'text' or 'binary' to write a text or a
         binary ark file respectively, default is 'text'
 
+    scp (str): when specified, write a scp file indexing the
+        utterances in the ark, as the Kaldi wspecifier 'ark,scp:'
+
     Raise:
     ------
 
     RuntimeError if format is not 'text' or 'binary'
 
     """
-    if format is 'text':
-        _dict_to_txt_ark(arkfile, data)
-    elif format is 'binary':
-        with tempfile.NamedTemporaryFile(
-                dir=utils.config.get('abkhazia', 'tmp-directory')) as tmp:
-            _dict_to_txt_ark(tmp.name, data)
-
-            utils.jobs.run(
-                'copy-feats ark,t:{0} ark:{1}'.format(tmp.name, arkfile),
-                env=kaldi_path(),
-                stdout=open(os.devnull, 'w').write)
+    write_ark(arkfile, ((utt, data[utt]) for utt in sorted(data.iterkeys())),
+              format=format, scp=scp)
+
+
+def write_ark(arkfile, utterances, format='binary', scp=None):
+    """Write (utt_id, array) pairs to a Kaldi ark file
+
+    This is the streaming counterpart of dict_to_ark: the utterances
+    are written as they come from the `utterances` iterable, in that
+    order. Kaldi expects sorted utterances in most cases.
+
+    Parameters:
+    -----------
+
+    arkfile (str): path to the ark file to write
+
+    utterances (iterable): (utt_id, array) pairs to write
+
+    format (str): must be 'text' or 'binary', default is 'binary'
+
+    scp (str): when specified, write a scp file indexing the
+        utterances in the ark
+
+    Raise:
+    ------
+
+    RuntimeError if format is not 'text' or 'binary'
+
+    """
+    if format == 'text':
+        write = _write_text
+    elif format == 'binary':
+        write = _write_binary
     else:
         raise RuntimeError(
             'ark format must be "text" or "binary", it is "{}"'
             .format(format))
 
+    fscp = open(scp, 'w') if scp else None
+    try:
+        with open(arkfile, 'wb') as fark:
+            for utt, array in utterances:
+                fark.write(utt + ' ')
+                if fscp:
+                    fscp.write('{} {}:{}\n'.format(utt, arkfile, fark.tell()))
+                write(fark, np.asarray(array))
+    finally:
+        if fscp:
+            fscp.close()
+
 
 #
 # Functions above should be considered private
 #
 
 
-def _ark_to_data(arkfile, sample_frequency=100, tstart=0.0125):
-    """ark to h5features.Data"""
-    d = ark_to_dict(arkfile)
+def _ark_to_data(arkfile, sample_frequency=100, tstart=0.0125,
+                 chunk_size=1000, chunk_mb=256,
+                 log=utils.logger.null_logger()):
+    """Yield h5features.Data chunks read from an ark file
 
-    times = [np.arange(val.shape[0], dtype=float) / sample_frequency + tstart
-             for val in d.values()]
+    A chunk is yielded each time `chunk_size` utterances or
+    `chunk_mb` MB of features are read.
+
+    """
+    log.debug('converting {}...'.format(os.path.basename(arkfile)))
+
+    def _data(items, features):
+        times = [np.arange(f.shape[0], dtype=float) / sample_frequency + tstart
+                 for f in features]
+        return h5f.Data(items, times, features)
+
+    items, features, size = [], [], 0
+    for utt, array in read_ark(arkfile):
+        items.append(utt)
+        features.append(array)
+        size += array.nbytes
+        if len(items) >= chunk_size or size >= chunk_mb * 2**20:
+            yield _data(items, features)
+            items, features, size = [], [], 0
+
+    if items:
+        yield _data(items, features)
 
-    return h5f.Data(d.keys(), times, d.values())
+
+def _ordered_prefetch(sources, njobs=1, buffer_size=2):
+    """Yield the items of the iterables in `sources`, in order
+
+    Up to `njobs` iterables are consumed ahead in background threads,
+    each one buffering at most `buffer_size` items. With `njobs` = 1
+    the items are simply yielded from the current thread.
+
+    Exceptions raised by an iterable are raised again when its items
+    are reached.
+
+    """
+    if njobs <= 1:
+        for source in sources:
+            for item in source:
+                yield item
+        return
+
+    stop = threading.Event()
+
+    def _consume(source, queue):
+        def _put(item):
+            # give up if the consumer stopped before the end
+            while not stop.is_set():
+                try:
+                    queue.put(item, timeout=0.1)
+                    return True
+                except Queue.Full:
+                    pass
+            return False
+
+        try:
+            for item in source:
+                if not _put((True, item)):
+                    return
+            _put((False, None))
+        except Exception:
+            _put((False, sys.exc_info()))
+
+    def _start(source):
+        queue = Queue.Queue(maxsize=buffer_size)
+        thread = threading.Thread(target=_consume, args=(source, queue))
+        thread.daemon = True
+        thread.start()
+        return queue
+
+    sources = iter(sources)
+    queues = collections.deque(
+        _start(source) for source in itertools.islice(sources, njobs))
+    try:
+        while queues:
+            queue = queues.popleft()
+            while True:
+                running, item = queue.get()
+                if not running:
+                    break
+                yield item
+
+            if item is not None:
+                raise item[0], item[1], item[2]
+
+            for source in itertools.islice(sources, 1):
+                queues.append(_start(source))
+    finally:
+        stop.set()
+
+
+def _read_objects(arkfile, read):
+    """Yield (utt_id, object) from `arkfile`, objects parsed by `read`"""
+    data = _mmap(arkfile)
+    offset = _skip_spaces(data, 0)
+    while offset < len(data):
+        # the utterance id is terminated by a space
+        end = data.find(' ', offset)
+        if end == -1:
+            raise IOError('{}: truncated utterance id at byte {}'
+                          .format(arkfile, offset))
+        utt_id = data[offset:end]
+        obj, offset = read(data, end + 1, arkfile)
+        yield utt_id, obj
+        offset = _skip_spaces(data, offset)
 
 
 def _is_binary(arkfile):
@@ -231,102 +550,258 @@ def _is_binary(arkfile):
     return bool(open(arkfile, 'rb').read(1024).translate(None, textchars))
 
 
-def _ark_to_dict_binary(arkfile):
-    res = {}
-    with open(arkfile) as fin:
-        while True:
-            # TODO break if empty buffer here
-            fname = ''
-            c = fin.read(1)
-            if c == '':  # EOF (EOFError not raised by read(empty))
-                break
-            while c != ' ':
-                fname += c
-                c = fin.read(1)
-
-            # end of fname
-            fin.read(1)
-
-            # data type
-            assert fin.read(4) == 'BFM ', 'type not supported'
-
-            # nrows type
-            assert struct.unpack('b', fin.read(1))[0] == 4, \
-                'type not supported'
-            nrows = struct.unpack('i', fin.read(4))[0]
-
-            # ncols type:
-            assert struct.unpack('b', fin.read(1))[0] == 4, \
-                'type not supported'
-            ncols = struct.unpack('i', fin.read(4))[0]
-
-            # data
-            size = nrows * ncols * 4
-            data = np.fromstring(
-                fin.read(size), dtype=np.float32).reshape((nrows, ncols))
-            res[fname] = data
-    return res
-
-
-def _ark_to_dict_binary_bytext(arkfile):
-    """Convert a binary ark to text, and load it as numpy arrays"""
-    try:
-        # copy-feats converts binary ark to text ark
-        tempdir = tempfile.mkdtemp(
-            dir=utils.config.get('abkhazia', 'tmp-directory'))
-        txtfile = os.path.join(tempdir, 'txt')
-        utils.jobs.run(
-            'copy-feats ark:{0} ark,t:{1}'.format(arkfile, txtfile),
-            env=kaldi_path(), stdout=open(os.devnull, 'w').write)
-
-        # load the converted text ark as a dict
-        return _ark_to_dict_text(txtfile)
-    finally:
-        utils.remove(tempdir, safe=True)
+def _mmap(arkfile):
+    """Return the content of `arkfile` as a read-only memory map
+
+    The file can be closed once mapped. The map is not closed
+    explicitly because arrays built on it can outlive the reader, it
+    is unmapped when no more referenced.
 
+    """
+    with open(arkfile, 'rb') as fin:
+        if os.fstat(fin.fileno()).st_size == 0:
+            return ''
+        return mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+# Kaldi binary types of uncompressed data, mapped to their numpy
+# dtype and number of dimensions
+_BINARY_TYPES = {
+    'FM': (np.dtype('<f4'), 2),
+    'DM': (np.dtype('<f8'), 2),
+    'FV': (np.dtype('<f4'), 1),
+    'DV': (np.dtype('<f8'), 1)}
+
+
+def _read_binary(data, offset, arkfile=''):
+    """Read a Kaldi binary object from `data` at `offset`
+
+    `data` is a buffer and `offset` points to the '\\0B' binary
+    marker following an utterance id in an ark. Return the tuple
+    (array, offset) with the offset of the next utterance.
+
+    """
+    def error(msg):
+        return IOError('{}: {} at byte {}'.format(arkfile, msg, offset))
+
+    if data[offset:offset+2] != '\0B':
+        raise error('binary marker expected')
+
+    # the type token is terminated by a space
+    end = data.find(' ', offset + 2, offset + 8)
+    token = data[offset+2:end] if end != -1 else None
 
-def _ark_to_dict_text(arkfile):
-    """Load a text ark to utterances indexed numpy arrays"""
-    return {utt: data for utt, data in _yield_utt(arkfile)}
+    if token in _BINARY_TYPES:
+        dtype, ndim = _BINARY_TYPES[token]
+        shape, offset = _read_shape(data, end + 1, ndim, error)
+        size = int(np.prod(shape))
+        array = np.frombuffer(
+            data, dtype=dtype, count=size, offset=offset).reshape(shape)
+        return array, offset + size * dtype.itemsize
 
+    if token in ('CM', 'CM2', 'CM3'):
+        return _read_compressed(data, end + 1, token)
 
-def _str2np(data):
-    """Convert a list of str to a np.array of float"""
-    npdata = np.zeros((len(data), len(data[0].split())))
-    for i, line in enumerate(data):
+    raise error('unsupported data type {}'.format(token))
+
+
+def _read_shape(data, offset, ndim, error):
+    """Read `ndim` Kaldi int32 from `data`, return (shape, offset)"""
+    shape = []
+    for _ in range(ndim):
         try:
-            npdata[i, :] = map(float, line.split())
-        except ValueError:
-            raise ValueError(
-                'error converting str to float in:', line.strip())
-    return npdata
-
-
-def _yield_utt(arkfile):
-    """Yield (utt_id, data) tuples read from a text `arkfile`"""
-    utt_id = None
-    data = []
-
-    for line in open(arkfile, 'r'):
-        # a new utterance is starting, yield the previous utt if any
-        if not line.startswith('  '):
-            if utt_id:
-                yield utt_id, _str2np(data)
-                utt_id, data = None, []
-            utt_id = line[:-2].strip()
-        else:  # line of floats
-            data.append(line.replace(']', '').strip())
-
-    # yield the final utt
-    if utt_id:
-        yield utt_id, _str2np(data)
-
-
-def _dict_to_txt_ark(arkfile, data, sort=True):
-    """Save `data` as a Kaldi ark `arkfile`"""
-    with open(arkfile, 'w') as fark:
-        for utt in sorted(data.iterkeys()) if sort else data.iterkeys():
-            fark.write(utt + '  [\n')
-            for vec in data[utt][:-1]:
-                fark.write('  ' + ' '.join(str(v) for v in vec) + ' \n')
-            fark.write('  ' + ' '.join(str(v) for v in data[utt][-1]) + ' ]\n')
+            size, value = struct.unpack_from('<bi', data, offset)
+        except struct.error:
+            raise error('truncated data')
+        if size != 4:
+            raise error('int32 expected')
+        shape.append(value)
+        offset += 5
+    return tuple(shape), offset
+
+
+# a (id, weight) pair of a Kaldi posterior, each value is preceded
+# by its size in bytes
+_POSTERIOR_PAIR = np.dtype([
+    ('isize', 'i1'), ('id', '<i4'), ('wsize', 'i1'), ('weight', '<f4')])
+
+
+def _read_posterior(data, offset, arkfile=''):
+    """Read a Kaldi binary posterior from `data` at `offset`
+
+    The posterior is written as the number of frames followed, for
+    each frame, by the number of its pairs and the (id, weight) pairs
+    themselves. Only the frame headers are walked in Python, the
+    pairs are then decoded at once. Return ((frames, ids, weights),
+    offset) with the offset of the next utterance.
+
+    """
+    def error(msg):
+        return IOError('{}: {} at byte {}'.format(arkfile, msg, offset))
+
+    if data[offset:offset+2] != '\0B':
+        raise error('binary marker expected')
+
+    (nframes,), position = _read_shape(data, offset + 2, 1, error)
+    starts = np.zeros((nframes,), dtype=np.int64)
+    counts = np.zeros((nframes,), dtype=np.int64)
+    for frame in range(nframes):
+        (count,), position = _read_shape(data, position, 1, error)
+        starts[frame] = position
+        counts[frame] = count
+        position += count * _POSTERIOR_PAIR.itemsize
+    if position > len(data):
+        raise error('truncated data')
+
+    # the byte offsets of all the pairs
+    frames = np.repeat(np.arange(nframes), counts)
+    firsts = np.repeat(np.cumsum(counts) - counts, counts)
+    pairs = np.repeat(starts, counts) + _POSTERIOR_PAIR.itemsize * (
+        np.arange(len(frames)) - firsts)
+
+    raw = np.frombuffer(data, dtype=np.uint8, count=position - offset,
+                        offset=offset)
+    pairs = raw[(pairs - offset)[:, None] + np.arange(
+        _POSTERIOR_PAIR.itemsize)].view(_POSTERIOR_PAIR).ravel()
+    if not ((pairs['isize'] == 4) & (pairs['wsize'] == 4)).all():
+        raise error('int32 and float expected')
+
+    return (frames, pairs['id'], pairs['weight']), position
+
+
+def _read_compressed(data, offset, token):
+    """Decompress a Kaldi compressed matrix, return (array, offset)
+
+    This is a port of the CompressedMatrix::CopyToMat method from
+    kaldi/src/matrix/compressed-matrix.cc. The global header gives
+    the range of the matrix values. CM2 and CM3 store the values as
+    uint16 and uint8 in this range. CM stores a per-column header of
+    4 percentiles and the values of each column as uint8 interpolated
+    between those percentiles.
+
+    """
+    min_value, range_, nrows, ncols = struct.unpack_from('<ffii', data, offset)
+    offset += 16
+    min_value, range_ = np.float32(min_value), np.float32(range_)
+    size = nrows * ncols
+
+    if token == 'CM2':
+        values = np.frombuffer(data, dtype='<u2', count=size, offset=offset)
+        array = min_value + range_ * np.float32(1.0 / 65535) * values
+        return array.reshape(nrows, ncols), offset + 2 * size
+
+    if token == 'CM3':
+        values = np.frombuffer(data, dtype=np.uint8, count=size, offset=offset)
+        array = min_value + range_ * np.float32(1.0 / 255) * values
+        return array.reshape(nrows, ncols), offset + size
+
+    # CM: per column headers of percentiles 0, 25, 75 and 100
+    headers = np.frombuffer(
+        data, dtype='<u2', count=4 * ncols, offset=offset).reshape(ncols, 4)
+    offset += 8 * ncols
+    p0, p25, p75, p100 = (
+        min_value + range_ * np.float32(1.0 / 65535) * headers[:, i:i+1]
+        for i in range(4))
+
+    # values are stored column by column
+    values = np.frombuffer(
+        data, dtype=np.uint8, count=size, offset=offset).reshape(ncols, nrows)
+    values = values.astype(np.float32)
+    array = np.where(
+        values <= 64,
+        p0 + (p25 - p0) * values * np.float32(1 / 64.),
+        np.where(
+            values <= 192,
+            p25 + (p75 - p25) * (values - 64) * np.float32(1 / 128.),
+            p75 + (p100 - p75) * (values - 192) * np.float32(1 / 63.)))
+    return np.ascontiguousarray(array.T), offset + size
+
+
+def _read_text(data, offset, arkfile=''):
+    """Read a Kaldi text matrix or vector from `data` at `offset`
+
+    `data` is a buffer and `offset` points to the data following an
+    utterance id in a text ark. Return the tuple (array, offset) with
+    the offset of the next utterance.
+
+    The numbers of the matrix or vector are converted by a single
+    call to np.fromstring.
+
+    """
+    end = data.find(']', offset)
+    if end == -1:
+        raise IOError('{}: truncated text data at byte {}'
+                      .format(arkfile, offset))
+    block = data[offset:end].replace('[', ' ', 1)
+
+    # a matrix starts with a newline after '[', a vector does not
+    if block.lstrip(' ').startswith('\n'):
+        block = block.rstrip(' ')
+        nrows = block.count('\n') - block.endswith('\n')
+        ncols = len(block.split('\n', 2)[1].split())
+        shape = (nrows, ncols)
+    else:
+        shape = (len(block.split()),)
+
+    if not np.prod(shape):
+        return np.zeros(shape), end + 1
+
+    # np.fromstring stops silently at the first invalid number
+    array = np.fromstring(block, dtype=np.float64, sep=' ')
+    if array.size != np.prod(shape):
+        raise ValueError('{}: error converting str to float at byte {}'
+                         .format(arkfile, offset))
+    return array.reshape(shape), end + 1
+
+
+def _skip_spaces(data, offset):
+    """Return the offset of the next non space character in `data`"""
+    while offset < len(data) and data[offset] in ' \t\r\n':
+        offset += 1
+    return offset
+
+
+def _write_binary(fark, array):
+    """Write `array` as a Kaldi binary matrix or vector in `fark`"""
+    if array.ndim not in (1, 2):
+        raise ValueError(
+            'cannot write a {}-dimensional array in ark'.format(array.ndim))
+
+    dtype = np.dtype('<f4' if array.dtype == np.float32 else '<f8')
+    token = ('F' if dtype.itemsize == 4 else 'D') + (
+        'M' if array.ndim == 2 else 'V')
+
+    fark.write('\0B' + token + ' ' + ''.join(
+        struct.pack('<bi', 4, dim) for dim in array.shape))
+    np.ascontiguousarray(array, dtype=dtype).tofile(fark)
+
+
+def _write_text(fark, array):
+    """Write `array` as a Kaldi text matrix or vector in `fark`
+
+    The values of the whole array are formatted in a single call.
+    float32 values are written with 9 significant digits, others with
+    17, the digits needed to read back the same values.
+
+    An empty matrix is written as '[ ]' on two lines, as Kaldi does
+    for a matrix without columns, and is read back as a (0, 0) matrix:
+    the text format does not keep the dimensions of an empty matrix.
+
+    """
+    fmt = '%.9g' if array.dtype == np.float32 else '%.17g'
+
+    if array.ndim == 1:
+        fark.write(
+            ' [ ' + ''.join([fmt + ' '] * array.size) % tuple(array.tolist())
+            + ']\n')
+    elif array.ndim == 2:
+        if array.size == 0:
+            fark.write(' [\n ]\n')
+            return
+
+        row = '  ' + ' '.join([fmt] * array.shape[1]) + ' \n'
+        text = (row * array.shape[0]) % tuple(array.ravel().tolist())
+        fark.write(' [\n' + text[:-2] + ' ]\n')
+    else:
+        raise ValueError(
+            'cannot write a {}-dimensional array in ark'.format(array.ndim))
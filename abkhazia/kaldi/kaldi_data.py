@@ -0,0 +1,256 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Provides the KaldiData class, a Kaldi data directory shared by recipes"""
+
+import errno
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from abkhazia.utils import logger, open_utf8
+from abkhazia.corpus.corpus_cache import CorpusCache
+from abkhazia.corpus.corpus_saver import CorpusSaver
+
+
+class KaldiData(object):
+    """The Kaldi data files of a corpus, built once and shared by recipes
+
+    corpus : the abkhazia corpus to convert
+
+    directory : where the versions of the data are stored. For a
+      corpus loaded from a directory this is the 'kaldi' subdirectory
+      of its cache (see the for_corpus method).
+
+    log : the logger to write in
+
+    fallback : an optional directory used instead of `directory` when
+      it cannot be written (on a read-only corpus for instance)
+
+    A version of the data is stored in a subdirectory named after the
+    fingerprint of the corpus (see Corpus.fingerprint) and the
+    location of its wavs. It is built on first use and reused as long
+    as the corpus is not modified. A version contains:
+
+    - dict/ : lexicon.txt, nonsilence_phones.txt, silence_phones.txt,
+      optional_silence.txt and extra_questions.txt
+
+    - data/ : text, utt2spk, spk2utt, wav.scp and segments (only if
+      several utterances share a wav)
+
+    The utterances shorter than `min_duration` are filtered out, as
+    they result in empty feature files that trigger Kaldi warnings.
+    The recipes copy the files they need (see Abkhazia2Kaldi) and must
+    not modify them in place.
+
+    """
+    version = '1'
+    """Version of the data format, the data is rebuilt on mismatch"""
+
+    min_duration = 0.015
+    """Minimal duration of the retained utterances, in seconds"""
+
+    max_versions = 4
+    """Number of versions kept, the least recently used are removed"""
+
+    evict_delay = 3600
+    """Delay in seconds after its last use before a version is removed"""
+
+    def __init__(self, corpus, directory, log=logger.null_logger(),
+                 fallback=None):
+        self.directory = os.path.abspath(directory)
+        self.fallback = fallback
+        self.log = log
+        self._source = corpus
+        self._corpus = None
+        self._path = None
+
+    @classmethod
+    def for_corpus(cls, corpus, default, log=logger.null_logger()):
+        """Return the KaldiData of `corpus`
+
+        The data is stored in `corpus.directory`/cache/kaldi if the
+        corpus has been loaded from a directory, else in `default`.
+        The data falls back to `default` if the corpus directory
+        cannot be written.
+
+        """
+        if getattr(corpus, 'directory', None) is None:
+            return cls(corpus, default, log=log)
+        return cls(
+            corpus,
+            os.path.join(corpus.directory, CorpusCache.directory, 'kaldi'),
+            log=log, fallback=default)
+
+    @property
+    def corpus(self):
+        """The corpus restricted to the retained utterances"""
+        if self._corpus is None:
+            with open_utf8(self.path('data', 'utt2spk'), 'r') as fin:
+                utts = [line.split()[0] for line in fin if line.strip()]
+            self._corpus = self._source.subcorpus(utts, validate=False)
+        return self._corpus
+
+    @staticmethod
+    def key(fingerprint, wav_folder):
+        """Return the name of the version of the data for a corpus"""
+        return hashlib.sha1(u'{}\0{}'.format(
+            fingerprint, os.path.abspath(wav_folder))
+                            .encode('utf8')).hexdigest()
+
+    def path(self, *names):
+        """Return the path to `names` in the data, built if needed"""
+        if self._path is None:
+            self._path = self._prepare()
+        return os.path.join(self._path, *names)
+
+    def _prepare(self):
+        """Return the directory of the up to date data, build it if needed"""
+        fingerprint = self._source.fingerprint()
+        key = self.key(fingerprint, self._source.wav_folder)
+        path = os.path.join(self.directory, key)
+        manifest = os.path.join(path, 'manifest.json')
+
+        try:
+            if json.load(open(manifest, 'r'))['version'] == self.version:
+                self.log.debug('using Kaldi data from %s', path)
+                # the modification time of the manifest is the last use
+                os.utime(manifest, None)
+                return path
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+
+            # the data is built aside and moved in place once complete
+            tmp = tempfile.mkdtemp(dir=self.directory, prefix='tmp.')
+        except (IOError, OSError) as err:
+            if self.fallback is None:
+                raise
+            self.log.warning(
+                'cannot write Kaldi data in %s (%s), using %s',
+                self.directory, err, self.fallback)
+            self.directory, self.fallback = (
+                os.path.abspath(self.fallback), None)
+            return self._prepare()
+
+        self.log.info('preparing Kaldi data in %s', path)
+        os.chmod(tmp, 0o755)
+        try:
+            self._write(tmp)
+            with open(os.path.join(tmp, 'manifest.json'), 'w') as fout:
+                json.dump({'version': self.version, 'key': key,
+                           'fingerprint': fingerprint,
+                           'wav_folder': self._source.wav_folder,
+                           'created': time.time()}, fout)
+
+            if os.path.isdir(path):  # an outdated version of the format
+                self._remove(path)
+            try:
+                os.rename(tmp, path)
+            except OSError as err:
+                # built concurrently by another process
+                if err.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                    raise
+        finally:
+            if os.path.isdir(tmp):
+                shutil.rmtree(tmp)
+
+        self._evict(keep=key)
+        return path
+
+    def _write(self, path):
+        """Write the data of the retained utterances in `path`"""
+        utt2dur = self._source.utt2duration()
+        self._corpus = self._source.subcorpus(
+            [utt for utt, dur in utt2dur.iteritems()
+             if dur >= self.min_duration], validate=False)
+        corpus = self._corpus
+
+        local = os.path.join(path, 'dict')
+        data = os.path.join(path, 'data')
+        for directory in (local, data):
+            os.makedirs(directory)
+
+        # dictionary
+        CorpusSaver.save_lexicon(
+            corpus, os.path.join(local, 'lexicon.txt'))
+        with open_utf8(os.path.join(
+                local, 'nonsilence_phones.txt'), 'w') as out:
+            for symbol in corpus.phones.iterkeys():
+                out.write(u'{0}\n'.format(symbol))
+        CorpusSaver.save_silences(
+            corpus, os.path.join(local, 'silence_phones.txt'))
+        with open_utf8(os.path.join(
+                local, 'optional_silence.txt'), 'w') as out:
+            out.write(u'SIL\n')
+        CorpusSaver.save_variants(
+            corpus, os.path.join(local, 'extra_questions.txt'))
+
+        # utterances
+        CorpusSaver.save_text(corpus, os.path.join(data, 'text'))
+        CorpusSaver.save_utt2spk(corpus, os.path.join(data, 'utt2spk'))
+        with open_utf8(os.path.join(data, 'spk2utt'), 'w') as out:
+            for spk, utt in sorted(corpus.spk2utt().iteritems()):
+                out.write(u'{} {}\n'.format(spk, ' '.join(sorted(utt))))
+
+        # write segments only if starts and stops are specified
+        if corpus.has_several_utts_per_wav():
+            CorpusSaver.save_segments(corpus, os.path.join(data, 'segments'))
+
+        wavs = set(w for w, _, _ in corpus.segments.itervalues())
+        with open_utf8(os.path.join(data, 'wav.scp'), 'w') as out:
+            for wav in sorted(wavs):
+                out.write(u'{} {}\n'.format(
+                    wav, os.path.join(corpus.wav_folder, wav)))
+
+    def _evict(self, keep):
+        """Remove the least recently used versions but `keep`
+
+        The versions used for less than `evict_delay` seconds are kept,
+        as they may be read by a running recipe.
+
+        """
+        versions = []
+        for key in os.listdir(self.directory):
+            manifest = os.path.join(self.directory, key, 'manifest.json')
+            if key != keep and os.path.isfile(manifest):
+                versions.append((os.path.getmtime(manifest), key))
+
+        now = time.time()
+        for mtime, key in sorted(
+                versions, reverse=True)[self.max_versions - 1:]:
+            if now - mtime >= self.evict_delay:
+                self.log.debug('removing outdated Kaldi data %s', key)
+                self._remove(os.path.join(self.directory, key))
+
+    def _remove(self, path):
+        """Remove the directory `path`, moved aside at once
+
+        The directory is renamed to a temporary one before being
+        deleted, so that its content is never seen partially removed.
+
+        """
+        tmp = tempfile.mkdtemp(dir=self.directory, prefix='tmp.')
+        try:
+            os.rename(path, os.path.join(tmp, os.path.basename(path)))
+        except OSError:
+            # already removed by another process
+            pass
+        shutil.rmtree(tmp, ignore_errors=True)
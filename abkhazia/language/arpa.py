@@ -21,87 +21,470 @@ the python-arpa library (MIT, ARPA writer). See
 https://github.com/proycon/pynlpl and
 https://github.com/sfischer13/python-arpa.
 
+The n-grams are stored in a compact form: the words are interned in a
+vocabulary and the n-grams of each order are stored as a sorted array
+of word ids, with their probabilities and backoff weights as float32
+arrays. Models are loaded and saved in streaming.
+
 """
 
-import os
+import array
+import gzip
 import re
-import abkhazia.utils as utils
+
+import numpy as np
 
 
 class ARPALanguageModel(object):
-    def __init__(self, ngrams):
-        """Build a LM from raw data
+    """A n-gram language model with probabilities in log10
 
-        ngrams is a dict of dicts, each inner dict corresponds to ngram
-        of a given order: ngrams[1] and ngrams[2] are unigrams and
-        bigrams respectively. ngrams[n] itself is a dict[(word_1, ...,
-        word_n)] -> (probability, backoff)
+    words : the vocabulary, as a list of words indexed by their id
 
-        """
-        self.order = len(ngrams)
-        self.ngrams = ngrams
+    grams : a list of the n-grams for each order: grams[0] are the
+        unigrams, grams[1] the bigrams, etc... The n-grams of order n
+        are a (m, n) array of words ids.
+
+    probs : the list of the log10 probabilities of the n-grams for
+        each order, as arrays of size m
+
+    backoffs : the list of the log10 backoff weights of the n-grams
+        for each order, as arrays of size m, NaN for the n-grams with
+        no backoff weight. None for the highest order.
+
+    The n-grams of each order are sorted by words ids.
+
+    """
+    def __init__(self, words, grams, probs, backoffs):
+        self.words = list(words)
+        self.vocabulary = {word: i for i, word in enumerate(self.words)}
+        self.grams, self.probs, self.backoffs = [], [], []
+
+        for n, (gram, prob, backoff) in enumerate(
+                zip(grams, probs, backoffs), 1):
+            gram = np.asarray(gram, dtype=np.uint32).reshape((-1, n))
+            index = np.argsort(ngram_keys(gram), kind='mergesort')
+            self.grams.append(gram[index])
+            self.probs.append(np.asarray(prob, dtype=np.float32)[index])
+            self.backoffs.append(
+                None if backoff is None
+                else np.asarray(backoff, dtype=np.float32)[index])
+
+        # the sorted keys of the n-grams, see the _find method
+        self._keys = {}
+
+    @property
+    def order(self):
+        """The order of the model"""
+        return len(self.grams)
+
+    def size(self, order):
+        """Return the number of n-grams of order `order`"""
+        return len(self.grams[order - 1])
 
     @classmethod
     def load(cls, path):
-        """Load an ARPA language model from the file `path`"""
-        assert os.path.isfile(path)
+        """Load an ARPA language model from the file `path`
+
+        The file is read in streaming, gzipped if it ends with '.gz'.
+        Raise IOError if the file is not in ARPA format.
 
-        data = {}
+        """
+        vocabulary = {}
+        sizes = {}
+        grams, probs, backoffs = [], [], []
         order = None
-        for line in (l.strip() for l in utils.open_utf8(path, 'r') if l):
-            if line.startswith('\\data\\'):
-                order = 0
-            elif line.startswith('\\end\\'):
-                break
-            elif line.startswith('\\') and line.endswith(':'):
-                order = int(re.search('[0-9]+', line).group(0))
-                if order not in data:
-                    data[order] = {}
-            elif line:
-                if order == 0:  # still in \data\ section
-                    pass
+
+        fin = (gzip.open(path, 'rb') if path.endswith('.gz')
+               else open(path, 'r'))
+        with fin:
+            for line in fin:
+                line = line.strip()
+                if not line:
+                    continue
+                elif line.startswith('\\data\\'):
+                    order = 0
+                elif line.startswith('\\end\\'):
+                    break
+                elif line.startswith('\\') and line.endswith(':'):
+                    order = int(re.search('[0-9]+', line).group(0))
+                    while len(grams) < order:
+                        grams.append(array.array('I'))
+                        probs.append(array.array('f'))
+                        backoffs.append(array.array('f'))
+                elif order == 0:  # still in \data\ section
+                    match = re.match(r'ngram\s+([0-9]+)\s*=\s*([0-9]+)', line)
+                    if match:
+                        sizes[int(match.group(1))] = int(match.group(2))
                 elif order > 0:
-                    line = line.split('\t')
-                    prob = float(line[0])
-                    ngram = tuple(line[1].split())
-                    backoff = None if len(line) <= 2 else float(line[2])
-                    data[order][ngram] = (prob, backoff)
+                    fields = line.decode('utf8').split()
+                    if len(fields) not in (order + 1, order + 2):
+                        raise IOError(
+                            'unable to parse ARPA file line: {}'.format(line))
+                    probs[order - 1].append(float(fields[0]))
+                    grams[order - 1].extend(
+                        vocabulary.setdefault(word, len(vocabulary))
+                        for word in fields[1:order + 1])
+                    backoffs[order - 1].append(
+                        float(fields[order + 1]) if len(fields) == order + 2
+                        else np.nan)
                 else:
                     raise IOError(
                         'unable to parse ARPA file line: {}'.format(line))
-        return cls(data)
+
+        for n, size in sizes.iteritems():
+            if size and (n > len(probs) or len(probs[n - 1]) != size):
+                raise IOError(
+                    'expected {} {}-grams in {}'.format(size, n, path))
+
+        # words ids in alphabetical order, so that the n-grams are
+        # sorted alphabetically as well
+        words = sorted(vocabulary.iterkeys())
+        ids = np.zeros((len(words),), dtype=np.uint32)
+        ids[[vocabulary[w] for w in words]] = np.arange(
+            len(words), dtype=np.uint32)
+
+        return cls(
+            words,
+            [ids[np.frombuffer(g, dtype=np.uint32)] if len(g)
+             else np.zeros((0,), dtype=np.uint32) for g in grams],
+            [np.frombuffer(p, dtype=np.float32) for p in probs],
+            [np.frombuffer(b, dtype=np.float32) for b in backoffs[:-1]]
+            + [None])
 
     def save(self, path):
         """Save a language model to `path` in the ARPA format
 
-        Do not write empty ngrams to the `path`
+        Do not write empty ngrams to the `path`. The file is written
+        in streaming, gzipped if `path` ends with '.gz'.
 
         """
-        with utils.open_utf8(path, 'w') as fp:
+        words = [w.encode('utf8') if isinstance(w, unicode) else w
+                 for w in self.words]
+
+        # the default gzip level 9 is much slower for a few percents
+        fout = (gzip.open(path, 'wb', compresslevel=6)
+                if path.endswith('.gz') else open(path, 'wb'))
+        with fout:
             # write header
-            fp.write('\n\\data\\\n')
-            for order in range(1, self.order+1):
-                size = len(self.ngrams[order])
-                if size:
-                    fp.write('ngram {}={}\n'.format(order, size))
-            fp.write('\n')
-
-            # write ngrams
-            for order in range(1, self.order+1):
-                if len(self.ngrams[order]):
-                    fp.write('\\{}-grams:\n'.format(order))
-                    for k, v in sorted(self.ngrams[order].items()):
-                        ngram = ' '.join(k)
-                        if v[1] is None:  # no backoff
-                            fp.write(u'{}\t{}\n'.format(v[0], ngram))
-                        else:
-                            fp.write(u'{}\t{}\t{}\n'.format(v[0], ngram, v[1]))
-                    fp.write('\n')
-            fp.write('\\end\\\n')
+            fout.write('\n\\data\\\n')
+            for order in range(1, self.order + 1):
+                if self.size(order):
+                    fout.write('ngram {}={}\n'.format(order, self.size(order)))
+            fout.write('\n')
+
+            # write ngrams by blocks
+            block = 100000
+            for order in range(1, self.order + 1):
+                if not self.size(order):
+                    continue
+
+                fout.write('\\{}-grams:\n'.format(order))
+                grams = self.grams[order - 1]
+                probs = self.probs[order - 1].tolist()
+                backoffs = (None if self.backoffs[order - 1] is None
+                            else self.backoffs[order - 1].tolist())
+
+                for start in range(0, len(grams), block):
+                    lines = []
+                    for i, gram in enumerate(
+                            grams[start:start + block].tolist(), start):
+                        line = '{:.6f}\t{}'.format(
+                            probs[i], ' '.join(words[w] for w in gram))
+                        # no backoff if NaN
+                        if backoffs is not None and backoffs[i] == backoffs[i]:
+                            line += '\t{:.6f}'.format(backoffs[i])
+                        lines.append(line + '\n')
+                    fout.write(''.join(lines))
+                fout.write('\n')
+            fout.write('\\end\\\n')
 
     def prune_vocabulary(self, words):
         """Remove any ngram entry containing a word not in `words`"""
-        for ngram in self.ngrams.itervalues():
-            for entry in ngram.keys():
-                if not all(word in words for word in entry):
-                    del ngram[entry]
+        keep = np.zeros((len(self.words) + 1,), dtype=bool)
+        keep[[self.vocabulary[w] for w in words
+              if w in self.vocabulary]] = True
+        self._remove([~keep[g].all(axis=1) for g in self.grams])
+
+        # remove the pruned words from the vocabulary, the ids keep
+        # their order so the n-grams are still sorted
+        keep = keep[:-1]
+        ids = np.cumsum(keep, dtype=np.int64) - 1
+        self.grams = [ids[g].astype(np.uint32) for g in self.grams]
+        self.words = [w for w, k in zip(self.words, keep) if k]
+        self.vocabulary = {word: i for i, word in enumerate(self.words)}
+        self._keys = {}
+
+    def prune_sequences(self, sequences):
+        """Remove any ngram entry containing one of the word `sequences`
+
+        `sequences` is a list of pairs of words, for instance [('</s>',
+        '<s>')] removes all the n-grams where '<s>' follows '</s>'.
+
+        """
+        pairs = [(self.vocabulary[a], self.vocabulary[b])
+                 for a, b in sequences
+                 if a in self.vocabulary and b in self.vocabulary]
+
+        remove = []
+        for grams in self.grams:
+            mask = np.zeros((len(grams),), dtype=bool)
+            for a, b in pairs:
+                mask |= (
+                    (grams[:, :-1] == a) & (grams[:, 1:] == b)).any(axis=1)
+            remove.append(mask)
+        self._remove(remove)
+
+    def renormalize(self):
+        """Recompute the backoff weights so that the model is normalized
+
+        The unigram probabilities are normalized first: the missing
+        probability mass goes to the unigrams of null probability
+        (excepted <s>) if any, else all the unigrams are scaled. This
+        is what the SRILM 'ngram -renorm' command does.
+
+        """
+        unigrams = self.grams[0][:, 0]
+        probs = 10 ** self.probs[0].astype(np.float64)
+        predicted = unigrams != self.vocabulary.get('<s>', len(self.words))
+        mass = probs[predicted].sum()
+
+        zeros = predicted & (self.probs[0] <= -99)
+        if zeros.any() and mass < 1:
+            probs[zeros] = (1 - mass) / zeros.sum()
+        elif mass > 0:
+            probs[predicted] /= mass
+        with np.errstate(divide='ignore'):
+            self.probs[0][predicted] = np.maximum(
+                np.log10(probs[predicted]), -99)
+
+        for n in range(2, self.order + 1):
+            self._compute_backoffs(n)
+
+    def prune_low_probs(self):
+        """Remove the n-grams less probable than their backoff estimate
+
+        The n-grams which are the context of higher order n-grams are
+        kept. The backoff weights are recomputed after pruning. This
+        is what the SRILM 'ngram -prune-lowprobs' command does.
+
+        """
+        for n in range(2, self.order + 1):
+            grams = self.grams[n - 1]
+            index, found = self._find(n - 1, grams[:, :-1])
+            backoff = np.zeros((len(grams),))
+            weights = self.backoffs[n - 2][index[found]]
+            backoff[found] = np.where(np.isnan(weights), 0, weights)
+
+            remove = self.probs[n - 1] < backoff + self._lower(grams)
+            if n < self.order:
+                # a context is never removed
+                contexts = np.zeros((len(grams),), dtype=bool)
+                index, found = self._find(n, self.grams[n][:, :-1])
+                contexts[index[found]] = True
+                remove &= ~contexts
+
+            self._remove([
+                remove if m == n - 1 else np.zeros((len(g),), dtype=bool)
+                for m, g in enumerate(self.grams)])
+            self._compute_backoffs(n)
+
+    def score(self, sentence):
+        """Return the log10 probability of a `sentence`
+
+        `sentence` is a string or a list of words, the begin and end
+        of sentence symbols are added. The words not in the model are
+        mapped to <unk> if it is in the model, else they are ignored
+        (as SRILM does).
+
+        """
+        return self._score([sentence])[0]
+
+    def perplexity(self, text):
+        """Return the perplexity of the model on `text`
+
+        `text` is a list of sentences or a dict of sentences (such as
+        Corpus.text), each sentence being a string or a list of
+        words. The perplexity is computed as by SRILM, on the words
+        and end of sentences, ignoring the words not in the model.
+
+        """
+        sentences = text.values() if isinstance(text, dict) else text
+        logprob, nwords = self._score(sentences, count=True)
+        return 10 ** (-logprob / nwords) if nwords else float('inf')
+
+    def logprob(self, word, history=()):
+        """Return the log10 probability of `word` following `history`
+
+        `history` is a sequence of words, only its last `order` - 1
+        words are considered. Return None if `word` is not in the
+        model.
+
+        """
+        history = tuple(history)[-(self.order - 1):] if self.order > 1 else ()
+        window = np.full((1, self.order), len(self.words), dtype=np.uint32)
+        ids = [self.vocabulary.get(w, len(self.words))
+               for w in history + (word,)]
+        window[0, self.order - len(ids):] = ids
+        prob = self._logprob(window, np.asarray([len(ids)]))[0]
+        return None if np.isnan(prob) else float(prob)
+
+    def _score(self, sentences, count=False):
+        """Return the log10 probability of `sentences`
+
+        If `count` is True, return the pair (logprob, n) where n is the
+        number of scored tokens.
+
+        """
+        oov = self.vocabulary.get('<unk>', len(self.words))
+        bos, eos = (self.vocabulary.get(w, len(self.words))
+                    for w in ('<s>', '</s>'))
+
+        tokens, positions, scores = [], [], []
+        for sentence in sentences:
+            if isinstance(sentence, basestring):
+                sentence = sentence.split()
+            tokens.append(bos)
+            tokens.extend(self.vocabulary.get(w, oov) for w in sentence)
+            tokens.append(eos)
+            positions.extend(range(len(sentence) + 2))
+            scores.append(len(sentence) + 1)
+
+        tokens = np.asarray(tokens, dtype=np.uint32)
+        positions = np.asarray(positions, dtype=np.int64)
+
+        # windows of the `order` last words before each token but <s>
+        scored = np.flatnonzero(positions > 0)
+        window = np.full(
+            (len(scored), self.order), len(self.words), dtype=np.uint32)
+        for j in range(self.order):
+            valid = positions[scored] >= j
+            window[valid, self.order - 1 - j] = tokens[scored[valid] - j]
+        lengths = np.minimum(positions[scored] + 1, self.order)
+
+        logprobs = self._logprob(window, lengths)
+
+        # sum by sentence, ignoring the unknown words
+        known = ~np.isnan(logprobs)
+        sentence = np.repeat(np.arange(len(scores)), scores)
+        totals = np.bincount(
+            sentence[known], weights=logprobs[known], minlength=len(scores))
+        if count:
+            return float(totals.sum()), int(known.sum())
+        return totals.tolist()
+
+    def _logprob(self, window, lengths):
+        """Return the log10 probabilities of the last word of each window
+
+        `window` is a (k, order) array of words ids, the n-grams are
+        right aligned and of sizes `lengths`. Follow the backoff
+        weights up to the longest known n-gram. Return NaN for unknown
+        words.
+
+        """
+        logprob = np.full((len(window),), np.nan)
+        backoff = np.zeros((len(window),))
+        done = np.zeros((len(window),), dtype=bool)
+
+        for n in range(self.order, 0, -1):
+            rows = np.flatnonzero(~done & (lengths >= n))
+            index, found = self._find(n, window[rows, self.order - n:])
+
+            hit = rows[found]
+            logprob[hit] = self.probs[n - 1][index[found]] + backoff[hit]
+            done[hit] = True
+
+            # add the backoff weight of the context, if any
+            miss = rows[~found]
+            if n > 1 and len(miss):
+                index, found = self._find(
+                    n - 1, window[miss, self.order - n:-1])
+                weights = self.backoffs[n - 2][index[found]]
+                backoff[miss[found]] += np.where(
+                    np.isnan(weights), 0, weights)
+
+        return logprob
+
+    def _lower(self, grams):
+        """Return the log10 probabilities of `grams` given a shorter context
+
+        This is the probability of the last word of each n-gram given
+        the n-gram without its first word, following the backoff
+        weights as needed.
+
+        """
+        n = grams.shape[1]
+        window = np.full(
+            (len(grams), self.order), len(self.words), dtype=np.uint32)
+        window[:, self.order - n + 1:] = grams[:, 1:]
+        return self._logprob(window, np.full((len(grams),), n - 1))
+
+    def _compute_backoffs(self, n):
+        """Compute the backoff weights of the contexts of the `n`-grams
+
+        The backoff weight of a context h normalizes the probabilities
+        backed-off to h without its first word. The contexts without
+        any extension have no backoff weight.
+
+        """
+        grams = self.grams[n - 1]
+        backoffs = np.full((self.size(n - 1),), np.nan, dtype=np.float32)
+        if len(grams):
+            # the n-grams sharing a context are contiguous
+            keys = ngram_keys(grams[:, :-1])
+            starts = np.concatenate(
+                ([0], np.flatnonzero(keys[1:] != keys[:-1]) + 1))
+
+            numerator = 1 - np.add.reduceat(
+                10 ** self.probs[n - 1].astype(np.float64), starts)
+            denominator = 1 - np.add.reduceat(
+                10 ** self._lower(grams), starts)
+
+            # no backoff mass left on the numerator, or backoff
+            # never used on the denominator
+            weights = np.zeros((len(starts),))
+            valid = (numerator > 0) & (denominator > 0)
+            weights[valid] = np.log10(numerator[valid] / denominator[valid])
+            weights[(numerator <= 0) & (denominator > 0)] = -99
+
+            index, found = self._find(n - 1, grams[starts, :-1])
+            backoffs[index[found]] = np.maximum(weights[found], -99)
+        self.backoffs[n - 2] = backoffs
+
+    def _find(self, order, rows):
+        """Return the indices of `rows` in the n-grams of `order`
+
+        Return a pair (index, found) of arrays, index is valid only
+        where found is True.
+
+        """
+        if order not in self._keys:
+            self._keys[order] = ngram_keys(self.grams[order - 1])
+        keys = self._keys[order]
+
+        rows = ngram_keys(rows)
+        index = np.minimum(np.searchsorted(keys, rows), max(len(keys) - 1, 0))
+        found = (keys[index] == rows) if len(keys) else np.zeros(
+            (len(rows),), dtype=bool)
+        return index, found
+
+    def _remove(self, masks):
+        """Remove the n-grams where masks[n-1] is True for each order"""
+        for n, mask in enumerate(masks):
+            keep = ~mask
+            self.grams[n] = self.grams[n][keep]
+            self.probs[n] = self.probs[n][keep]
+            if self.backoffs[n] is not None:
+                self.backoffs[n] = self.backoffs[n][keep]
+        self._keys = {}
+
+
+def ngram_keys(grams):
+    """Return the rows of a n-grams array as an array of comparable keys
+
+    The keys compare as the rows of `grams` in lexicographic order,
+    so they can be sorted and searched with numpy.
+
+    """
+    grams = np.ascontiguousarray(grams, dtype='>u4')
+    return grams.view(
+        np.dtype((np.void, 4 * max(grams.shape[1], 1)))).ravel()
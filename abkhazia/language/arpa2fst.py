@@ -0,0 +1,198 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Conversion of ARPA language models to the Kaldi grammar FST G.fst
+
+This module replaces the Kaldi pipeline 'arpa2fst | fstprint |
+eps2disambig.pl | s2eps.pl | fstcompile | fstrmepsilon' by a direct
+construction of the FST from an ARPALanguageModel, written in the
+OpenFst text format (to be compiled with fstcompile).
+
+The FST has a state for each history (the n-grams of order lower than
+the model order, and the empty history), the start state is the <s>
+history. A word w in history h is an arc w:w from h to the longest
+known suffix of hw, a sentence end is the final weight of h, and the
+backoff from h to its longest known suffix is an arc #0:<eps>. The
+weights are the negated natural logarithms of the probabilities.
+
+"""
+
+import math
+
+import numpy as np
+
+from abkhazia.utils import open_utf8
+
+
+def read_symbols(words_txt):
+    """Return a dict word -> id from the OpenFst symbol table `words_txt`"""
+    symbols = {}
+    with open_utf8(words_txt, 'r') as fin:
+        for line in fin:
+            line = line.split()
+            if line:
+                symbols[line[0]] = int(line[1])
+    return symbols
+
+
+def arpa2fst(lm, symbols, fst_txt, block_size=100000):
+    """Write the grammar FST of the ARPA model `lm` to `fst_txt`
+
+    lm : the ARPALanguageModel to convert, all its words but <s> and
+        </s> must be in `symbols`
+
+    symbols : a dict word -> id, as returned by read_symbols(), must
+        contain the backoff symbol #0
+
+    fst_txt : the file where to write the FST in the OpenFst text
+        format, the arcs of each state sorted by input label
+
+    Raise IOError if a word is missing in `symbols`.
+
+    """
+    fst = _Fst(lm)
+
+    labels = np.zeros((len(lm.words),), dtype=np.int64)
+    for i, word in enumerate(lm.words):
+        if word not in ('<s>', '</s>'):
+            try:
+                labels[i] = symbols[word]
+            except KeyError:
+                raise IOError(
+                    'word {} not in the symbol table'.format(word))
+    try:
+        backoff = symbols['#0']
+    except KeyError:
+        raise IOError('backoff symbol #0 not in the symbol table')
+
+    source, target, label, weight, finals, final_weights = fst.arcs()
+    ilabel = np.where(label < 0, backoff, labels[np.maximum(label, 0)])
+    olabel = np.where(label < 0, 0, ilabel)
+
+    # the start state comes first, then the arcs sorted by state and
+    # input label
+    index = np.lexsort((ilabel, source, source != fst.start))
+    with open(fst_txt, 'w') as fout:
+        if not len(index):
+            # a FST with a single state
+            fout.write('{}\n'.format(fst.start))
+
+        for start in range(0, len(index), block_size):
+            block = index[start:start + block_size]
+            fout.write(''.join(
+                '{}\t{}\t{}\t{}\t{}\n'.format(*arc) for arc in zip(
+                    source[block].tolist(), target[block].tolist(),
+                    ilabel[block].tolist(), olabel[block].tolist(),
+                    _format(weight[block]))))
+
+        fout.write(''.join(
+            '{}\t{}\n'.format(*final) for final in zip(
+                finals.tolist(), _format(final_weights))))
+
+
+def _format(weights):
+    """Return the FST `weights` as strings"""
+    return ['{:.6g}'.format(w) if w != 0 else '0' for w in weights.tolist()]
+
+
+class _Fst(object):
+    """The states and arcs of the grammar FST of an ARPA model"""
+    def __init__(self, lm):
+        self.lm = lm
+        self.bos = lm.vocabulary.get('<s>', -1)
+        self.eos = lm.vocabulary.get('</s>', -1)
+
+        # the states of order n are the n-grams of order n not ending
+        # with </s> or <s> (but <s> itself), the state 0 is the empty
+        # history
+        self.states = [None]
+        nstates = 1
+        for n in range(1, lm.order):
+            last = lm.grams[n - 1][:, -1].astype(np.int64)
+            state = (last != self.eos) & ((last != self.bos) | (n == 1))
+            ids = np.full((len(last),), -1, dtype=np.int64)
+            ids[state] = np.arange(nstates, nstates + state.sum())
+            nstates += state.sum()
+            self.states.append(ids)
+
+        self.start = 0
+        if lm.order > 1 and self.bos >= 0:
+            index, found = lm._find(
+                1, np.asarray([[self.bos]], dtype=np.uint32))
+            if found[0]:
+                self.start = int(self.states[1][index[0]])
+
+    def arcs(self):
+        """Return the arcs and final states of the FST
+
+        Return (source, target, label, weight, finals, final_weights),
+        the labels are word ids in the model, -1 for backoff arcs.
+
+        """
+        lm = self.lm
+        arcs = []
+        finals, final_weights = [], []
+
+        for n in range(1, lm.order + 1):
+            grams = lm.grams[n - 1]
+            weight = -lm.probs[n - 1].astype(np.float64) * math.log(10)
+            word = grams[:, -1].astype(np.int64)
+
+            if n == 1:
+                source = np.zeros((len(grams),), dtype=np.int64)
+            else:
+                source = self._exact(grams[:, :-1])
+            valid = (source >= 0) & (word != self.bos)
+
+            end = valid & (word == self.eos)
+            finals.append(source[end])
+            final_weights.append(weight[end])
+
+            arc = valid & (word != self.eos)
+            target = (self._exact(grams[arc]) if n < lm.order
+                      else self._suffix(grams[arc][:, 1:]))
+            arcs.append((source[arc], target, word[arc], weight[arc]))
+
+            # backoff arcs from the states of order n
+            if n < lm.order:
+                state = self.states[n] >= 0
+                backoff = lm.backoffs[n - 1][state].astype(np.float64)
+                arcs.append((
+                    self.states[n][state],
+                    self._suffix(grams[state][:, 1:]),
+                    np.full((state.sum(),), -1, dtype=np.int64),
+                    -np.where(np.isnan(backoff), 0, backoff) * math.log(10)))
+
+        return tuple(np.concatenate(a) for a in zip(*arcs)) + (
+            np.concatenate(finals), np.concatenate(final_weights))
+
+    def _exact(self, rows):
+        """Return the states of the histories `rows`, -1 if not a state"""
+        states = np.full((len(rows),), -1, dtype=np.int64)
+        if rows.shape[1]:
+            index, found = self.lm._find(rows.shape[1], rows)
+            states[found] = self.states[rows.shape[1]][index[found]]
+        else:
+            states[:] = 0
+        return states
+
+    def _suffix(self, rows):
+        """Return the states of the longest known suffixes of `rows`"""
+        states = np.zeros((len(rows),), dtype=np.int64)
+        todo = np.arange(len(rows))
+        for n in range(rows.shape[1], 0, -1):
+            found = self._exact(rows[todo, rows.shape[1] - n:])
+            states[todo[found >= 0]] = found[found >= 0]
+            todo = todo[found < 0]
+        return states
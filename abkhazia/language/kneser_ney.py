@@ -0,0 +1,317 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Estimation of ARPA n-gram models with modified Kneser-Ney smoothing
+
+This module implements the interpolated modified Kneser-Ney smoothing
+of Chen and Goodman (1998), as done by the SRILM -kndiscount
+-interpolate options or the KenLM lmplz program, for any n-gram order.
+
+The words are coded as integers and the n-grams of order n are stored
+as sorted (m, n) arrays of word ids, with their counts in a parallel
+array. The text is counted by chunks of sentences, each chunk being
+sorted on its own and merged with the previous ones without sorting
+them again, so the memory used depends on the number of distinct
+n-grams, not on the size of the text.
+
+The estimate_arpa() function is the entry point, the estimated model
+is an ARPALanguageModel saved to a (possibly gzipped) file.
+
+"""
+
+import numpy as np
+
+from abkhazia.utils import logger
+from abkhazia.language.arpa import ARPALanguageModel, ngram_keys
+
+
+BOS, EOS, UNK = '<s>', '</s>', '<unk>'
+"""The begin and end of sentence and the unknown word symbols"""
+
+_BOS, _EOS, _UNK = 0, 1, 2
+"""The ids of BOS, EOS and UNK"""
+
+
+def estimate_arpa(sentences, arpa_file, order,
+                  chunk_size=100000, log=logger.null_logger()):
+    """Estimate a n-gram model from `sentences` and write it to `arpa_file`
+
+    sentences : an iterable of sentences, each sentence being a list
+        of words (without begin and end of sentence symbols)
+
+    arpa_file : the file where to write the model in ARPA format,
+        gzipped if it ends with '.gz'
+
+    order : the order of the n-gram model, must be strictly positive
+
+    chunk_size : the number of sentences counted at once
+
+    """
+    if order < 1:
+        raise IOError(
+            'n-gram order must be strictly positive, it is {}'.format(order))
+
+    words, counts = count_ngrams(sentences, order, chunk_size=chunk_size)
+    log.debug('counted %s n-grams on %s words', ', '.join(
+        str(len(counts[n][0])) for n in range(1, order + 1)), len(words))
+
+    kneser_ney(words, counts, order, log=log).save(arpa_file)
+
+
+def count_ngrams(sentences, order, chunk_size=100000):
+    """Count the n-grams of `sentences` up to `order`
+
+    The sentences are padded with the begin and end of sentence
+    symbols. Return a pair (words, counts) where `words` is the list
+    of the words indexed by their id (the ids of <s>, </s> and <unk>
+    are 0, 1 and 2), and counts[n] is a pair (grams, counts) of the
+    distinct n-grams as a sorted (m, n) array of words ids and their
+    number of occurrences.
+
+    """
+    vocab = {BOS: _BOS, EOS: _EOS, UNK: _UNK}
+
+    # the counts of each order as a stack of sorted runs of decreasing
+    # sizes, merged when of similar sizes so that each n-gram is
+    # merged a logarithmic number of times
+    runs = {n: [(np.zeros((0, n), dtype=np.uint32),
+                 np.zeros((0,), dtype=np.int64))]
+            for n in range(1, order + 1)}
+
+    tokens, sentence_ids = [], []
+
+    def _count():
+        ids = np.asarray(tokens, dtype=np.uint32)
+        sids = np.asarray(sentence_ids, dtype=np.int64)
+        for n in range(1, min(order, ids.size) + 1):
+            size = ids.size - n + 1
+            # the n-grams must not overlap two sentences
+            valid = sids[:size] == sids[n - 1:]
+            grams = np.column_stack(
+                [ids[i:i + size] for i in range(n)])[valid]
+
+            # only the chunk is sorted, it is then merged into the
+            # runs counted so far
+            stack = runs[n]
+            stack.append(_unique(
+                grams, np.ones((len(grams),), dtype=np.int64)))
+            while len(stack) > 1 and (
+                    len(stack[-2][0]) <= 2 * len(stack[-1][0])):
+                stack[-2:] = [_merge(stack[-2], stack[-1])]
+
+        del tokens[:]
+        del sentence_ids[:]
+
+    for index, sentence in enumerate(sentences):
+        tokens.append(_BOS)
+        tokens.extend(vocab.setdefault(word, len(vocab)) for word in sentence)
+        tokens.append(_EOS)
+        sentence_ids.extend([index] * (len(sentence) + 2))
+
+        if (index + 1) % chunk_size == 0:
+            _count()
+    _count()
+
+    counts = {}
+    for n, stack in runs.iteritems():
+        while len(stack) > 1:
+            stack[-2:] = [_merge(stack[-2], stack[-1])]
+        counts[n] = stack[0]
+
+    words = [None] * len(vocab)
+    for word, index in vocab.iteritems():
+        words[index] = word
+    return words, counts
+
+
+def adjusted_counts(counts, order):
+    """Return the Kneser-Ney adjusted counts of the n-grams in `counts`
+
+    For the highest order, and for the n-grams starting with <s>, this
+    is the number of occurrences. For the other n-grams this is the
+    number of distinct words preceding them. `counts` is as returned
+    by count_ngrams(), so is the returned dict.
+
+    """
+    adjusted = {order: counts[order]}
+    for n in range(1, order):
+        grams, occurrences = counts[n]
+        adjusted_count = occurrences.copy()
+
+        # each distinct (n+1)-gram is a left extension of its suffix,
+        # which never starts with <s>
+        extended = counts[n + 1][0]
+        suffixes, extensions = _unique(
+            extended[:, 1:], np.ones((len(extended),), dtype=np.int64))
+        adjusted_count[_find(grams, suffixes)] = extensions
+
+        adjusted[n] = (grams, adjusted_count)
+    return adjusted
+
+
+def discounts(adjusted_count, log=logger.null_logger()):
+    """Return the discounts (D1, D2, D3+) of modified Kneser-Ney
+
+    The discounts are estimated from the counts of n-grams occurring
+    one, two, three and four times in `adjusted_count`. When they are
+    not defined (on tiny corpora mostly), fall back to a single
+    absolute discount.
+
+    """
+    t = [float(np.count_nonzero(adjusted_count == k)) for k in (1, 2, 3, 4)]
+
+    if all(t):
+        y = t[0] / (t[0] + 2 * t[1])
+        d = [k - (k + 1) * y * t[k] / t[k - 1] for k in (1, 2, 3)]
+        if all(0 < d[k - 1] < k for k in (1, 2, 3)):
+            return tuple(d)
+
+    y = t[0] / (t[0] + 2 * t[1]) if t[0] and t[1] else 0.5
+    log.debug('modified Kneser-Ney discounts undefined, using %s', y)
+    return (y, y, y)
+
+
+def kneser_ney(words, counts, order, log=logger.null_logger()):
+    """Estimate an interpolated modified Kneser-Ney model
+
+    `words` and `counts` are as returned by count_ngrams(). Return the
+    model as an ARPALanguageModel, the n-grams which are not a context
+    have no backoff weight.
+
+    The unigrams are interpolated with the uniform distribution on the
+    vocabulary (including <unk> but not <s>).
+
+    """
+    adjusted = adjusted_counts(counts, order)
+    probs, backoffs = [], []
+    for n in range(1, order + 1):
+        grams, adjusted_count = adjusted[n]
+
+        if n == 1:
+            # <s> is never predicted and unseen words (<unk> only) get
+            # the interpolated mass, <s> is added back later
+            seen = np.zeros((len(words),), dtype=bool)
+            seen[grams[:, 0]] = True
+            unseen = np.flatnonzero(~seen[1:]) + 1
+            grams, adjusted_count = _unique(
+                np.concatenate((grams, unseen[:, None].astype(np.uint32))),
+                np.concatenate((adjusted_count, np.zeros(
+                    (len(unseen),), dtype=np.int64))))
+            keep = grams[:, 0] != _BOS
+            grams, adjusted_count = grams[keep], adjusted_count[keep]
+
+        if not len(grams):
+            probs.append((grams, np.zeros((0,))))
+            backoffs.append(None)
+            continue
+
+        d = np.asarray((0.0,) + discounts(adjusted_count, log=log))
+        discount = d[np.minimum(adjusted_count, 3)]
+
+        # the n-grams sharing a context are contiguous
+        starts = _starts(grams[:, :-1])
+        group = np.zeros((len(grams),), dtype=np.int64)
+        group[starts[1:]] = 1
+        group = np.cumsum(group)
+        total = np.add.reduceat(adjusted_count, starts).astype(np.float64)
+
+        # on an empty text the unigrams are uniformly distributed
+        gamma = np.ones(total.shape)
+        nonzero = total > 0
+        gamma[nonzero] = (
+            np.add.reduceat(discount, starts)[nonzero] / total[nonzero])
+        total[~nonzero] = 1
+
+        if n == 1:
+            lower = 1.0 / (len(words) - 1)
+        else:
+            lower_grams, lower_probs = probs[n - 2]
+            lower = lower_probs[_find(lower_grams, grams[:, 1:])]
+
+            # gamma is the backoff weight of the context
+            backoff = backoffs[n - 2]
+            backoff[_find(lower_grams, grams[starts, :-1])] = gamma
+
+        prob = ((adjusted_count - discount) / total[group]
+                + gamma[group] * lower)
+
+        if n == 1:
+            grams = np.concatenate(
+                (np.asarray([[_BOS]], dtype=np.uint32), grams))
+            prob = np.concatenate(([0.0], prob))
+
+        probs.append((grams, prob))
+        backoffs.append(
+            np.full((len(grams),), np.nan) if n < order else None)
+
+    with np.errstate(divide='ignore'):
+        return ARPALanguageModel(
+            words,
+            [grams for grams, _ in probs],
+            [np.maximum(np.log10(prob), -99) for _, prob in probs],
+            # NaN for the n-grams which are not a context
+            [None if b is None else np.log10(b) for b in backoffs])
+
+
+def _unique(grams, weights):
+    """Return the sorted distinct rows of `grams` and their summed weights"""
+    if not len(grams):
+        return grams, weights
+
+    keys = ngram_keys(grams)
+    index = np.argsort(keys, kind='mergesort')
+    starts = _starts(grams[index])
+    return grams[index[starts]], np.add.reduceat(weights[index], starts)
+
+
+def _merge(first, second):
+    """Merge two pairs (grams, weights) of sorted distinct n-grams
+
+    Return the pair of the sorted distinct n-grams in `first` or
+    `second` and their summed weights. This is linear in the size of
+    `first`, which is not sorted again.
+
+    """
+    grams, weights = first
+    new_grams, new_weights = second
+    if not len(grams):
+        return new_grams, new_weights
+
+    keys, new_keys = ngram_keys(grams), ngram_keys(new_grams)
+    index = np.searchsorted(keys, new_keys)
+    found = np.zeros((len(new_keys),), dtype=bool)
+    inside = index < len(keys)
+    found[inside] = keys[index[inside]] == new_keys[inside]
+
+    weights = weights.copy()
+    weights[index[found]] += new_weights[found]
+    return (np.insert(grams, index[~found], new_grams[~found], axis=0),
+            np.insert(weights, index[~found], new_weights[~found]))
+
+
+def _starts(grams):
+    """Return the indices where the rows of a sorted `grams` change"""
+    if not grams.shape[1]:
+        return np.zeros((1,), dtype=np.int64)
+
+    keys = ngram_keys(grams)
+    return np.concatenate(
+        ([0], np.flatnonzero(keys[1:] != keys[:-1]) + 1))
+
+
+def _find(grams, rows):
+    """Return the indices of `rows` in the sorted distinct `grams`"""
+    index = np.searchsorted(ngram_keys(grams), ngram_keys(rows))
+    assert (grams[np.minimum(index, len(grams) - 1)] == rows).all()
+    return index
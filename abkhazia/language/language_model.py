@@ -14,17 +14,15 @@
 # along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
 """Provides the LanguageModel class"""
 
-import gzip
 import os
 import pkg_resources
-import re
 import shutil
 import tempfile
 
 import abkhazia.utils as utils
 import abkhazia.abstract_recipe as abstract_recipe
 from abkhazia.language.arpa import ARPALanguageModel
-from abkhazia.kaldi import kaldi_path
+from abkhazia.language import arpa2fst, kneser_ney
 
 
 def check_language_model(lm_dir):
@@ -71,8 +69,9 @@ def read_int2phone(lm_dir, word_position_dependent=True):
 class LanguageModel(abstract_recipe.AbstractRecipe):
     """Compute a language model from an abkhazia corpus
 
-    This class uses Kaldi, IRSTLM and SRILM to compute n-grams
-    language models from any abkhazia speech corpus. The models can be
+    This class uses Kaldi to compute n-grams language
+    models from any abkhazia speech corpus, the n-grams are estimated
+    with modified Kneser-Ney smoothing. The models can be
     either at word or phone level.
 
     Parameters
@@ -226,13 +225,14 @@ class LanguageModel(abstract_recipe.AbstractRecipe):
                 ' --keep_isymbols=false --keep_osymbols=false {1}'
                 .format(os.path.join(self.output_dir, 'words.txt'), G_txt))
             self.log.debug('running %s > %s', command1, temp)
-            utils.jobs.run(command1, temp.write)
+            self.profiler.add_job(utils.jobs.run(command1, temp.write))
 
             # temp to fst
             command2 = (
                 'fstarcsort --sort_type=ilabel {}'.format(temp.name))
             self.log.debug('running %s > %s', command2, G_fst)
-            utils.jobs.run(command2, open(G_fst, 'w').write)
+            self.profiler.add_job(
+                utils.jobs.run(command2, open(G_fst, 'w').write))
 
         finally:
             utils.remove(temp.name, safe=True)
@@ -240,107 +240,31 @@ class LanguageModel(abstract_recipe.AbstractRecipe):
     def _compute_lm(self, G_arpa):
         """Generate an ARPA n-gram from an abkhazia corpus
 
-        This method relies on the following Kaldi programs:
-        add-start-end.sh, build-lm.sh and compile-lm. It uses the
-        IRSTLM library.
+        The n-gram is estimated in-process with interpolated modified
+        Kneser-Ney smoothing (see language.kneser_ney) and written to
+        the gzipped file `G_arpa`.
 
         """
         self.log.info(
             'computing %s %s-gram in ARPA format', self.level, self.order)
 
-        # cut -d' ' -f2 lm_text > text_ready. Train need to
-        # remove utt-id on first column of text file
+        # remove the utt-id on first column of the text file
         lm_text = os.path.join(self.a2k._local_path(), 'lm_text.txt')
-        lm_lines = utils.open_utf8(lm_text, 'r').readlines()
-
-        text_ready = os.path.join(self.a2k._local_path(), 'text_ready.txt')
-        with utils.open_utf8(text_ready, 'w') as ready:
-            ready.write('\n'.join(
-                [' '.join(line.split()[1:]) for line in lm_lines]))
-
-        text_se = os.path.join(self.a2k._local_path(), 'text_se.txt')
-        utils.jobs.run(
-            'add-start-end.sh',
-            stdin=open(text_ready, 'r'),
-            stdout=open(text_se, 'w').write,
-            env=kaldi_path(), cwd=self.recipe_dir)
-        assert os.path.isfile(text_se), 'LM failed on add-start-end'
-
-        # k option is number of split, useful for huge text files
-        # build-lm.sh in kaldi/tools/irstlm/bin
-        text_lm = os.path.join(self.a2k._local_path(), 'text_lm.gz')
-        self._run_command(
-            'build-lm.sh -i {0} -n {1} -o {2} -k 1 -s kneser-ney'
-            .format(text_se, self.order, text_lm))
-        assert os.path.isfile(text_lm), 'LM failed on build-lm'
-
-        text_blm = os.path.join(self.a2k._local_path(), 'text_blm.gz')
-        self._run_command(
-            # was with the -i option
-            'compile-lm {} --text=yes {}'.format(text_lm, text_blm))
-
-        # gzip the compiled lm (from
-        # https://docs.python.org/2/library/gzip.html#examples-of-usage)
-        with open(text_blm, 'rb') as fin, gzip.open(G_arpa, 'wb') as fout:
-            shutil.copyfileobj(fin, fout)
-
-    def _change_lm_vocab(self, lm_txt, words_txt):
-        """Create a LM from an existing one by changing its vocabulary
-
-        All n-grams in the new vocab are retained with their original
-        probabilities. Backoff weights are recomputed and backed-off
-        unigrams for all new words are added. -subset option performs
-        subsetting of the vocabulary without adding new words.
-
-        This is reimplementation of the change-lm-vocab script from
-        SRILM, modified in 3 ways:
-
-         - no more -tolower option
-
-         - the pruning step now updates ngrams count in the header
-           (disable annoying warning)
+        sentences = (line.split()[1:]
+                     for line in utils.open_utf8(lm_text, 'r'))
 
-         - the call to ngram is done in 2 steps if the 1 step failed
-           (-renorm and prune-lowprobs options failed together on
-           -librispeech-test-clean, need 2 calls)
-
-        """
-        out_lm = os.path.join(self.output_dir, 'out_lm.txt')
-        self.log.debug('pruning vocabulary in %s', out_lm)
-
-        words = set(w.split()[0] for w in utils.open_utf8(words_txt, 'r'))
-        lm = ARPALanguageModel.load(lm_txt)
-        lm.prune_vocabulary(words)
-        lm_pruned = lm_txt + '.pruned'
-        lm.save(lm_pruned)
-
-        try:
-            self._run_command(
-                'ngram -lm {0} -vocab /dev/null -renorm -write-lm {1} '
-                '-prune-lowprobs -unk -order {2}'
-                .format(lm_pruned, out_lm, self.order))
-        except RuntimeError:
-            self._run_command(
-                'utils/run.pl {3} '
-                'ngram -lm {0} -vocab /dev/null -write-lm - '
-                '-prune-lowprobs -unk -order {2} | '
-                'ngram -lm - -vocab /dev/null -renorm -unk '
-                '-order {2} -write-lm {1}'
-                .format(lm_pruned, out_lm, self.order,
-                        os.path.join(self.output_dir, 'ngram.log')))
-
-        return out_lm
+        kneser_ney.estimate_arpa(
+            sentences, G_arpa, self.order, log=self.log)
 
     def _format_lm(self, arpa_lm, fst_lm):
         """Converts ARPA-format language models to FSTs
 
-        Change the LM vocabulary using SRILM. This is a Python
-        implementation of Kaldi egs/wsj/s5/utils/format_lm_sri.sh,
-        with margin modifications.
-
-        Note: if you want to just convert ARPA LMs to FSTs, there is a
-        simpler way to do this that doesn't require SRILM: see
-        examples in Kaldi egs/wsj/s5/local/wsj_format_local_lms.sh
+        Change the LM vocabulary to the words in the lexicon and
+        convert it to a FST. This is a Python implementation of Kaldi
+        egs/wsj/s5/utils/format_lm_sri.sh, with margin modifications:
+        the vocabulary pruning and renormalization done by SRILM
+        change-lm-vocab and the conversion done by arpa2fst are
+        computed in Python (see abkhazia.language.arpa2fst).
 
         """
         self.log.info('converting ARPA to FST')
@@ -353,28 +277,24 @@ class LanguageModel(abstract_recipe.AbstractRecipe):
         lm_base = os.path.splitext(os.path.basename(arpa_lm))[0]
         tempdir = tempfile.mkdtemp()
         try:
-            # unzip the input LM. Removing all "illegal" combinations of
+            # load the input LM. Removing all "illegal" combinations of
             # <s> and </s>, which are supposed to occur only at being/end
             # of utt. These can cause determinization failures of CLG
             # [ends up being epsilon cycles].
-            lm_txt = os.path.join(tempdir, lm_base + '.txt')
-            # self.log.debug('unzip %s to %s', arpa_lm, lm_txt)
-            with utils.open_utf8(lm_txt, 'w') as fp:
-                for line in gzip.open(arpa_lm, 'rb'):
-                    if not (re.search('<s> <s>', line) or
-                            re.search('</s> <s>', line) or
-                            re.search('</s> </s>', line)):
-                        fp.write(line.decode('utf-8'))
+            lm = ARPALanguageModel.load(arpa_lm)
+            lm.prune_sequences(
+                [('<s>', '<s>'), ('</s>', '<s>'), ('</s>', '</s>')])
 
             # finds words in the arpa LM that are not symbols in the
-            # OpenFst-format symbol table words.txt
+            # OpenFst-format symbol table words.txt (as does
+            # utils/find_arpa_oovs.pl)
+            symbols = arpa2fst.read_symbols(words_txt)
             oovs = os.path.join(self.output_dir, 'oovs_{}.txt'.format(lm_base))
             self.log.debug('write OOVs to %s', oovs)
-            utils.jobs.run(
-                'utils/find_arpa_oovs.pl {} {}'.format(words_txt, lm_txt),
-                stdout=utils.open_utf8(oovs, 'w').write,
-                env=kaldi_path(),
-                cwd=self.recipe_dir)
+            with utils.open_utf8(oovs, 'w') as out:
+                for word in lm.words:
+                    if word not in symbols:
+                        out.write(u'{}\n'.format(word))
 
             # Change the LM vocabulary to be the intersection of the
             # current LM vocabulary and the set of words in the
@@ -382,17 +302,18 @@ class LanguageModel(abstract_recipe.AbstractRecipe):
             # recomputing the backoff weights, and remove those ngrams
             # whose probabilities are lower than the backed-off
             # estimates.
-            lm_pruned = self._change_lm_vocab(lm_txt, words_txt)
+            lm.prune_vocabulary(symbols)
+            lm.renormalize()
+            lm.prune_low_probs()
+            self.log.debug('pruned LM has %s n-grams', ', '.join(
+                str(lm.size(n)) for n in range(1, lm.order + 1)))
 
             # convert from ARPA to FST
+            fst_txt = os.path.join(tempdir, 'G.txt')
+            arpa2fst.arpa2fst(lm, symbols, fst_txt)
             self._run_command(
-                'utils/run.pl {0} arpa2fst {1} | fstprint | '
-                'utils/eps2disambig.pl | utils/s2eps.pl | '
-                'fstcompile --isymbols={2} --osymbols={2} '
-                '--keep_isymbols=false --keep_osymbols=false | '
-                'fstrmepsilon | fstarcsort --sort_type=ilabel > {3}'.format(
-                    os.path.join(self.output_dir, 'format_lm.log'),
-                    lm_pruned, words_txt, fst_lm))
+                'fstcompile {0} | fstarcsort --sort_type=ilabel > {1}'
+                .format(fst_txt, fst_lm))
 
             # The output is like: 9.14233e-05 -0.259833. We do expect
             # the first of these 2 numbers to be close to zero (the
@@ -442,7 +363,7 @@ class LanguageModel(abstract_recipe.AbstractRecipe):
 
     def run(self):
         """Run the created recipe and compute the language model"""
-        self._prepare_lang()
+        self._checkpoint('prepare_lang', self._prepare_lang)
 
         def _local(f):
             return os.path.join(self.a2k._local_path(), f)
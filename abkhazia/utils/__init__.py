@@ -23,4 +23,6 @@ import abkhazia_base
 import logger
 import wav
 import jobs
+import profiler
+import cache
 import cha
@@ -17,6 +17,7 @@
 from itertools import groupby, chain
 
 import abkhazia.utils as utils
+from abkhazia.align import binary
 import joblib
 
 
@@ -55,8 +56,9 @@ def alignment2item(corpus, alignment_file, item_file,
 
            utt_id tstart tstop phone
 
-        Any utterance present in the alignment but not registered in
-        the corpus is ignored
+        or a binary alignment file at phone level (see
+        abkhazia.align.binary). Any utterance present in the alignment
+        but not registered in the corpus is ignored
 
     item_file (filename): the item file to write
 
@@ -79,7 +81,7 @@ def alignment2item(corpus, alignment_file, item_file,
         all the parallel tasks
 
     ali_with_phone_proba (bool): True if phone posterior probabilities
-        are specified in the alignment file
+        are specified in the alignment file, ignored for binary files
 
     Raise:
     ------
@@ -94,11 +96,9 @@ def alignment2item(corpus, alignment_file, item_file,
     items = joblib.Parallel(
         n_jobs=njobs, verbose=verbose, backend='threading')(
         joblib.delayed(_utt2item)
-        (utt_id, corpus, list(lines), segment_extension, exclude_phones,
-         ali_with_phone_proba)
-        for utt_id, lines in groupby(
-                utils.open_utf8(alignment_file, mode='r'),
-                lambda line: line.split()[0]))
+        (utt_id, corpus, phones, segment_extension, exclude_phones)
+        for utt_id, phones in _read_phones(
+                alignment_file, ali_with_phone_proba))
 
     # open output file and write items to it
     with utils.open_utf8(item_file, mode='w') as fout:
@@ -115,9 +115,36 @@ def parse_line(line, ali_with_phone_proba):
     return start, stop, phone
 
 
-def _utt2item(utt_id, corpus, lines, segment_extension, exclude_phones,
-              ali_with_phone_proba):
-    """Convert an utterance alignment to a list of items"""
+def _read_phones(alignment_file, ali_with_phone_proba):
+    """Yield (utt_id, phones) from a text or binary alignment file
+
+    The phones of an utterance are a list of (start, stop, phone)
+    strings, as returned by parse_line.
+
+    """
+    if binary.is_binary(alignment_file):
+        with binary.BinaryAlignment(alignment_file) as alignment:
+            if alignment.phones is None:
+                raise IOError('{}: no phones in the alignment file'
+                              .format(alignment_file))
+            for utt_id, rows in alignment:
+                yield utt_id, zip(
+                    map(str, rows.tstart), map(str, rows.tstop),
+                    [alignment.phones[p] for p in rows.phone.tolist()])
+    else:
+        for utt_id, lines in groupby(
+                utils.open_utf8(alignment_file, mode='r'),
+                lambda line: line.split()[0]):
+            yield utt_id, [parse_line(line, ali_with_phone_proba)
+                           for line in lines]
+
+
+def _utt2item(utt_id, corpus, phones, segment_extension, exclude_phones):
+    """Convert an utterance alignment to a list of items
+
+    `phones` is the list of the (start, stop, phone) of the utterance
+
+    """
     items = []
 
     # ensure the utterance is registered in the corpus
@@ -129,22 +156,20 @@ def _utt2item(utt_id, corpus, lines, segment_extension, exclude_phones,
 
     # use the first phone only in 'single_phone' case
     if segment_extension == 'single_phone':
-        start, stop, phone = parse_line(lines[0], ali_with_phone_proba)
+        start, stop, phone = phones[0]
         prev_phone = 'SIL'
-        if len(lines) == 1:
+        if len(phones) == 1:
             next_phone = 'SIL'
         else:
-            _, _, next_phone = parse_line(lines[1], ali_with_phone_proba)
+            _, _, next_phone = phones[1]
 
         _append_item(items, utt_id, start, stop, phone,
                      'SIL', next_phone, speaker, exclude_phones)
 
     # middle lines
-    for prev_line, line, next_line in zip(
-            lines[:-2], lines[1:-1], lines[2:]):
-        prev_start, prev_stop, prev_phone = parse_line(prev_line, ali_with_phone_proba)
-        start, stop, phone = parse_line(line, ali_with_phone_proba)
-        next_start, next_stop, next_phone = parse_line(next_line, ali_with_phone_proba)
+    for (prev_start, prev_stop, prev_phone), (start, stop, phone), (
+            next_start, next_stop, next_phone) in zip(
+                phones[:-2], phones[1:-1], phones[2:]):
 
         # setup start and stop according to the segment
         # extension
@@ -160,9 +185,9 @@ def _utt2item(utt_id, corpus, lines, segment_extension, exclude_phones,
 
     # use the last line only in 'single_phone' case (and don't process
     # twice the same line as first and last line)
-    if segment_extension == 'single_phone' and len(lines) > 1:
-        start, stop, phone = parse_line(lines[-1], ali_with_phone_proba)
-        _, _, prev_phone = parse_line(lines[-2], ali_with_phone_proba)
+    if segment_extension == 'single_phone' and len(phones) > 1:
+        start, stop, phone = phones[-1]
+        _, _, prev_phone = phones[-2]
 
         _append_item(items, utt_id, start, stop, phone,
                      prev_phone, 'SIL', speaker, exclude_phones)
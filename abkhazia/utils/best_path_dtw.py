@@ -12,80 +12,245 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
-""" Return the best dtw path"""
+"""Return the best dtw path
+
+This is used to get the word alignment from the phone level alignment
+when the aligned phones do not match the phones of the words in the
+lexicon.
+
+The DTW matrix of two sequences x and y is computed by anti-diagonal
+wavefronts: all the cells (i, j) with i + j = k only depend on the
+diagonals k-1 and k-2, so each diagonal is computed at once with
+numpy. The diagonals are stored by row index, so that the three
+predecessors of a diagonal are contiguous slices of the two previous
+ones. Several pairs of sequences can be processed at once (padded to
+the longest ones), and the cells can be restricted to a Sakoe-Chiba
+band around the diagonal of the matrix.
+
+"""
 
-import abkhazia.utils as utils
-import os
-import sys
 import numpy as np
-from operator import itemgetter
 
 
+UP, LEFT, DIAG = 0, 1, 2
+"""The moves of the backtrace, (i-1, j), (i, j-1) and (i-1, j-1)"""
+
+
+def encode(*sequences):
+    """Return the `sequences` of symbols as arrays of integer codes
+
+    The codes are shared by all the sequences, so that equal symbols
+    have equal codes.
+
+    """
+    codes = {}
+    return [np.asarray([codes.setdefault(s, len(codes)) for s in seq],
+                       dtype=np.int64) for seq in sequences]
 
-def dtw(alignment, list_phones, word_pos, utt_align):
-    """ Get the best path from dtw"""
-    """ This was created to get the """
-    """ word alignment from the phone level alignment"""
-    
-    # return if alignment of list of phones is empty 
-    # (can happen if utterance is just noise for example)
-    if (len(alignment) == 0) or (len(list_phones) == 0):
+
+def best_paths(pairs, band=None):
+    """Return the best DTW paths for a list of pairs of sequences
+
+    pairs : a list of pairs (x, y) of integer coded sequences (see
+        encode), both sequences must be non empty
+
+    band : if not None, the radius of a Sakoe-Chiba band around the
+        diagonal of the DTW matrix, in number of cells along the
+        longest sequence. It is enlarged as needed to contain a path.
+        When None the whole matrix is computed.
+
+    The cost of a cell (i, j) is 0 if x[i] == y[j] else 1. The first
+    row and column are excluded but the cell (0, 0), as done by the
+    legacy implementation. Return a list of paths, each path is the
+    list of the moves (UP, LEFT or DIAG) from the last cell of the
+    matrix back to the first row or column.
+
+    """
+    if not pairs:
         return []
-    word_alignment = []
-
-    # init dtw matrix
-    dtw = np.zeros((len(alignment),len(list_phones)))
-    dtw[0,:] = np.inf
-    dtw[:,0] = np.inf
-    dtw[0,0] = 0
-
-    # compute dtw costs
-    for i in range(1,len(alignment)):
-        for j in range(1,len(list_phones)):
-            cost = int(not alignment[i] == list_phones[j])
-            dtw[i,j] = cost + min([dtw[i-1,j], dtw[i,j-1], dtw[i-1, j-1]])
-    word_alignment.append(word_pos[-1])
-
-    # go backward to get the best path
-    i = len(alignment) - 1
-    j = len(list_phones) - 1
-    path = []
-    while (not i == 0 and not j == 0):
-        options = [dtw[i-1,j], dtw[i,j-1], dtw[i-1, j-1]]
-        idx, val = min(enumerate(options), key=itemgetter(1))
-        if idx == 0:
-            i = i-1
+
+    nx = np.asarray([len(x) for x, _ in pairs], dtype=np.int64)
+    ny = np.asarray([len(y) for _, y in pairs], dtype=np.int64)
+    moves = _wavefront(
+        _pad([x for x, _ in pairs], nx.max()),
+        _pad([y for _, y in pairs], ny.max()),
+        nx, ny, band)
+
+    paths = []
+    for b in range(len(pairs)):
+        i, j = nx[b] - 1, ny[b] - 1
+        path = []
+        while i != 0 and j != 0:
+            move = moves.item((b, i + j, i))
+            path.append(move)
+            if move != LEFT:
+                i -= 1
+            if move != UP:
+                j -= 1
+        paths.append(path)
+    return paths
+
+
+def dtw(alignment, list_phones, word_pos, utt_align, band=None):
+    """Get the best path from dtw
+
+    This was created to get the word alignment from the phone level
+    alignment.
+
+    alignment : the list of aligned phones
+
+    list_phones : the list of phones of the transcription, as given
+        by the lexicon
+
+    word_pos : the word of each phone in `list_phones`
+
+    utt_align : the phone level alignment of the utterance, a line per
+        phone in `alignment`
+
+    band : the optional Sakoe-Chiba band, see best_paths
+
+    Return the lines of `utt_align` with the word appended to the
+    first phone of each word.
+
+    """
+    return word_alignments(
+        [(alignment, list_phones, word_pos, utt_align)], band=band)[0]
+
+
+def word_alignments(utterances, band=None, max_cells=4000000):
+    """Return the word alignments of several utterances
+
+    `utterances` is a list of (alignment, list_phones, word_pos,
+    utt_align) as the arguments of dtw. The utterances are processed
+    by batches of similar sizes, with at most `max_cells` cells in
+    each batch.
+
+    """
+    results = [[] for _ in utterances]
+    todo = [n for n, (alignment, list_phones, _, _) in enumerate(utterances)
+            # return if alignment of list of phones is empty (can
+            # happen if utterance is just noise for example)
+            if len(alignment) and len(list_phones)]
+    todo.sort(key=lambda n: (len(utterances[n][0]), len(utterances[n][1])))
+
+    while todo:
+        # the batch are padded to the largest utterance in it
+        batch = [todo.pop()]
+        shape = (len(utterances[batch[0]][0]), len(utterances[batch[0]][1]))
+        while todo and (len(batch) + 1) * (
+                shape[0] + shape[1]) * shape[0] <= max_cells:
+            batch.append(todo.pop())
+
+        paths = best_paths(
+            [encode(utterances[n][0], utterances[n][1]) for n in batch],
+            band=band)
+        for n, path in zip(batch, paths):
+            results[n] = _words(path, *utterances[n][2:])
+    return results
+
+
+def _words(path, word_pos, utt_align):
+    """Return the lines of `utt_align` with words from a DTW `path`"""
+    # go backward along the best path
+    j = len(word_pos) - 1
+    word_alignment = [word_pos[-1]]
+    for move in path:
+        if move == UP:
             word_alignment.append(word_pos[j])
-            path.append((i,j,word_pos[j]))
-            continue
-        elif idx == 1:
-            word_alignment.pop()
-            word_alignment.append(word_pos[j-1])
-            j = j-1
-            path.append((i,j,word_pos[j]))
-            continue
-        elif idx == 2:
-            word_alignment.append(word_pos[j-1])
-            i = i-1
-            j = j-1
-            path.append((i,j,word_pos[j]))
-            continue
+        elif move == LEFT:
+            word_alignment[-1] = word_pos[j - 1]
+            j -= 1
+        else:
+            word_alignment.append(word_pos[j - 1])
+            j -= 1
 
-    # return alignment with words
+    # the path stops on the first column when there is a single
+    # phone in the lexicon, the first rows go to the first word
+    word_alignment.extend(
+        [word_pos[0]] * (len(utt_align) - len(word_alignment)))
     word_alignment.reverse()
 
+    # return alignment with words
     prev_word = ''
     complete_alignment = []
-    for utt,word in zip(utt_align, word_alignment):
+    for utt, word in zip(utt_align, word_alignment):
         if word == prev_word:
-            prev_word = word
             complete_alignment.append(utt)
-            continue
         else:
             prev_word = word
-            complete_alignment.append(u'{} {}'.format(utt,word))
-
-    #complete_alignment = ['{} {}'.format(utt,word)
-    #        for utt, word in zip(utt_align,word_alignment)]
+            complete_alignment.append(u'{} {}'.format(utt, word))
     return complete_alignment
 
+
+def _pad(sequences, size):
+    """Return the `sequences` as the rows of a (len(sequences), size) array"""
+    padded = np.zeros((len(sequences), size), dtype=np.int64)
+    for n, seq in enumerate(sequences):
+        padded[n, :len(seq)] = seq
+    return padded
+
+
+def _wavefront(x, y, nx, ny, band):
+    """Return the backtrace moves of the DTW matrices of x and y
+
+    x and y are (B, N) and (B, M) arrays, the actual lengths of the
+    sequences are nx and ny. Return a (B, N + M, N) array of int8,
+    the move to the cell (i, j) being stored at [:, i + j, i].
+
+    """
+    nbatch, nrows = x.shape
+    ncols = y.shape[1]
+    moves = np.zeros((nbatch, nrows + ncols, nrows), dtype=np.int8)
+
+    if band is not None:
+        # the band radius along the longest axis, enlarged so that
+        # the band contains a path, and the scale factors of the axis
+        longest = np.maximum(np.maximum(nx, ny) - 1., 1)
+        shortest = np.maximum(np.minimum(nx, ny) - 1, 1)
+        radius = np.maximum(
+            band, np.ceil(longest / shortest / 2.) + 1)[:, None]
+        xscale = (longest / np.maximum(nx - 1, 1))[:, None]
+        yscale = (longest / np.maximum(ny - 1, 1))[:, None]
+
+        # the rows of each diagonal in the band, for each pair and for
+        # at least one pair
+        k = np.arange(nrows + ncols)
+        center = k * yscale / (xscale + yscale)
+        width = radius / (xscale + yscale)
+        band_lows = np.ceil(center - width).astype(np.int64)
+        band_highs = np.floor(center + width).astype(np.int64)
+        lows, highs = band_lows.min(axis=0), band_highs.max(axis=0)
+
+    # the diagonals k-1 and k-2, indexed by rows, inf on the first
+    # row and column
+    prev2 = np.full((nbatch, nrows), np.inf)
+    prev1 = np.full((nbatch, nrows), np.inf)
+    prev2[:, 0] = 0
+
+    for k in range(2, nrows + ncols - 1):
+        lo, hi = max(1, k - ncols + 1), min(nrows - 1, k - 1)
+        if band is not None:
+            lo, hi = max(lo, lows[k]), min(hi, highs[k])
+        current = np.full((nbatch, nrows), np.inf)
+        if lo <= hi:
+            options = np.stack((
+                prev1[:, lo - 1:hi],       # UP (i-1, j)
+                prev1[:, lo:hi + 1],       # LEFT (i, j-1)
+                prev2[:, lo - 1:hi]))      # DIAG (i-1, j-1)
+            best = options.argmin(axis=0)
+            moves[:, k, lo:hi + 1] = best
+
+            # the cells (i, k - i) for i in [lo, hi]
+            cost = (x[:, lo:hi + 1] !=
+                    y[:, k - hi:k - lo + 1][:, ::-1]).astype(np.float64)
+            value = cost + options.min(axis=0)
+
+            if band is not None and nbatch > 1:
+                i = np.arange(lo, hi + 1)
+                value[(i < band_lows[:, k:k + 1]) |
+                      (i > band_highs[:, k:k + 1])] = np.inf
+            current[:, lo:hi + 1] = value
+
+        prev2, prev1 = prev1, current
+
+    return moves
@@ -0,0 +1,385 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Provides the StageCache class, a content-addressed cache of results
+
+The recipes stages (a whole recipe or a part of it, such as the
+decoding graph) are cached under a key computed from everything the
+stage depends on: the corpus contents, the stage options and the
+contents of its input directories. When a stage is computed again with
+the same key, its results are restored from the cache instead.
+
+The cache is enabled by setting 'cache-directory' in the 'abkhazia'
+section of the configuration file, 'cache-size' is its maximum size
+in GB. When the cache grows bigger, the least recently used entries
+are removed.
+
+The hashes of the input files are memoized in the cache directory on
+their size and modification time, so that the inputs are read again
+only when modified.
+
+"""
+
+import errno
+import fnmatch
+import hashlib
+import json
+import os
+import shutil
+import stat
+import tempfile
+import time
+
+from abkhazia.utils.config import config
+from abkhazia.utils.logger import null_logger
+
+
+class StageCache(object):
+    """A content-addressed and size-bounded cache of directories
+
+    directory : the directory where the cached entries are stored
+
+    max_size : the maximal size of the cache in bytes, the least
+        recently used entries are removed when it is exceeded. If
+        None the size is unbounded.
+
+    An entry is the copy of a directory, stored under a key. The
+    cached files are read-only. They are restored by hard links when
+    possible (or copied from another filesystem), so they must not be
+    modified in place once restored. The Kaldi scp files refer to
+    their arks by absolute paths, so they are rewritten to point to
+    the directory they are restored in.
+
+    """
+    ignored = ('recipe', '*.log', 'profile.json')
+    """Files and directories not cached nor hashed in a recipe directory"""
+
+    relocated = ('*.scp',)
+    """Files where the absolute path of the cached directory is replaced"""
+
+    hashes = 'hashes.json'
+    """File of the cache directory memoizing the hashes of input files"""
+
+    _placeholder = '@ABKHAZIA_CACHE@'
+
+    def __init__(self, directory, max_size=None, log=null_logger()):
+        self.directory = os.path.abspath(directory)
+        self.max_size = max_size
+        self.log = log
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    @classmethod
+    def from_config(cls, log=null_logger()):
+        """Return the cache defined in the configuration, or None
+
+        Return None if no cache directory is configured.
+
+        """
+        try:
+            directory = config.get('abkhazia', 'cache-directory').strip()
+        except Exception:  # no option or no section
+            return None
+        if not directory:
+            return None
+
+        try:
+            max_size = int(float(config.get('abkhazia', 'cache-size'))
+                           * 1024 ** 3)
+        except Exception:
+            max_size = None
+
+        return cls(directory, max_size=max_size, log=log)
+
+    @classmethod
+    def key(cls, *parts, **kwargs):
+        """Return a hexadecimal key hashing the `parts`
+
+        The parts can be basic values (None, bool, numbers, str),
+        lists, tuples and dicts of them. An absolute path to an
+        existing file or directory is hashed by its contents (see the
+        hash_path() method), ignoring the files matching
+        StageCache.ignored. The optional `memo` keyword argument is
+        passed to hash_path().
+
+        """
+        memo = kwargs.pop('memo', None)
+        return hashlib.sha1(json.dumps(
+            [cls._normalize(part, memo) for part in parts],
+            sort_keys=True)).hexdigest()
+
+    def memoized_key(self, *parts):
+        """Return key(*parts), with the input files hashed once
+
+        The hashes of the files are stored in the cache directory and
+        a file is read again only if its size or modification time
+        changed (see hash_path).
+
+        """
+        filename = os.path.join(self.directory, self.hashes)
+        try:
+            memo = json.load(open(filename, 'r'))
+        except (IOError, OSError, ValueError):
+            memo = {}
+
+        key = self.key(*parts, memo=memo)
+
+        # forget the removed files, write the memo aside and move it
+        # in place for concurrent processes
+        memo = {f: h for f, h in memo.iteritems() if os.path.isfile(f)}
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='tmp.')
+        try:
+            with os.fdopen(fd, 'w') as fout:
+                json.dump(memo, fout)
+            os.rename(tmp, filename)
+        except (IOError, OSError) as err:
+            self.log.debug('cannot write %s: %s', filename, err)
+            os.remove(tmp)
+        return key
+
+    @classmethod
+    def hash_path(cls, path, exclude=(), memo=None):
+        """Return a hash of the contents of a file or directory
+
+        The hash depends on the relative names and the contents of the
+        files, not on their location or modification time. The files
+        and directories matching a pattern in `exclude` are ignored.
+
+        `memo` is an optional dict filename -> (size, mtime, hash) of
+        the files already hashed, updated in place. A file in `memo`
+        is read again only if its size or modification time changed.
+
+        """
+        sha = hashlib.sha1()
+        for relpath, filename in _walk(path, exclude):
+            sha.update(relpath.encode('utf8') + '\0')
+            sha.update(_hash_file(filename, memo) + '\0')
+        return sha.hexdigest()
+
+    def get(self, key, target):
+        """Restore the entry `key` in the `target` directory
+
+        Return True on success, False if `key` is not cached. Existing
+        files in `target` are replaced by the cached ones.
+
+        """
+        entry = self._entry(key)
+        files = os.path.join(entry, 'files')
+        if not os.path.isdir(files):
+            return False
+
+        restored = []
+        try:
+            for relpath, filename in _walk(files):
+                dest = os.path.join(target, relpath)
+                if not os.path.isdir(os.path.dirname(dest)):
+                    os.makedirs(os.path.dirname(dest))
+                if os.path.lexists(dest):
+                    os.remove(dest)
+                if _excluded(relpath, self.relocated):
+                    _replace(filename, dest,
+                             self._placeholder, os.path.abspath(target))
+                else:
+                    _link_or_copy(filename, dest)
+                restored.append(dest)
+        except (OSError, IOError) as err:
+            # the entry has been evicted by a concurrent process
+            self.log.debug('cannot restore %s from cache: %s', key, err)
+            for dest in restored:
+                os.remove(dest)
+            return False
+
+        # the modification time of the manifest is the last access
+        try:
+            os.utime(os.path.join(entry, 'manifest.json'), None)
+        except OSError:
+            pass
+        return True
+
+    def put(self, key, source, exclude=(), name=''):
+        """Store the `source` directory under `key`
+
+        The files matching a pattern in `exclude` are not stored. The
+        cached files are made read-only. Once stored, the least
+        recently used entries are evicted if the cache is too big.
+
+        """
+        entry = self._entry(key)
+        if os.path.isdir(entry):
+            return
+
+        # the entry is built aside and moved in place once complete
+        tmp = tempfile.mkdtemp(dir=self.directory, prefix='tmp.')
+        os.chmod(tmp, 0o755)
+        try:
+            size = 0
+            for relpath, filename in _walk(source, exclude):
+                dest = os.path.join(tmp, 'files', relpath)
+                if not os.path.isdir(os.path.dirname(dest)):
+                    os.makedirs(os.path.dirname(dest))
+                if _excluded(relpath, self.relocated):
+                    _replace(filename, dest,
+                             os.path.abspath(source), self._placeholder)
+                else:
+                    shutil.copy2(filename, dest)
+                os.chmod(dest, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+                size += os.path.getsize(dest)
+
+            with open(os.path.join(tmp, 'manifest.json'), 'w') as fout:
+                json.dump({'key': key, 'name': name, 'size': size,
+                           'created': time.time()}, fout)
+
+            if not os.path.isdir(os.path.dirname(entry)):
+                os.makedirs(os.path.dirname(entry))
+            try:
+                os.rename(tmp, entry)
+            except OSError as err:
+                # stored concurrently by another process
+                if err.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                    raise
+        finally:
+            if os.path.isdir(tmp):
+                shutil.rmtree(tmp)
+
+        self.log.debug('stored %s in cache (%s)', name, key)
+        self.evict()
+
+    def entries(self):
+        """Return the list of (key, size, last access) of the entries"""
+        entries = []
+        for prefix in os.listdir(self.directory):
+            path = os.path.join(self.directory, prefix)
+            if len(prefix) != 2 or not os.path.isdir(path):
+                continue
+
+            for key in os.listdir(path):
+                manifest = os.path.join(path, key, 'manifest.json')
+                try:
+                    size = json.load(open(manifest, 'r'))['size']
+                    entries.append((key, size, os.path.getmtime(manifest)))
+                except (IOError, OSError, ValueError, KeyError):
+                    pass
+        return entries
+
+    def size(self):
+        """Return the size of the cached entries in bytes"""
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """Remove the least recently used entries exceeding max_size"""
+        if self.max_size is None:
+            return
+
+        entries = sorted(self.entries(), key=lambda e: e[2], reverse=True)
+        total = 0
+        for key, size, _ in entries:
+            total += size
+            if total > self.max_size:
+                self.log.debug('evicting %s from cache', key)
+                self.remove(key)
+
+    def remove(self, key):
+        """Remove the entry `key` from the cache"""
+        entry = self._entry(key)
+        if os.path.isdir(entry):
+            # move the entry away first so that it disappears at once
+            trash = tempfile.mkdtemp(dir=self.directory, prefix='tmp.')
+            os.rename(entry, os.path.join(trash, key))
+            shutil.rmtree(trash)
+
+    def _entry(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    @classmethod
+    def _normalize(cls, value, memo=None):
+        """Return `value` as a JSON serializable object for hashing"""
+        if isinstance(value, dict):
+            return {u'{}'.format(k): cls._normalize(v, memo)
+                    for k, v in value.iteritems()}
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            values = [cls._normalize(v, memo) for v in value]
+            return sorted(values) if isinstance(
+                value, (set, frozenset)) else values
+        elif (isinstance(value, basestring) and os.path.isabs(value)
+              and os.path.exists(value)):
+            return {u'hash': cls.hash_path(
+                value, exclude=cls.ignored, memo=memo)}
+        elif isinstance(value, str):
+            return value.decode('utf8')
+        elif value is None or isinstance(value, (bool, int, long, float,
+                                                 unicode)):
+            return value
+        elif hasattr(value, 'value'):  # a kaldi.options.OptionEntry
+            return cls._normalize(value.value, memo)
+        return repr(value)
+
+
+def _walk(path, exclude=()):
+    """Yield sorted (relpath, filename) for the files in `path`"""
+    if os.path.isfile(path):
+        yield os.path.basename(path), path
+        return
+
+    for root, dirs, files in os.walk(path):
+        relroot = os.path.relpath(root, path)
+        dirs[:] = sorted(
+            d for d in dirs if not _excluded(
+                os.path.normpath(os.path.join(relroot, d)), exclude))
+        for name in sorted(files):
+            relpath = os.path.normpath(os.path.join(relroot, name))
+            if not _excluded(relpath, exclude):
+                yield relpath, os.path.join(root, name)
+
+
+def _hash_file(filename, memo=None):
+    """Return the hash of the contents of `filename`, see hash_path"""
+    info = os.stat(filename)
+    filename = os.path.abspath(filename)
+    if isinstance(filename, str):  # the memo is read from JSON
+        filename = filename.decode('utf8')
+    if memo is not None:
+        known = memo.get(filename)
+        if known is not None and list(known[:2]) == [
+                info.st_size, info.st_mtime]:
+            return str(known[2])
+
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as fin:
+        for block in iter(lambda: fin.read(1 << 20), b''):
+            sha.update(block)
+    digest = sha.hexdigest()
+
+    if memo is not None:
+        memo[filename] = (info.st_size, info.st_mtime, digest)
+    return digest
+
+
+def _excluded(relpath, exclude):
+    return any(fnmatch.fnmatch(relpath, pattern) for pattern in exclude)
+
+
+def _replace(source, dest, old, new):
+    """Copy `source` to `dest`, replacing `old` by `new`"""
+    with open(source, 'r') as fin, open(dest, 'w') as fout:
+        fout.write(fin.read().replace(old, new))
+
+
+def _link_or_copy(source, dest):
+    try:
+        os.link(source, dest)
+    except OSError as err:
+        if err.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        shutil.copy2(source, dest)
@@ -12,17 +12,32 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with abkahzia. If not, see <http://www.gnu.org/licenses/>.
-"""Provide functions to launch command-line jobs"""
+"""Provide functions and classes to launch command-line jobs
 
+The run() function executes a single command and blocks until it
+returns. The JobRunner class executes several commands concurrently,
+with a bounded number of simultaneous jobs, per-job timeouts and
+cancellation. The wall time, CPU time and maximum resident memory of
+each job, as well as the bytes it read and wrote on disk, are read
+from wait4. The output of the jobs is forwarded by
+batches from a dedicated thread, so that a slow output function (a
+logger for instance) never blocks the jobs.
+
+"""
+
+import errno
 import os
+import Queue
 import shlex
+import signal
 import subprocess
 import sys
 import threading
+import time
 
 
 def run(command, stdin=None, stdout=sys.stdout.write,
-        cwd=None, env=os.environ, returncode=0):
+        cwd=None, env=os.environ, returncode=0, timeout=None):
     """Run 'command' as a subprocess
 
     command : string to be executed as a subprocess
@@ -42,32 +57,377 @@ def run(command, stdin=None, stdout=sys.stdout.write,
 
     returncode : expected return code of the command
 
-    Returns silently if the command returned with `returncode`, else
-    raise a RuntimeError
+    timeout : if not None, the command is killed after `timeout`
+        seconds
+
+    Returns the executed Job if the command returned with
+    `returncode`, else raise a RuntimeError
+
+    """
+    with JobRunner(njobs=1) as runner:
+        job = runner.submit(
+            command, stdin=stdin, stdout=stdout, cwd=cwd, env=env,
+            returncode=returncode, timeout=timeout)
+        job.wait()
+    return job
+
+
+class Job(object):
+    """A command executed by a JobRunner
+
+    A job is created by JobRunner.submit(). Its `status` is one of
+    'pending', 'running', 'done' (returned the expected code),
+    'failed', 'timeout' or 'cancelled'. Once the job is finished, the
+    following attributes are available:
+
+    exitcode : the return code of the command, negative if killed
+        by a signal
+
+    wall_time, user_time, sys_time : the elapsed and CPU times of the
+        command and its children, in seconds
+
+    maxrss : the maximum resident set size of the command or one of
+        its children, in kilobytes
+
+    read_bytes, write_bytes : the bytes read and written on disk by
+        the command and its children
 
     """
-    job = subprocess.Popen(
-        shlex.split(command),
-        stdin=stdin,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        cwd=cwd, env=env)
-
-    # join the command output to log (from
-    # https://stackoverflow.com/questions/35488927)
-    def consume_lines(pipe, consume):
-        with pipe:
+    def __init__(self, command, stdin=None, stdout=sys.stdout.write,
+                 cwd=None, env=os.environ, returncode=0, timeout=None):
+        self.command = command
+        self.stdin = stdin
+        self.stdout = stdout
+        self.cwd = cwd
+        self.env = env
+        self.returncode = returncode
+        self.timeout = timeout
+
+        self.status = 'pending'
+        self.exitcode = None
+        self.wall_time = None
+        self.user_time = None
+        self.sys_time = None
+        self.maxrss = None
+        self.read_bytes = None
+        self.write_bytes = None
+
+        self._process = None
+        self._exc_info = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    @property
+    def usage(self):
+        """The resources used by the job as a dict"""
+        return {'wall': self.wall_time, 'user': self.user_time,
+                'sys': self.sys_time, 'maxrss': self.maxrss,
+                'read_bytes': self.read_bytes,
+                'write_bytes': self.write_bytes}
+
+    def done(self):
+        """Return True if the job is finished, whatever its status"""
+        return self._done.is_set()
+
+    def wait(self):
+        """Block until the job is finished
+
+        Raise RuntimeError if the job failed, timed out or was
+        cancelled. Raise OSError if the command cannot be executed.
+
+        """
+        # wait by small steps to stay responsive to KeyboardInterrupt
+        try:
+            while not self._done.wait(0.1):
+                pass
+        except KeyboardInterrupt:
+            self.cancel()
+            raise
+
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+
+        if self.status == 'failed':
+            raise RuntimeError('command "{}" returned with {}'.format(
+                self.command, self.exitcode))
+        elif self.status == 'timeout':
+            raise RuntimeError('command "{}" timed out after {}s'.format(
+                self.command, self.timeout))
+        elif self.status == 'cancelled':
+            raise RuntimeError('command "{}" cancelled'.format(self.command))
+
+    def cancel(self):
+        """Cancel the job, kill the command if it is running"""
+        self._kill('cancelled')
+
+    def _kill(self, status):
+        """Kill the command and its children, set the job `status`"""
+        with self._lock:
+            if self.status == 'pending':
+                self.status = status
+                self._done.set()
+            elif self.status == 'running':
+                self.status = status
+                try:
+                    os.killpg(self._process.pid, signal.SIGKILL)
+                except OSError:  # already finished
+                    pass
+
+    def _execute(self, output):
+        """Run the command, send its output lines to the `output` queue
+
+        This method is called from a JobRunner worker thread and
+        returns once the job is finished and its output forwarded.
+
+        """
+        with self._lock:
+            if self.status != 'pending':  # cancelled
+                return
+
+            start = time.time()
+            try:
+                # the command is the leader of a new process group, so
+                # that it can be killed with all its children
+                self._process = subprocess.Popen(
+                    shlex.split(self.command),
+                    stdin=self.stdin,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    cwd=self.cwd, env=self.env,
+                    close_fds=True, preexec_fn=os.setsid)
+            except Exception:
+                self._exc_info = sys.exc_info()
+                self.status = 'failed'
+                self._done.set()
+                return
+            self.status = 'running'
+
+        reader = threading.Thread(target=self._read_output, args=(output,))
+        reader.daemon = True
+        reader.start()
+
+        timer = None
+        if self.timeout is not None:
+            timer = threading.Timer(self.timeout, self._kill, ['timeout'])
+            timer.daemon = True
+            timer.start()
+
+        try:
+            status, rusage = _wait4(self._process.pid)
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+        self.wall_time = time.time() - start
+        self.user_time = rusage.ru_utime
+        self.sys_time = rusage.ru_stime
+        self.maxrss = rusage.ru_maxrss
+        # counted in blocks of 512 bytes on Linux
+        self.read_bytes = rusage.ru_inblock * 512
+        self.write_bytes = rusage.ru_oublock * 512
+        self.exitcode = (-os.WTERMSIG(status) if os.WIFSIGNALED(status)
+                         else os.WEXITSTATUS(status))
+
+        # the process is reaped, prevent Popen to wait for it again
+        self._process.returncode = self.exitcode
+
+        # wait the whole output is forwarded before notifying the end
+        reader.join()
+        flushed = threading.Event()
+        output.put(flushed)
+        flushed.wait()
+
+        with self._lock:
+            if self.status == 'running':
+                self.status = (
+                    'done' if self.exitcode == self.returncode else 'failed')
+            self._done.set()
+
+    def _read_output(self, output):
+        with self._process.stdout as pipe:
             # NOTE: workaround read-ahead bug
             for line in iter(pipe.readline, b''):
-                consume(line)
-            consume('\n')
+                output.put((self.stdout, line))
+
+
+class JobRunner(object):
+    """Run command-line jobs concurrently
+
+    njobs : the maximum number of jobs running simultaneously
+
+    stdout, cwd, env : default parameters for the submitted jobs, see
+        the run() function
+
+    The jobs are submitted with submit() or map() and are executed in
+    submission order by `njobs` worker threads. The runner must be
+    closed once used, preferably in a with statement:
+
+        with JobRunner(njobs=4, stdout=log.debug) as runner:
+            jobs = runner.map(commands, timeout=3600)
+        for job in jobs:
+            print job.command, job.wall_time, job.maxrss
+
+    """
+    def __init__(self, njobs=1, stdout=sys.stdout.write,
+                 cwd=None, env=os.environ):
+        if njobs < 1:
+            raise RuntimeError(
+                'njobs must be strictly positive, it is {}'.format(njobs))
+
+        self.njobs = njobs
+        self.stdout = stdout
+        self.cwd = cwd
+        self.env = env
+
+        self._jobs = []
+        self._pending = Queue.Queue()
+        self._output = Queue.Queue()
+        self._output_error = None
+
+        self._workers = [threading.Thread(target=self._work)
+                         for _ in range(njobs)]
+        self._forwarder = threading.Thread(target=self._forward)
+        for thread in self._workers + [self._forwarder]:
+            thread.daemon = True
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is not None:
+            self.cancel()
+        self.close()
+
+    def submit(self, command, stdin=None, stdout=None, cwd=None, env=None,
+               returncode=0, timeout=None):
+        """Submit a command for execution, return its Job
+
+        The parameters are the same as the run() function, stdout, cwd
+        and env default to those of the runner.
+
+        """
+        job = Job(
+            command, stdin=stdin,
+            stdout=self.stdout if stdout is None else stdout,
+            cwd=self.cwd if cwd is None else cwd,
+            env=self.env if env is None else env,
+            returncode=returncode, timeout=timeout)
+
+        self._jobs.append(job)
+        self._pending.put(job)
+        return job
+
+    def map(self, commands, **kwargs):
+        """Submit the `commands` and wait for them, return their jobs
+
+        `kwargs` are passed to submit(). Raise on the first failed job,
+        the other jobs being cancelled, see wait().
+
+        """
+        return self.wait([self.submit(command, **kwargs)
+                          for command in commands])
+
+    def wait(self, jobs=None):
+        """Wait for the `jobs` to finish, default to all submitted jobs
+
+        As soon as a job fails, the other ones are cancelled and the
+        error of the failed job is raised. Return the list of jobs.
+
+        """
+        jobs = list(self._jobs) if jobs is None else list(jobs)
+
+        try:
+            while True:
+                failed = [j for j in jobs if j.done() and j.status != 'done']
+                if failed:
+                    for job in jobs:
+                        job.cancel()
+                    failed[0].wait()
+
+                running = [j for j in jobs if not j.done()]
+                if not running:
+                    break
+                running[0]._done.wait(0.1)
+        except KeyboardInterrupt:
+            for job in jobs:
+                job.cancel()
+            raise
+
+        if self._output_error is not None:
+            error = self._output_error
+            raise error[0], error[1], error[2]
+        return jobs
+
+    def cancel(self):
+        """Cancel all the submitted jobs"""
+        for job in self._jobs:
+            job.cancel()
+
+    def close(self):
+        """Wait for the submitted jobs and stop the runner threads"""
+        for _ in self._workers:
+            self._pending.put(None)
+        for worker in self._workers:
+            worker.join()
+
+        self._output.put(None)
+        self._forwarder.join()
+
+    def _work(self):
+        while True:
+            job = self._pending.get()
+            if job is None:
+                return
+            job._execute(self._output)
+
+    def _forward(self):
+        """Forward the jobs output, grouping consecutive lines by batch"""
+        stop = False
+        while not stop:
+            # wait for an item and take all the available ones
+            items = [self._output.get()]
+            while True:
+                try:
+                    items.append(self._output.get_nowait())
+                except Queue.Empty:
+                    break
+
+            batch, batch_stdout = [], None
+            for item in items:
+                if isinstance(item, tuple) and item[0] == batch_stdout:
+                    batch.append(item[1])
+                    continue
+
+                if batch:
+                    self._write(batch_stdout, ''.join(batch))
+                    batch = []
+
+                if isinstance(item, tuple):
+                    batch_stdout, batch = item[0], [item[1]]
+                elif item is None:  # sent by close()
+                    stop = True
+                else:  # a job waiting for its output to be flushed
+                    item.set()
+
+            if batch:
+                self._write(batch_stdout, ''.join(batch))
 
-    threading.Thread(
-        target=consume_lines,
-        args=[job.stdout, lambda line: stdout(line)]).start()
+    def _write(self, stdout, data):
+        try:
+            stdout(data)
+        except Exception:
+            # reported by wait(), the forwarding goes on to not block
+            # the jobs
+            if self._output_error is None:
+                self._output_error = sys.exc_info()
 
-    job.wait()
 
-    if job.returncode != returncode:
-        raise RuntimeError('command "{}" returned with {}'
-                           .format(command, job.returncode))
+def _wait4(pid):
+    """Wait for the process `pid`, return its (status, rusage)"""
+    while True:
+        try:
+            return os.wait4(pid, 0)[1:]
+        except OSError as err:
+            if err.errno != errno.EINTR:
+                raise
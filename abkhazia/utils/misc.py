@@ -19,6 +19,8 @@ import collections
 import multiprocessing
 import re
 
+import numpy as np
+
 import config  # this is abkhazia.utils.config
 
 
@@ -92,6 +94,41 @@ def unique(seq, sort=False):
     return sorted(keys.keys()) if sort else keys.keys()
 
 
+def overlapping_intervals(starts, stops):
+    """Return the pairs of intervals overlapping each other
+
+    The intervals are [starts[i], stops[i]] and two intervals overlap
+    if their intersection has a positive length. The intervals are
+    swept by increasing start: the intervals overlapping the interval
+    i and starting after it are the next ones starting before its
+    stop, found by binary search. This runs in O(n log n + k) for n
+    intervals and k overlapping pairs.
+
+    Return 3 arrays (first, second, duration): the intervals first[k]
+    and second[k] overlap during duration[k], with first[k] starting
+    before second[k].
+
+    """
+    starts = np.asarray(starts, dtype=np.float64)
+    stops = np.asarray(stops, dtype=np.float64)
+    order = np.argsort(starts, kind='mergesort')
+    starts, stops = starts[order], stops[order]
+
+    # number of intervals starting after each interval and before its stop
+    index = np.arange(starts.size)
+    counts = np.maximum(
+        np.searchsorted(starts, stops, side='left') - index - 1, 0)
+
+    # expand all the (first, second) candidate pairs
+    first = np.repeat(index, counts)
+    second = first + 1 + (
+        np.arange(first.size) - np.repeat(np.cumsum(counts) - counts, counts))
+    duration = np.minimum(stops[first], stops[second]) - starts[second]
+
+    overlap = duration > 0
+    return order[first[overlap]], order[second[overlap]], duration[overlap]
+
+
 def open_utf8(filename, mode='rb'):
     """Open a file encoded in UTF-8 and return its handler"""
     return codecs.open(filename, mode=mode, encoding='UTF-8')
@@ -106,3 +143,38 @@ def natural_sort_keys(text):
     def atoi(text):
         return int(text) if text.isdigit() else text
     return [atoi(c) for c in re.split('(\d+)', text)]
+
+
+class TrackedDict(dict):
+    """A dict recording a version number incremented on each change
+
+    This is used to invalidate the values derived from a dict (for
+    instance an inverted index) when it is modified: store the
+    version number along with the derived value and compute it again
+    when they differ.
+
+    """
+    def __init__(self, *args, **kwargs):
+        super(TrackedDict, self).__init__(*args, **kwargs)
+        self.version = 0
+
+    def _changed(method):
+        def wrapper(self, *args, **kwargs):
+            self.version += 1
+            return method(self, *args, **kwargs)
+        wrapper.__name__ = method.__name__
+        wrapper.__doc__ = method.__doc__
+        return wrapper
+
+    __setitem__ = _changed(dict.__setitem__)
+    __delitem__ = _changed(dict.__delitem__)
+    clear = _changed(dict.clear)
+    pop = _changed(dict.pop)
+    popitem = _changed(dict.popitem)
+    setdefault = _changed(dict.setdefault)
+    update = _changed(dict.update)
+
+    del _changed
+
+    def __reduce__(self):
+        return (TrackedDict, (dict(self),))
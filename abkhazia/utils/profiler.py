@@ -0,0 +1,140 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Provides the Profiler class measuring the resources used by recipes"""
+
+import contextlib
+import json
+import resource
+import time
+
+
+class Profiler(object):
+    """Measure the resources used by the stages of a recipe
+
+    A stage is a block of code profiled with the stage() context
+    manager. For each stage are recorded the wall time, the CPU time
+    (of abkhazia and of its subprocesses), the peak resident memory
+    reached so far and the bytes read and written on disk.
+
+    The commands executed during a stage (as utils.jobs.Job) are
+    registered with add_job(), with their own resources usage.
+
+    The profile is saved as JSON with save(), summary() returns a
+    human readable report.
+
+    """
+    def __init__(self):
+        self.stages = []
+        self.commands = []
+        self._stage = None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Profile the code executed in the with block as stage `name`"""
+        stage = {'name': name, 'status': 'running'}
+        self.stages.append(stage)
+        previous, self._stage = self._stage, name
+
+        start = _usage()
+        try:
+            yield
+            stage['status'] = 'done'
+        except BaseException:
+            stage['status'] = 'failed'
+            raise
+        finally:
+            stop = _usage()
+            stage.update({key: stop[key] - start[key] for key in (
+                'wall', 'cpu', 'read_bytes', 'write_bytes')})
+            stage['maxrss'] = stop['maxrss']
+            self._stage = previous
+
+    def add_job(self, job):
+        """Register a finished utils.jobs.Job in the current stage"""
+        self.commands.append({
+            'stage': self._stage,
+            'command': job.command,
+            'status': job.status,
+            'wall': job.wall_time,
+            'cpu': (None if job.user_time is None
+                    else job.user_time + job.sys_time),
+            'maxrss': job.maxrss,
+            'read_bytes': job.read_bytes,
+            'write_bytes': job.write_bytes})
+
+    def save(self, filename):
+        """Write the profile to `filename` in JSON"""
+        with open(filename, 'w') as fout:
+            json.dump({'stages': self.stages, 'commands': self.commands},
+                      fout, indent=2, sort_keys=True)
+
+    @classmethod
+    def load(cls, filename):
+        """Return a Profiler loaded from a JSON `filename`"""
+        data = json.load(open(filename, 'r'))
+        profiler = cls()
+        profiler.stages = data['stages']
+        profiler.commands = data['commands']
+        return profiler
+
+    def summary(self, ncommands=5):
+        """Return a report on stages and the `ncommands` longest commands"""
+        row = '{:<40} {:>10} {:>10} {:>12} {:>10} {:>10}'
+        lines = [row.format(
+            'stage', 'wall (s)', 'cpu (s)', 'maxrss (MB)',
+            'read (MB)', 'write (MB)')]
+
+        def _format(name, entry):
+            return row.format(
+                name[:40],
+                *(_number(entry[key], scale) for key, scale in (
+                    ('wall', 1), ('cpu', 1), ('maxrss', 1024),
+                    ('read_bytes', 1024 ** 2), ('write_bytes', 1024 ** 2))))
+
+        for stage in self.stages:
+            name = stage['name'] + (
+                '' if stage['status'] == 'done'
+                else ' ({})'.format(stage['status']))
+            lines.append(_format(name, stage))
+
+        commands = sorted(
+            (c for c in self.commands if c['wall'] is not None),
+            key=lambda c: c['wall'], reverse=True)[:ncommands]
+        if commands:
+            lines.append('')
+            lines.append(row.format(
+                'longest commands', '', '', '', '', '').rstrip())
+            for command in commands:
+                lines.append(_format(command['command'], command))
+
+        return '\n'.join(lines)
+
+
+def _number(value, scale):
+    return '-' if value is None else '{:.1f}'.format(value / float(scale))
+
+
+def _usage():
+    """Return the current resources usage of the process and children"""
+    usages = [resource.getrusage(resource.RUSAGE_SELF),
+              resource.getrusage(resource.RUSAGE_CHILDREN)]
+
+    return {
+        'wall': time.time(),
+        'cpu': sum(u.ru_utime + u.ru_stime for u in usages),
+        # Linux reports maxrss in kB and blocks of 512 bytes
+        'maxrss': max(u.ru_maxrss for u in usages),
+        'read_bytes': sum(u.ru_inblock for u in usages) * 512,
+        'write_bytes': sum(u.ru_oublock for u in usages) * 512}
@@ -25,6 +25,7 @@ import os
 import shlex
 import shutil
 import subprocess
+import tempfile
 import wave
 
 import joblib
@@ -183,13 +184,14 @@ _metawav = collections.namedtuple(
 def _scan_one(wav):
     """scan a single wav file and return a metawav tuple"""
     try:
-        param = wave.open(wav, 'r').getparams()
+        with contextlib.closing(wave.open(wav, 'r')) as w:
+            param = w.getparams()
         return _metawav(
             param[0], param[1], param[2],
             param[3], param[4], param[5],
             param[3]/float(param[2]))  # duration
-    except EOFError:
-        return _metawav(nframes=0)
+    except EOFError:  # empty file
+        return _metawav(0, 0, 0, 0, 'NONE', 'not compressed', 0.0)
 
 
 def scan(wavs, njobs=1, verbose=0):
@@ -222,3 +224,149 @@ def duration(wav):
     """Return the duration of a wav file in seconds"""
     with contextlib.closing(wave.open(wav, 'r')) as w:
         return w.getnframes() / float(w.getframerate())
+
+
+class WavIndex(object):
+    """Persistent index of metadata on the wav files of a folder
+
+    Opening the header of each wav file is slow on big corpora
+    (especially on network file systems). This class stores the
+    metainformation returned by scan() for the wavs in `wav_folder`,
+    and optionally saves it to `index_file` so that it persists
+    between runs.
+
+    Each entry is keyed by the path of the wav relative to
+    `wav_folder` and records the size and modification time of the
+    file it describes. An entry is outdated as soon as the file size
+    or mtime changes: only the outdated or missing entries are scanned
+    again, the others are read from the index.
+
+    The updated entries are saved at once by flush(), scan() calls it
+    by default.
+
+    """
+    def __init__(self, wav_folder, index_file=None):
+        self.wav_folder = wav_folder
+        self.index_file = index_file
+
+        # wav -> (size, mtime, metawav)
+        self._entries = {}
+
+        # True when entries are updated but not saved
+        self._modified = False
+        if index_file is not None and os.path.isfile(index_file):
+            self._load(index_file)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def scan(self, wavs, njobs=1, flush=True):
+        """Return a dict of metainformation on `wavs`
+
+        wavs : a sequence of wav files, relative to self.wav_folder
+
+        njobs : the number of parallel scans of outdated wavs
+
+        flush : if True, save the index file if it changed, else the
+            caller must call flush() once done
+
+        The returned dict is indexed by the elements of `wavs`, with
+        values as returned by the scan() function. Outdated entries of
+        the index are updated.
+
+        Raise IOError if a wav file does not exist.
+
+        """
+        stats = {}
+        for wav in set(wavs):
+            try:
+                stat = os.stat(os.path.join(self.wav_folder, wav))
+            except OSError:
+                raise IOError('wav file not found: {}'.format(
+                    os.path.join(self.wav_folder, wav)))
+            stats[wav] = (stat.st_size, stat.st_mtime)
+
+        outdated = [w for w, s in stats.iteritems()
+                    if w not in self._entries or self._entries[w][:2] != s]
+        if outdated:
+            meta = scan([os.path.join(self.wav_folder, w) for w in outdated],
+                        njobs=njobs)
+            for wav in outdated:
+                self._entries[wav] = stats[wav] + (
+                    meta[os.path.join(self.wav_folder, wav)],)
+            self._modified = True
+
+        if flush:
+            self.flush()
+        return {wav: self._entries[wav][2] for wav in stats}
+
+    def duration(self, wav):
+        """Return the duration in seconds of `wav`, relative to wav_folder
+
+        The index is not saved, call flush() after the last duration.
+
+        """
+        return self.scan([wav], flush=False)[wav].duration
+
+    def flush(self):
+        """Save the index file if entries were updated, ignoring errors"""
+        if self._modified:
+            self.save(safe=True)
+
+    def save(self, index_file=None, safe=False):
+        """Write the index to `index_file` (default to self.index_file)
+
+        The file is written atomically so that concurrent readers
+        never see a partial index, with permissions following the
+        umask so that it can be shared. If `safe` is True, ignore
+        errors (when the index cannot be written, for instance in a
+        read-only corpus).
+
+        """
+        index_file = self.index_file if index_file is None else index_file
+        if index_file is None:
+            return
+
+        tmp = None
+        try:
+            directory = os.path.dirname(os.path.abspath(index_file))
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+
+            with tempfile.NamedTemporaryFile(
+                    'w', dir=directory, delete=False) as tmp:
+                for wav, (size, mtime, m) in sorted(
+                        self._entries.iteritems()):
+                    tmp.write('\t'.join(
+                        [wav, str(size), repr(mtime)] +
+                        [str(v) for v in m[:5]] + [m[5]]) + '\n')
+
+            # temporary files are created with mode 0600
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp.name, 0o666 & ~umask)
+
+            os.rename(tmp.name, index_file)
+            if index_file == self.index_file:
+                self._modified = False
+        except (IOError, OSError):
+            if tmp is not None and os.path.exists(tmp.name):
+                os.remove(tmp.name)
+            if not safe:
+                raise
+
+    def _load(self, index_file):
+        """Read the entries from `index_file`, ignoring corrupted lines"""
+        for line in open(index_file, 'r'):
+            try:
+                (wav, size, mtime, nbc, width, rate, nframes,
+                 comptype, compname) = line.rstrip('\n').split('\t')
+                size, mtime = int(size), float(mtime)
+                nbc, width, rate, nframes = [
+                    int(v) for v in (nbc, width, rate, nframes)]
+            except ValueError:
+                continue
+
+            self._entries[wav] = (size, mtime, _metawav(
+                nbc, width, rate, nframes, comptype, compname,
+                nframes / float(rate) if rate else 0.0))
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Benchmark of Corpus.load from text files and from the binary cache
+
+Generates a synthetic corpus (1M utterances by default), saves it and
+compares the loading times with and without the binary cache.
+
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from abkhazia.corpus import Corpus
+
+
+def synthetic_corpus(nutts, nspks=1000, utts_per_wav=100, nwords=20000):
+    """Return a random corpus of `nutts` utterances (without wavs)"""
+    random.seed(0)
+    corpus = Corpus()
+    words = ['w{:06d}'.format(i) for i in range(nwords)]
+    phones = ['p{:02d}'.format(i) for i in range(40)]
+    corpus.phones = {p: p for p in phones}
+    corpus.lexicon = {w: ' '.join(random.sample(phones, 5)) for w in words}
+    corpus.silences = ['SIL', 'SPN']
+
+    for i in range(nutts):
+        spk = 's{:04d}'.format(i % nspks)
+        utt = '{}-u{:08d}'.format(spk, i)
+        wav = '{}-{:06d}.wav'.format(spk, i // (nspks * utts_per_wav))
+        tstart = (i // nspks % utts_per_wav) * 2.5
+        corpus.segments[utt] = (wav, tstart, tstart + 2.0)
+        corpus.utt2spk[utt] = spk
+        corpus.text[utt] = ' '.join(random.sample(words, 10))
+    corpus.wavs = set(w for w, _, _ in corpus.segments.itervalues())
+    return corpus
+
+
+def timeit(func, repeat=3):
+    """Return the best time of `repeat` calls to func()"""
+    times = []
+    for _ in range(repeat):
+        t0 = time.time()
+        func()
+        times.append(time.time() - t0)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '-n', '--nutts', type=int, default=1000000,
+        help='number of utterances in the corpus, default is %(default)s')
+    parser.add_argument(
+        '-r', '--repeat', type=int, default=3,
+        help='number of repetitions of each load, default is %(default)s')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        corpus_dir = os.path.join(tmpdir, 'data')
+        print 'generating a corpus of {} utterances...'.format(args.nutts)
+        corpus = synthetic_corpus(args.nutts)
+        t0 = time.time()
+        corpus.save(corpus_dir, no_wavs=True)
+        t_save = time.time() - t0
+        os.makedirs(os.path.join(corpus_dir, 'wavs'))
+        del corpus
+
+        t_text = timeit(
+            lambda: Corpus.load(corpus_dir, use_cache=False), args.repeat)
+        t_cache = timeit(
+            lambda: Corpus.load(corpus_dir, use_cache=True), args.repeat)
+
+        print 'save (text + cache): {:.2f}s'.format(t_save)
+        print 'load from text:      {:.2f}s'.format(t_text)
+        print 'load from cache:     {:.2f}s'.format(t_cache)
+        print 'speedup:             {:.1f}x'.format(t_text / t_cache)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
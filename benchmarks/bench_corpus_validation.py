@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Benchmark of the corpus validation on long wavs
+
+Generates a synthetic corpus of long wavs (10k wavs of 120 segments
+by default) and times CorpusValidation.validate(). The wav files are
+not generated, their metadata are given to the validation instead.
+
+"""
+
+import argparse
+import random
+import time
+
+from abkhazia.corpus import Corpus
+from abkhazia.corpus.corpus_validation import CorpusValidation
+from abkhazia.utils.wav import _metawav
+
+
+def synthetic_corpus(nwavs, utts_per_wav, nwords=20000):
+    """Return a random corpus and the metadata of its wavs"""
+    random.seed(0)
+    corpus = Corpus()
+    words = ['w{:06d}'.format(i) for i in range(nwords)]
+    phones = ['p{:02d}'.format(i) for i in range(40)]
+    corpus.phones = {p: p for p in phones}
+    corpus.lexicon = {w: ' '.join(random.sample(phones, 5)) for w in words}
+    corpus.silences = ['SIL', 'SPN']
+
+    segments, utt2spk, text = {}, {}, {}
+    for i in range(nwavs):
+        spk = 's{:04d}'.format(i % 1000)
+        wav = '{}-{:06d}.wav'.format(spk, i)
+        for j in range(utts_per_wav):
+            utt = '{}-{:06d}-{:04d}'.format(spk, i, j)
+            segments[utt] = (wav, j * 2.5, j * 2.5 + 2.0)
+            utt2spk[utt] = spk
+            text[utt] = ' '.join(random.sample(words, 10))
+    corpus.segments = segments
+    corpus.utt2spk = utt2spk
+    corpus.text = text
+    corpus.wavs = set(w for w, _, _ in segments.itervalues())
+
+    duration = utts_per_wav * 2.5
+    meta = {w: _metawav(1, 2, 16000, int(duration * 16000),
+                        'NONE', 'not compressed', duration)
+            for w in corpus.wavs}
+    return corpus, meta
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '-w', '--nwavs', type=int, default=10000,
+        help='number of wavs in the corpus, default is %(default)s')
+    parser.add_argument(
+        '-u', '--utts-per-wav', type=int, default=120,
+        help='number of segments per wav, default is %(default)s')
+    parser.add_argument(
+        '-j', '--njobs', type=int, default=4,
+        help='number of parallel jobs, default is %(default)s')
+    args = parser.parse_args()
+
+    print 'generating a corpus of {} wavs with {} segments each...'.format(
+        args.nwavs, args.utts_per_wav)
+    corpus, meta = synthetic_corpus(args.nwavs, args.utts_per_wav)
+
+    for njobs in sorted(set([1, args.njobs])):
+        # validate a fresh copy so that the derived views of the
+        # corpus are computed in each run
+        copy = corpus.subcorpus(corpus.utts(), prune=False, validate=False)
+        t0 = time.time()
+        CorpusValidation(copy, njobs=njobs).validate(meta)
+        print 'validation with {} job(s): {:.2f}s'.format(
+            njobs, time.time() - t0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Benchmark of the DTW used to recover word alignments
+
+Generates synthetic phone sequences (50 to 2000 phones by default),
+aligned phones being the lexicon ones with deletions, substitutions
+and repetitions. Times the former cell by cell DTW against the
+wavefront DTW, with and without a Sakoe-Chiba band, and checks they
+give the same word alignments.
+
+"""
+
+import argparse
+import random
+import time
+
+import numpy as np
+
+from abkhazia.utils import best_path_dtw
+
+
+def legacy_dtw(alignment, list_phones, word_pos, utt_align):
+    """The former cell by cell DTW of abkhazia.utils.best_path_dtw"""
+    if (len(alignment) == 0) or (len(list_phones) == 0):
+        return []
+    word_alignment = []
+
+    dtw = np.zeros((len(alignment), len(list_phones)))
+    dtw[0, :] = np.inf
+    dtw[:, 0] = np.inf
+    dtw[0, 0] = 0
+
+    for i in range(1, len(alignment)):
+        for j in range(1, len(list_phones)):
+            cost = int(not alignment[i] == list_phones[j])
+            dtw[i, j] = cost + min(
+                [dtw[i-1, j], dtw[i, j-1], dtw[i-1, j-1]])
+    word_alignment.append(word_pos[-1])
+
+    i = len(alignment) - 1
+    j = len(list_phones) - 1
+    while not i == 0 and not j == 0:
+        options = [dtw[i-1, j], dtw[i, j-1], dtw[i-1, j-1]]
+        idx = min(enumerate(options), key=lambda o: o[1])[0]
+        if idx == 0:
+            i = i-1
+            word_alignment.append(word_pos[j])
+        elif idx == 1:
+            word_alignment.pop()
+            word_alignment.append(word_pos[j-1])
+            j = j-1
+        else:
+            word_alignment.append(word_pos[j-1])
+            i = i-1
+            j = j-1
+    word_alignment.reverse()
+
+    prev_word = ''
+    complete_alignment = []
+    for utt, word in zip(utt_align, word_alignment):
+        if word == prev_word:
+            complete_alignment.append(utt)
+        else:
+            prev_word = word
+            complete_alignment.append(u'{} {}'.format(utt, word))
+    return complete_alignment
+
+
+def synthetic_utterance(nphones, nsymbols=40, error=0.05):
+    """Return the arguments of best_path_dtw.dtw for a random utterance"""
+    phones = ['p{:02d}'.format(i) for i in range(nsymbols)]
+    list_phones = [random.choice(phones) for _ in range(nphones)]
+    word_pos = ['w{}'.format(i // 4) for i in range(nphones)]
+
+    alignment = []
+    for phone in list_phones:
+        if random.random() < error:
+            continue
+        if random.random() < error:
+            phone = random.choice(phones)
+        alignment.extend([phone] * (2 if random.random() < error else 1))
+    utt_align = ['utt 0.0 0.1 {}'.format(p) for p in alignment]
+    return alignment, list_phones, word_pos, utt_align
+
+
+def timeit(func, repeat=3):
+    """Return the best time of `repeat` calls to func() and its result"""
+    times = []
+    for _ in range(repeat):
+        t0 = time.time()
+        result = func()
+        times.append(time.time() - t0)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '-n', '--nphones', type=int, nargs='+',
+        default=[50, 100, 200, 500, 1000, 2000],
+        help='lengths of the phone sequences, default is %(default)s')
+    parser.add_argument(
+        '-b', '--band', type=int, default=50,
+        help='radius of the Sakoe-Chiba band, default is %(default)s')
+    parser.add_argument(
+        '-r', '--repeat', type=int, default=3,
+        help='number of repetitions of each DTW, default is %(default)s')
+    parser.add_argument(
+        '--batch', type=int, default=100,
+        help='number of utterances of 50 phones in the batched test, '
+        'default is %(default)s')
+    args = parser.parse_args()
+
+    random.seed(0)
+    print '{:>8} {:>10} {:>10} {:>10} {:>8} {:>6}'.format(
+        'phones', 'legacy', 'wavefront', 'banded', 'speedup', 'same')
+    for nphones in args.nphones:
+        utt = synthetic_utterance(nphones)
+        t_legacy, legacy = timeit(lambda: legacy_dtw(*utt), args.repeat)
+        t_full, full = timeit(
+            lambda: best_path_dtw.dtw(*utt), args.repeat)
+        t_band, banded = timeit(
+            lambda: best_path_dtw.dtw(*utt, band=args.band), args.repeat)
+        print '{:>8} {:>9.3f}s {:>9.3f}s {:>9.3f}s {:>7.1f}x {:>6}'.format(
+            nphones, t_legacy, t_full, t_band, t_legacy / t_full,
+            str(legacy == full == banded))
+
+    utts = [synthetic_utterance(50) for _ in range(args.batch)]
+    t_legacy, legacy = timeit(
+        lambda: [legacy_dtw(*utt) for utt in utts], args.repeat)
+    t_batch, batch = timeit(
+        lambda: best_path_dtw.word_alignments(utts), args.repeat)
+    print '{} x 50 phones: legacy {:.3f}s, batched {:.3f}s, same {}'.format(
+        args.batch, t_legacy, t_batch, legacy == batch)
+
+
+if __name__ == '__main__':
+    main()
@@ -15,7 +15,10 @@
 """Abkhazia test setup"""
 
 import os
+import random
 import re
+import struct
+import wave
 
 import pytest
 
@@ -48,6 +51,66 @@ def assert_expr_in_log(flog, expr):
     assert len(matched_lines)
 
 
+def synthetic_corpus(wav_folder):
+    """Return a little corpus of 3 utterances on the wavs s1 and s2"""
+    c = Corpus()
+    c.wav_folder = wav_folder
+    c.wavs = {'s1.wav', 's2.wav'}
+    c.segments = {'s1-u1': ('s1.wav', 0.0, 1.5),
+                  's1-u2': ('s1.wav', 1.5, 2.123456789),
+                  's2-u1': ('s2.wav', None, None)}
+    c.utt2spk = {'s1-u1': 's1', 's1-u2': 's1', 's2-u1': 's2'}
+    c.text = {'s1-u1': u'hello  world', 's1-u2': u'\xe9t\xe9', 's2-u1': u''}
+    c.lexicon = {'hello': 'h e l o', 'world': 'w o r l d',
+                 u'\xe9t\xe9': 'e t e', '<unk>': 'SPN'}
+    c.phones = {p: p for p in 'helowrdt'}
+    c.silences = ['SIL', 'SPN']
+    return c
+
+
+def write_wav(path, nframes, rate=16000):
+    """Write a silent mono 16 bits wav of `nframes` frames"""
+    w = wave.open(path, 'w')
+    w.setparams((1, 2, rate, 0, 'NONE', 'not compressed'))
+    w.writeframes('\x00\x00' * nframes)
+    w.close()
+
+
+@pytest.fixture
+def wav_corpus(tmpdir):
+    """Return the synthetic corpus with wavs of 2.5s (s1) and 1s (s2)"""
+    wavs = str(tmpdir.mkdir('wavs'))
+    write_wav(os.path.join(wavs, 's1.wav'), 40000)
+    write_wav(os.path.join(wavs, 's2.wav'), 16000)
+    return synthetic_corpus(wavs)
+
+
+def posterior_ark(arkfile, data):
+    """Write `data`, a list of (utt, frames), as binary posterior ark
+
+    Each frame is a list of (id, weight) pairs, as written by Kaldi.
+
+    """
+    def _dims(*dims):
+        return ''.join(struct.pack('<bi', 4, d) for d in dims)
+
+    with open(arkfile, 'wb') as fout:
+        for utt, frames in data:
+            fout.write(utt + ' \0B' + _dims(len(frames)) + ''.join(
+                _dims(len(frame)) + ''.join(
+                    _dims(i) + struct.pack('<bf', 4, w) for i, w in frame)
+                for frame in frames))
+
+
+def random_sentences(nsentences=300, nwords=25, seed=0):
+    """Return random sentences as lists of words w0, w1, ..."""
+    rand = random.Random(seed)
+    words = ['w{}'.format(i) for i in range(nwords)]
+    return [[rand.choice(words[:rand.randint(2, nwords)])
+             for _ in range(rand.randint(0, 10))]
+            for _ in range(nsentences)]
+
+
 # utterances from Buckeye composing the TRAIN corpus for the tests
 buckeye_utterances = [
     's0101b-sent23',
@@ -14,11 +14,14 @@
 # along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
 """Test of the abkhazia.align module"""
 
+import gzip
 import os
+
 import pytest
 import abkhazia.align as align
+from abkhazia.align.align import read_alignment
 from abkhazia import utils
-from .conftest import assert_no_expr_in_log
+from .conftest import assert_no_expr_in_log, posterior_ark
 
 
 # params = [(l, p) for l in ('phones', 'words', 'both') for p in (True, False)]
@@ -44,3 +47,64 @@ def test_align(
     assert_no_expr_in_log(flog, 'error')
     assert os.path.isfile(
         os.path.join(output_dir, 'alignment.txt'))
+
+
+def test_export_words(tmpdir, wav_corpus):
+    corpus = wav_corpus
+    corpus.text['s2-u1'] = u'hello <unk>'
+
+    phones = {
+        # match the lexicon
+        's1-u1': 'SIL h e l o SIL w o r l d',
+        # an inserted phone, need DTW
+        's1-u2': 'e t t e SIL',
+        # a word made of silence only, need DTW
+        's2-u1': 'h e l o SPN'}
+    lines = ['{} {} {} {}'.format(utt, t, t + 1, phone)
+             for utt, seq in sorted(phones.items())
+             for t, phone in enumerate(seq.split())]
+
+    aligner = align.Align(corpus, output_dir=str(tmpdir.join('align')))
+    aligned = list(aligner._export_phones_and_words(lines))
+
+    assert [l.split()[:4] for l in aligned] == [l.split() for l in lines]
+    assert [(l.split()[0], l.split()[4]) for l in aligned
+            if len(l.split()) == 5] == [
+                ('s1-u1', 'hello'), ('s1-u1', 'world'),
+                ('s1-u2', u'\xe9t\xe9'),
+                ('s2-u1', 'hello'), ('s2-u1', '<unk>')]
+
+
+def test_read_alignment(tmpdir):
+    ali = str(tmpdir.join('ali.1.gz'))
+    with gzip.open(ali, 'w') as fout:
+        fout.write('u1 1 2 ; 2 3\nu2 2 1\n')
+    post = str(tmpdir.join('phone_post.1.ark'))
+    posteriors = [
+        ('u1', [[(1, 0.5), (2, 0.5)], [(1, 1.0)], [(2, 0.2), (1, 0.8)],
+                [(2, 0.4), (1, 0.6)], [(2, 0.6), (1, 0.4)]]),
+        ('u2', [[(2, 1.0)]])]
+    posterior_ark(post, posteriors)
+
+    phonemap = [None, 'a', 'b']
+    assert list(read_alignment(ali, None, phonemap)) == [
+        'u1 0.0 0.0275 a', 'u1 0.0275 0.065 b', 'u2 0.0 0.025 b']
+
+    aligned = [l.split() for l in read_alignment(ali, post, phonemap)]
+    assert [float(l[3]) for l in aligned] == pytest.approx([0.75, 0.4, 1])
+
+    # a phone missing on a frame has a null posterior
+    posterior_ark(post, [('u1', [[(2, 1.0)]] + posteriors[0][1][1:]),
+                          posteriors[1]])
+    aligned = [l.split() for l in read_alignment(ali, post, phonemap)]
+    assert [float(l[3]) for l in aligned] == pytest.approx([0.5, 0.4, 1])
+
+    # posteriors in another order
+    posterior_ark(post, posteriors[::-1])
+    with pytest.raises(IOError):
+        list(read_alignment(ali, post, phonemap))
+
+    # posteriors missing for the last utterance
+    posterior_ark(post, posteriors[:1])
+    with pytest.raises(IOError):
+        list(read_alignment(ali, post, phonemap))
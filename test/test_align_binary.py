@@ -0,0 +1,137 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the abkhazia.align.binary module"""
+
+import os
+
+import numpy as np
+import pytest
+
+import abkhazia.align.binary as binary
+from abkhazia.align.align import Align, utterances_posterior_scoring
+from abkhazia.utils import open_utf8
+from abkhazia.utils.abkhazia2abx import alignment2item
+
+
+LINES = [
+    u'u1 0.0 0.0275 0.75 a hello',
+    u'u1 0.0275 0.065 0.4 b',
+    u'u1 0.065 0.1 0.5 SIL',
+    u'u2 0.0 0.025 1.0 b w\xe9',
+    u'u3 0.0 0.5 0.25 a hello']
+
+
+def _write(path, lines):
+    with open_utf8(path, 'w') as fout:
+        fout.write(u''.join(line + u'\n' for line in lines))
+
+
+@pytest.mark.parametrize('level, post', [
+    (l, p) for l in ('phones', 'words', 'both') for p in (True, False)])
+def test_text2binary(tmpdir, level, post):
+    lines = [l.split() for l in LINES]
+    if not post:
+        lines = [l[:3] + l[4:] for l in lines]
+    if level == 'phones':
+        lines = [l[:-1] if len(l) == (6 if post else 5) else l
+                 for l in lines]
+    elif level == 'words':
+        lines = [l[:-2] + l[-1:] for l in lines
+                 if len(l) == (6 if post else 5)]
+    lines = [u' '.join(l) for l in lines]
+
+    text = str(tmpdir.join('alignment.txt'))
+    h5 = str(tmpdir.join('alignment.h5'))
+    _write(text, lines)
+    binary.text2binary(text, h5, level=level, with_posteriors=post)
+    assert binary.is_binary(h5)
+    assert not binary.is_binary(text)
+
+    binary.binary2text(h5, text)
+    assert open_utf8(text, 'r').read().splitlines() == lines
+
+
+def test_reader(tmpdir):
+    h5 = str(tmpdir.join('alignment.h5'))
+    binary.write_binary(
+        LINES, h5, with_posteriors=True, chunk_size=2,
+        utt2spk={'u1': 's1', 'u2': 's2', 'u3': 's1'})
+
+    with binary.BinaryAlignment(h5, chunk_size=3) as alignment:
+        assert len(alignment) == 3
+        assert alignment.utterances == ['u1', 'u2', 'u3']
+        assert alignment.phones == ['a', 'b', 'SIL']
+        assert alignment.words == ['hello', u'w\xe9']
+        assert 'u2' in alignment and 'u4' not in alignment
+
+        rows = alignment['u1']
+        assert rows.dtype.names == (
+            'tstart', 'tstop', 'posterior', 'phone', 'word')
+        assert rows.tstop.dtype == np.float32
+        assert np.allclose(rows.tstop, [0.0275, 0.065, 0.1])
+        assert rows.phone.tolist() == [0, 1, 2]
+        assert rows.word.tolist() == [0, -1, -1]
+
+        assert [(u, len(r)) for u, r in alignment] == [
+            ('u1', 3), ('u2', 1), ('u3', 1)]
+        assert [u for u, _ in alignment.speaker('s1')] == ['u1', 'u3']
+        assert list(alignment.speaker('s3')) == []
+
+        utts, rows = alignment.phone('a')
+        assert utts == ['u1', 'u3']
+        assert np.allclose(rows.posterior, [0.75, 0.25])
+        assert alignment.phone('c')[0] == []
+
+    # no speakers, bad formats
+    binary.write_binary(LINES[:1], h5, with_posteriors=True)
+    with binary.BinaryAlignment(h5) as alignment:
+        with pytest.raises(IOError):
+            alignment.speaker('s1')
+    with pytest.raises(IOError):
+        binary.write_binary(LINES, h5)
+    with pytest.raises(IOError):
+        binary.write_binary(LINES + LINES[:1], h5, with_posteriors=True)
+
+
+def test_consumers(tmpdir, wav_corpus):
+    text = str(tmpdir.join('alignment.txt'))
+    h5 = str(tmpdir.join('alignment.h5'))
+    _write(text, LINES)
+    binary.text2binary(text, h5, with_posteriors=True)
+
+    scores = list(utterances_posterior_scoring(text))
+    assert list(utterances_posterior_scoring(h5)) == [
+        (u, pytest.approx(s)) for u, s in scores]
+
+    # word alignment, the text reader expects lines without posteriors
+    lines = [u' '.join(l.split()[:3] + l.split()[4:]) for l in LINES]
+    binary.write_binary(lines, h5)
+    assert list(Align._read_words(h5)) == list(Align._read_words(lines))
+
+    # ABX items from text and binary phone alignments
+    corpus = wav_corpus
+    lines = [u'{} {} {} {}'.format(utt, float(t), t + 0.5, phone)
+             for utt in sorted(corpus.utts())
+             for t, phone in enumerate(('a', 'b', 'a', 'SIL'))]
+    _write(text, lines)
+    binary.text2binary(text, h5, level='phones')
+
+    items = []
+    for alignment in (text, h5):
+        item = str(tmpdir.join('item'))
+        alignment2item(corpus, alignment, item, ali_with_phone_proba=False)
+        items.append(open_utf8(item, 'r').read())
+    assert items[0] == items[1]
+    assert len(items[0].splitlines()) == 1 + len(lines)
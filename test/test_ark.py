@@ -15,12 +15,14 @@
 """Test of the abkhazia.kaldi.io module"""
 
 import os
+import struct
 
 import h5features as h5f
 import numpy as np
 import pytest
 
 import abkhazia.kaldi.ark as io
+from .conftest import posterior_ark
 
 
 @pytest.fixture(scope='session')
@@ -81,3 +83,233 @@ def test_h5f_twice(tmpdir, data):
     # test writing in an existing group
     with pytest.raises(AssertionError):
         io.ark_to_h5f([ark], h5file, 'test')
+
+
+def _binary_ark(arkfile, data):
+    """Write `data`, a list of (utt, token, header, bytes), as binary ark"""
+    with open(arkfile, 'wb') as fout:
+        for utt, token, header, values in data:
+            fout.write(utt + ' \0B' + token + ' ' + header + values)
+
+
+def _dims(*dims):
+    return ''.join(struct.pack('<bi', 4, d) for d in dims)
+
+
+def test_read_binary(tmpdir):
+    ark = os.path.join(str(tmpdir), 'ark')
+    fm = np.random.random_sample((10, 3)).astype(np.float32)
+    dm = np.random.random_sample((2, 4))
+    fv = np.arange(5, dtype=np.float32)
+    dv = np.zeros((0,))
+    _binary_ark(ark, [
+        ('fm', 'FM', _dims(10, 3), fm.tobytes()),
+        ('dm', 'DM', _dims(2, 4), dm.tobytes()),
+        ('fv', 'FV', _dims(5), fv.tobytes()),
+        ('dv', 'DV', _dims(0), dv.tobytes())])
+
+    data = list(io.read_ark(ark))
+    assert [d[0] for d in data] == ['fm', 'dm', 'fv', 'dv']
+    for expected, (_, array) in zip([fm, dm, fv, dv], data):
+        assert array.dtype == expected.dtype
+        assert np.array_equal(array, expected)
+
+    assert sorted(io.ark_to_dict(ark).keys()) == ['dm', 'dv', 'fm', 'fv']
+
+
+def test_read_compressed(tmpdir):
+    ark = os.path.join(str(tmpdir), 'ark')
+    values = np.random.randint(0, 256, size=(6, 4)).astype(np.uint8)
+
+    # the values are decompressed in the range [0, 255] with
+    # percentiles chosen so that the decompression is the identity
+    _binary_ark(ark, [
+        ('cm2', 'CM2', struct.pack('<ffii', 0, 65535, 6, 4),
+         values.astype('<u2').tobytes()),
+        ('cm3', 'CM3', struct.pack('<ffii', 0, 255, 6, 4), values.tobytes()),
+        ('cm', 'CM', struct.pack('<ffii', 0, 65535, 6, 4),
+         struct.pack('<HHHH', 0, 64, 192, 255) * 4 + values.T.tobytes())])
+
+    data = io.ark_to_dict(ark)
+    for utt in ('cm', 'cm2', 'cm3'):
+        assert data[utt].dtype == np.float32
+        assert np.allclose(data[utt], values, atol=1e-3)
+
+
+def test_read_bad_binary(tmpdir):
+    ark = os.path.join(str(tmpdir), 'ark')
+    _binary_ark(ark, [('a', 'FM', _dims(1, 1), '\0' * 4),
+                      ('b', 'BAD', '', '')])
+    with pytest.raises(IOError) as err:
+        io.ark_to_dict(ark)
+    assert 'unsupported data type BAD' in str(err)
+
+
+def test_read_posteriors(tmpdir):
+    ark = os.path.join(str(tmpdir), 'ark')
+    posterior_ark(ark, [
+        ('a', [[(1, 0.5), (3, 0.5)], [], [(2, 1.0)]]),
+        ('b', []),
+        ('c', [[(7, 0.25)]])])
+
+    data = list(io.read_posteriors(ark))
+    assert [d[0] for d in data] == ['a', 'b', 'c']
+
+    frames, ids, weights = data[0][1]
+    assert frames.tolist() == [0, 0, 2]
+    assert ids.tolist() == [1, 3, 2]
+    assert weights.tolist() == [0.5, 0.5, 1.0]
+    assert [len(a) for a in data[1][1]] == [0, 0, 0]
+    assert [a.tolist() for a in data[2][1]] == [[0], [7], [0.25]]
+
+    # truncated or text arks
+    open(ark, 'ab').write('d \0B' + _dims(2, 1))
+    with pytest.raises(IOError):
+        list(io.read_posteriors(ark))
+    open(ark, 'w').write('a [ 1 2 ]\n')
+    with pytest.raises(IOError):
+        list(io.read_posteriors(ark))
+
+
+def _scp(scpfile, arkfile):
+    """Write a scp indexing all the utterances in `arkfile`"""
+    content = open(arkfile, 'rb').read()
+    offset, lines = 0, []
+    for utt in [utt for utt, _ in io.read_ark(arkfile)]:
+        offset = content.index(utt + ' ', offset) + len(utt) + 1
+        lines.append('{} {}:{}\n'.format(utt, arkfile, offset))
+    open(scpfile, 'w').write(''.join(lines))
+
+
+@pytest.mark.parametrize('format', ['text', 'binary'])
+def test_scp_reader(tmpdir, format, data):
+    ark = os.path.join(str(tmpdir), 'ark')
+    scp = os.path.join(str(tmpdir), 'scp')
+    if format == 'text':
+        io.dict_to_ark(ark, data)
+    else:
+        _binary_ark(ark, [
+            (k, 'DM', _dims(*v.shape), v.tobytes())
+            for k, v in sorted(data.items())])
+    _scp(scp, ark)
+
+    with io.ScpReader(scp) as reader:
+        assert len(reader) == 2
+        assert 'test2' in reader and 'test3' not in reader
+        assert reader.utts() == ['test', 'test2']
+        assert reader.arks() == [ark]
+        assert np.allclose(reader['test2'], data['test2'])
+        assert [u for u, _ in reader] == ['test', 'test2']
+        assert [u for u, _ in reader.read(['test2'])] == ['test2']
+        for utt, array in reader.read(['test2', 'test']):
+            assert np.allclose(array, data[utt])
+
+        with pytest.raises(KeyError):
+            reader['test3']
+
+
+def test_scp_reader_bad(tmpdir):
+    scp = os.path.join(str(tmpdir), 'scp')
+    open(scp, 'w').write('utt1 ark:12\nutt2 ark\n')
+    with pytest.raises(IOError) as err:
+        io.ScpReader(scp)
+    assert 'Bad scp file line 2' in str(err)
+
+
+@pytest.mark.parametrize('format', ['text', 'binary'])
+def test_write_scp(tmpdir, format, data):
+    ark = os.path.join(str(tmpdir), 'ark')
+    scp = os.path.join(str(tmpdir), 'scp')
+    data = dict(data, test3=data['test'].astype(np.float32))
+    io.dict_to_ark(ark, data, format=format, scp=scp)
+
+    assert [line.split()[0] for line in open(scp, 'r')] == [
+        'test', 'test2', 'test3']
+    with io.ScpReader(scp) as reader:
+        for utt, array in reader:
+            assert np.allclose(array, data[utt], rtol=0, atol=1e-7)
+            if format == 'binary':
+                assert array.dtype == data[utt].dtype
+
+
+def test_write_binary_vector(tmpdir):
+    ark = os.path.join(str(tmpdir), 'ark')
+    data = {'a': np.arange(3, dtype=np.float32), 'b': np.arange(4.)}
+    io.dict_to_ark(ark, data, format='binary')
+    data2 = io.ark_to_dict(ark)
+    for k in data:
+        assert data2[k].dtype == data[k].dtype
+        assert np.array_equal(data2[k], data[k])
+
+
+def test_write_text_exact(tmpdir):
+    ark = os.path.join(str(tmpdir), 'ark')
+    data = {'f64': np.random.random_sample((10, 3)) / 3,
+            'f32': np.random.random_sample((7,)).astype(np.float32),
+            'vec': np.zeros((0,)),
+            'mat': np.zeros((0, 3)),
+            'mat2': np.zeros((2, 0))}
+    io.dict_to_ark(ark, data, format='text')
+    data2 = io.ark_to_dict(ark)
+
+    # the values are read back exactly
+    assert np.array_equal(data2['f64'], data['f64'])
+    assert np.array_equal(data2['f32'].astype(np.float32), data['f32'])
+
+    # empty matrices are still matrices but their dimensions are lost
+    assert data2['vec'].shape == (0,)
+    assert data2['mat'].shape == (0, 0)
+    assert data2['mat2'].shape == (0, 0)
+
+
+@pytest.mark.parametrize('njobs, chunk_size', [(1, 1), (1, 1000), (3, 2)])
+def test_h5f_chunks(tmpdir, njobs, chunk_size):
+    arks = []
+    for n in range(5):
+        arks.append(os.path.join(str(tmpdir), 'ark{}'.format(n)))
+        io.dict_to_ark(arks[-1], {
+            'utt{}_{}'.format(n, i): np.random.random_sample((10 + i, 3))
+            for i in range(3)}, format='binary')
+
+    h5file = os.path.join(str(tmpdir), 'h5f')
+    io.ark_to_h5f(arks, h5file, chunk_size=chunk_size, njobs=njobs)
+
+    data = h5f.Reader(h5file).read()
+    assert data.items() == [
+        'utt{}_{}'.format(n, i) for n in range(5) for i in range(3)]
+    for ark in arks:
+        for utt, array in io.read_ark(ark):
+            assert np.array_equal(data.dict_features()[utt], array)
+
+
+def test_h5f_bad_ark(tmpdir, data):
+    ark = os.path.join(str(tmpdir), 'ark')
+    io.dict_to_ark(ark, data, format='binary')
+    bad = os.path.join(str(tmpdir), 'bad')
+    open(bad, 'wb').write('utt \0BXM ')
+
+    with pytest.raises(IOError):
+        io.ark_to_h5f([ark, bad, ark], os.path.join(str(tmpdir), 'h5f'),
+                      njobs=2)
+
+
+def test_read_text(tmpdir):
+    ark = os.path.join(str(tmpdir), 'ark')
+    open(ark, 'w').write(
+        'mat  [\n  1 2 3 \n  4 5 6 ]\n'
+        'mat2 [\n  1e-3 -2\n  3 4.5\n]\n\n'
+        'row  [\n  1 2 3]\n'
+        'vec  [ 1 2.5 3 ]\n'
+        'empty  [ ]\n')
+
+    data = list(io.read_ark(ark))
+    assert [d[0] for d in data] == ['mat', 'mat2', 'row', 'vec', 'empty']
+    assert np.array_equal(data[0][1], [[1, 2, 3], [4, 5, 6]])
+    assert np.array_equal(data[1][1], [[1e-3, -2], [3, 4.5]])
+    assert np.array_equal(data[2][1], [[1, 2, 3]])
+    assert np.array_equal(data[3][1], [1, 2.5, 3])
+    assert data[4][1].shape == (0,)
+
+    open(ark, 'w').write('mat  [\n  1 2 3 \n  4 a 6 ]\n')
+    with pytest.raises(ValueError):
+        io.ark_to_dict(ark)
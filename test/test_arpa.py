@@ -0,0 +1,133 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the abkhazia.language.arpa module"""
+
+import pytest
+
+from abkhazia.language import kneser_ney
+from abkhazia.language.arpa import ARPALanguageModel
+from .conftest import random_sentences
+
+
+ARPA = '''
+\\data\\
+ngram 1=5
+ngram 2=4
+
+\\1-grams:
+-1.000000\t</s>
+-99.000000\t<s>\t-0.300000
+-0.500000\ta\t-0.200000
+-0.700000\tb\t-0.100000
+-1.200000\tc
+
+\\2-grams:
+-0.100000\t<s> a
+-0.400000\ta b
+-0.200000\tb </s>
+-0.600000\tc </s>
+
+\\end\\
+'''
+
+
+@pytest.fixture
+def arpa(tmpdir):
+    path = str(tmpdir.join('lm.arpa'))
+    open(path, 'w').write(ARPA)
+    return path
+
+
+def test_load_save(arpa, tmpdir):
+    lm = ARPALanguageModel.load(arpa)
+    assert lm.order == 2
+    assert lm.words == ['</s>', '<s>', 'a', 'b', 'c']
+    assert [lm.size(n) for n in (1, 2)] == [5, 4]
+
+    for name in ('lm2.arpa', 'lm2.arpa.gz'):
+        path = str(tmpdir.join(name))
+        lm.save(path)
+        lm2 = ARPALanguageModel.load(path)
+        assert lm2.words == lm.words
+        for n in (0, 1):
+            assert (lm2.grams[n] == lm.grams[n]).all()
+            assert (lm2.probs[n] == lm.probs[n]).all()
+    assert open(str(tmpdir.join('lm2.arpa'))).read() == ARPA
+
+
+def test_bad_header(tmpdir):
+    path = str(tmpdir.join('lm.arpa'))
+    open(path, 'w').write(ARPA.replace('ngram 2=4', 'ngram 2=5'))
+    with pytest.raises(IOError):
+        ARPALanguageModel.load(path)
+
+
+def test_prune(arpa):
+    lm = ARPALanguageModel.load(arpa)
+    lm.prune_vocabulary(['<s>', '</s>', 'a', 'c'])
+    assert lm.size(1) == 4 and lm.size(2) == 2
+    assert lm.logprob('b') is None
+    assert lm.logprob('</s>', ['c']) == pytest.approx(-0.6)
+
+    lm = ARPALanguageModel.load(arpa)
+    lm.prune_sequences([('a', 'b'), ('</s>', '<s>')])
+    assert lm.size(1) == 5 and lm.size(2) == 3
+
+
+def test_score(arpa):
+    lm = ARPALanguageModel.load(arpa)
+    assert lm.logprob('a', ['<s>']) == pytest.approx(-0.1)
+    # backoff through the weight of 'a'
+    assert lm.logprob('c', ['a']) == pytest.approx(-0.2 - 1.2)
+    # no backoff weight for 'c'
+    assert lm.logprob('a', ['c']) == pytest.approx(-0.5)
+    assert lm.logprob('x', ['a']) is None
+
+    assert lm.score('a b') == pytest.approx(-0.1 - 0.4 - 0.2)
+    assert lm.score(['c']) == pytest.approx(-0.3 - 1.2 - 0.6)
+    # unknown words are ignored and reset the history
+    assert lm.score('a x b') == pytest.approx(-0.1 - 0.7 - 0.2)
+
+    text = {'u1': 'a b', 'u2': 'c x'}
+    logprob = -0.1 - 0.4 - 0.2 - 0.3 - 1.2 - 1.0
+    assert lm.perplexity(text) == pytest.approx(10 ** (-logprob / 5))
+    assert lm.perplexity(text.values()) == lm.perplexity(text)
+
+
+def test_renormalize(tmpdir):
+    arpa = str(tmpdir.join('lm.arpa'))
+    kneser_ney.estimate_arpa(random_sentences(), arpa, 3)
+
+    lm = ARPALanguageModel.load(arpa)
+    lm.prune_vocabulary(
+        ['<s>', '</s>', '<unk>'] + ['w{}'.format(i) for i in range(15)])
+    assert len(lm.words) == 18
+    size = lm.size(3)
+
+    def _normalized():
+        vocab = [w for w in lm.words if w != '<s>']
+        for n in (1, 2):
+            for history in lm.grams[n - 1].tolist():
+                history = [lm.words[w] for w in history]
+                if history[-1] != '</s>':
+                    assert sum(10 ** lm.logprob(w, history)
+                               for w in vocab) == pytest.approx(1, abs=1e-4)
+
+    lm.renormalize()
+    _normalized()
+
+    lm.prune_low_probs()
+    assert lm.size(3) < size
+    _normalized()
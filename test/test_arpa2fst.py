@@ -0,0 +1,93 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the abkhazia.language.arpa2fst module"""
+
+import collections
+import math
+
+import pytest
+
+from abkhazia.language import arpa2fst, kneser_ney
+from abkhazia.language.arpa import ARPALanguageModel
+from .conftest import random_sentences
+
+
+def _load_fst(fst_txt):
+    """Return (start, arcs, finals) from a FST in text format"""
+    arcs = collections.defaultdict(dict)
+    finals = {}
+    start = None
+    for line in open(fst_txt, 'r'):
+        line = line.split()
+        if start is None:
+            start = int(line[0])
+        if len(line) == 5:
+            assert int(line[2]) not in arcs[int(line[0])]
+            arcs[int(line[0])][int(line[2])] = (int(line[1]), float(line[4]))
+        else:
+            finals[int(line[0])] = float(line[1]) if len(line) == 2 else 0
+    return start, arcs, finals
+
+
+def _cost(fst, symbols, sentence):
+    """Return the cost of `sentence` in `fst`, following backoff arcs"""
+    start, arcs, finals = fst
+    state, cost = start, 0
+    for label in [symbols[w] for w in sentence] + [None]:
+        while label not in arcs[state] if label else state not in finals:
+            state, weight = arcs[state][symbols['#0']]
+            cost += weight
+        if label:
+            state, weight = arcs[state][label]
+            cost += weight
+    return cost + finals[state]
+
+
+@pytest.mark.parametrize('order', [1, 2, 3])
+def test_arpa2fst(order, tmpdir):
+    sentences = random_sentences()
+    arpa = str(tmpdir.join('lm.arpa'))
+    kneser_ney.estimate_arpa(sentences, arpa, order)
+
+    words = ['<eps>', '<unk>'] + ['w{}'.format(i) for i in range(20)] + [
+        '#0', '<s>', '</s>']
+    words_txt = str(tmpdir.join('words.txt'))
+    with open(words_txt, 'w') as fout:
+        fout.write(''.join(
+            '{} {}\n'.format(w, i) for i, w in enumerate(words)))
+    symbols = arpa2fst.read_symbols(words_txt)
+
+    lm = ARPALanguageModel.load(arpa)
+    lm.prune_vocabulary(symbols)
+    lm.renormalize()
+    lm.prune_low_probs()
+
+    fst_txt = str(tmpdir.join('G.txt'))
+    arpa2fst.arpa2fst(lm, symbols, fst_txt)
+    fst = _load_fst(fst_txt)
+
+    for sentence in sentences[:50]:
+        if all(w in symbols for w in sentence):
+            assert _cost(fst, symbols, sentence) == pytest.approx(
+                -lm.score(sentence) * math.log(10), rel=1e-4)
+
+
+def test_missing_symbol(tmpdir):
+    lm = ARPALanguageModel(
+        ['</s>', '<s>', 'a'], [[[0], [1], [2]]], [[-0.3, -99, -0.3]], [None])
+    with pytest.raises(IOError):
+        arpa2fst.arpa2fst(lm, {'a': 1}, str(tmpdir.join('G.txt')))
+    with pytest.raises(IOError):
+        arpa2fst.arpa2fst(lm, {'#0': 1}, str(tmpdir.join('G.txt')))
@@ -0,0 +1,126 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the abkhazia.utils.cache module"""
+
+import os
+import stat
+import time
+
+from abkhazia.utils.cache import StageCache
+
+
+def _directory(path, files):
+    """Create the directory `path` with `files` as a dict name -> data"""
+    for name, data in files.iteritems():
+        filename = os.path.join(path, name)
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, 'w') as fout:
+            fout.write(data)
+    return path
+
+
+def test_key(tmpdir):
+    first = _directory(str(tmpdir.join('first')), {'a': '1', 'b/c': '2'})
+    second = _directory(str(tmpdir.join('second')), {'a': '1', 'b/c': '2'})
+
+    # options order and input location do not matter
+    assert (StageCache.key('stage', {'x': 1, 'y': [1, 2]}, first) ==
+            StageCache.key('stage', {'y': [1, 2], 'x': 1}, second))
+    assert StageCache.key('stage', 1) != StageCache.key('stage', 2)
+    assert StageCache.key('stage', 1) != StageCache.key('other', 1)
+
+    # logs are ignored, contents are not
+    _directory(second, {'x.log': 'log'})
+    assert StageCache.key(first) == StageCache.key(second)
+    _directory(second, {'b/c': '3'})
+    assert StageCache.key(first) != StageCache.key(second)
+
+
+def test_memoized_key(tmpdir):
+    cache = StageCache(str(tmpdir.join('cache')))
+    source = _directory(str(tmpdir.join('source')), {'a': '1', 'b/c': '2'})
+    filename = os.path.join(source, 'b', 'c')
+    mtime = 1000000000
+    os.utime(filename, (mtime, mtime))
+
+    key = cache.memoized_key('stage', source)
+    assert key == StageCache.key('stage', source)
+    assert os.path.isfile(os.path.join(cache.directory, cache.hashes))
+
+    # a file is not read again if its size and mtime are unchanged
+    _directory(source, {'b/c': '3'})
+    os.utime(filename, (mtime, mtime))
+    assert cache.memoized_key('stage', source) == key
+
+    # but is read again once modified
+    os.utime(filename, (mtime + 10, mtime + 10))
+    assert cache.memoized_key('stage', source) != key
+    assert (cache.memoized_key('stage', source) ==
+            StageCache.key('stage', source))
+
+    # the memo does not count as a cache entry
+    assert cache.entries() == []
+
+
+def test_get_put(tmpdir):
+    cache = StageCache(str(tmpdir.join('cache')))
+    source = _directory(
+        str(tmpdir.join('source')),
+        {'a': 'data', 'b/c': 'more data', 'x.log': 'log', 'recipe/d': ''})
+
+    target = str(tmpdir.join('target'))
+    assert not cache.get('0123', target)
+    assert not os.path.exists(target)
+
+    cache.put('0123', source, exclude=StageCache.ignored)
+    assert cache.get('0123', target)
+    assert sorted(os.listdir(target)) == ['a', 'b']
+    assert open(os.path.join(target, 'b', 'c')).read() == 'more data'
+
+    # the cached files are read-only
+    assert not os.stat(os.path.join(target, 'a')).st_mode & stat.S_IWUSR
+
+    cache.remove('0123')
+    assert cache.entries() == []
+
+
+def test_relocate(tmpdir):
+    cache = StageCache(str(tmpdir.join('cache')))
+    source = str(tmpdir.join('source'))
+    _directory(source, {'feats.scp': 'utt {}/feats.ark:4\n'.format(source),
+                        'feats.ark': 'data'})
+    cache.put('0123', source)
+
+    target = str(tmpdir.join('target'))
+    assert cache.get('0123', target)
+    assert open(os.path.join(target, 'feats.scp')).read() == (
+        'utt {}/feats.ark:4\n'.format(target))
+
+
+def test_evict(tmpdir):
+    cache = StageCache(str(tmpdir.join('cache')), max_size=25)
+    for key in ('aa', 'bb', 'cc'):
+        cache.put(key, _directory(
+            str(tmpdir.join(key)), {'data': 10 * key[0]}))
+        time.sleep(0.01)
+    assert sorted(k for k, _, _ in cache.entries()) == ['bb', 'cc']
+
+    # bb is now the most recently used
+    time.sleep(0.01)
+    assert cache.get('bb', str(tmpdir.join('target')))
+    cache.put('dd', _directory(str(tmpdir.join('dd')), {'data': 'd' * 10}))
+    assert sorted(k for k, _, _ in cache.entries()) == ['bb', 'dd']
+    assert cache.size() == 20
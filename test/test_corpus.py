@@ -16,9 +16,13 @@
 
 import os
 from abkhazia.corpus import Corpus
+from abkhazia.utils.wav import WavIndex
+from abkhazia.corpus.corpus_validation import CorpusValidation
 
 import pytest
 
+from .conftest import synthetic_corpus, write_wav
+
 
 @pytest.mark.parametrize('copy_wavs', [True, False])
 def test_save_corpus(tmpdir, corpus, copy_wavs):
@@ -152,3 +156,214 @@ def test_remove_phones(corpus):
     # make sure the phone is not here
     assert p not in corpus.phones
     assert not _aux(p, corpus.lexicon)
+
+
+def test_binary_cache(tmpdir):
+    wavs = str(tmpdir.mkdir('wavs'))
+    corpus_dir = os.path.join(str(tmpdir), 'corpus')
+    synthetic_corpus(wavs).save(corpus_dir, copy_wavs=False)
+    assert os.path.isfile(os.path.join(corpus_dir, 'cache', 'index.txt'))
+
+    from_text = Corpus.load(corpus_dir, use_cache=False)
+    from_cache = Corpus.load(corpus_dir)
+    for attr in ('lexicon', 'segments', 'wavs', 'text',
+                 'phones', 'utt2spk', 'silences', 'variants'):
+        assert getattr(from_text, attr) == getattr(from_cache, attr)
+
+
+def test_binary_cache_outdated(tmpdir):
+    wavs = str(tmpdir.mkdir('wavs'))
+    corpus_dir = os.path.join(str(tmpdir), 'corpus')
+    synthetic_corpus(wavs).save(corpus_dir, copy_wavs=False)
+
+    # a text file modified after the cache makes it outdated
+    text = os.path.join(corpus_dir, 'text.txt')
+    with open(text, 'a') as fout:
+        fout.write('s2-u2 hello\n')
+    index = os.path.join(corpus_dir, 'cache', 'index.txt')
+    os.utime(text, (os.path.getmtime(index) + 1,) * 2)
+
+    assert 's2-u2' in Corpus.load(corpus_dir).text
+
+    # even when modified within the mtime granularity of the
+    # filesystem, here with the same mtime as the cache
+    corpus_dir = os.path.join(str(tmpdir), 'corpus2')
+    synthetic_corpus(wavs).save(corpus_dir, copy_wavs=False)
+    text = os.path.join(corpus_dir, 'text.txt')
+    mtime = os.path.getmtime(os.path.join(corpus_dir, 'cache', 'index.txt'))
+    for line in ('s2-u3 hello\n', 's2-u4 hello\n'):
+        with open(text, 'a') as fout:
+            fout.write(line)
+        os.utime(text, (mtime, mtime))
+        assert line.split()[0] in Corpus.load(corpus_dir).text
+
+
+def test_fingerprint(tmpdir):
+    wavs = str(tmpdir.mkdir('wavs'))
+    corpus_dir = os.path.join(str(tmpdir), 'corpus')
+    synthetic_corpus(wavs).save(corpus_dir, copy_wavs=False)
+
+    # the same contents loaded from text or cache, at any location
+    c = Corpus.load(corpus_dir, use_cache=False)
+    fingerprint = c.fingerprint()
+    assert Corpus.load(corpus_dir).fingerprint() == fingerprint
+
+    copy_dir = os.path.join(str(tmpdir), 'copy')
+    c.save(copy_dir, copy_wavs=False)
+    assert Corpus.load(copy_dir).fingerprint() == fingerprint
+
+    c.text['s1-u1'] = 'hello'
+    assert c.fingerprint() != fingerprint
+
+    # the fingerprint is computed again only when the data changes
+    computed = []
+    compute = c._fingerprint
+    c._fingerprint = lambda: computed.append(1) or compute()
+    c.fingerprint()
+    assert computed == []
+    for change in (lambda: c.lexicon.pop('<unk>'),
+                   lambda: c.silences.append('NSN'),
+                   lambda: c.wavs.add('s3.wav')):
+        change()
+        c.fingerprint()
+        c.fingerprint()
+    assert len(computed) == 3
+
+
+def test_wav_index(tmpdir, wav_corpus):
+    wavs = wav_corpus.wav_folder
+    corpus_dir = os.path.join(str(tmpdir), 'corpus')
+    wav_corpus.save(corpus_dir, copy_wavs=False)
+
+    c = Corpus.load(corpus_dir)
+    assert c.utt2duration()['s2-u1'] == 1.0
+    index = os.path.join(corpus_dir, 'cache', 'wavs_index.txt')
+    assert os.path.isfile(index)
+    assert len(open(index, 'r').readlines()) == 1
+
+    # all the wavs are indexed, a modified wav is scanned again
+    assert c.wav_metadata()['s1.wav'].duration == 2.5
+    write_wav(os.path.join(wavs, 's2.wav'), 32000)
+    os.utime(os.path.join(wavs, 's2.wav'), (0, 0))
+    assert Corpus.load(corpus_dir).utt2duration()['s2-u1'] == 2.0
+    assert len(open(index, 'r').readlines()) == 2
+
+    # no wavs saved, no wav index
+    corpus_dir = os.path.join(str(tmpdir), 'corpus2')
+    c.save(corpus_dir, no_wavs=True)
+    assert not os.path.exists(os.path.join(corpus_dir, 'wavs'))
+    assert not os.path.exists(
+        os.path.join(corpus_dir, 'cache', 'wavs_index.txt'))
+
+
+def test_wav_index_file(tmpdir, wav_corpus):
+    wavs = wav_corpus.wav_folder
+    index_file = os.path.join(str(tmpdir), 'index.txt')
+
+    # durations are saved at once by flush
+    index = WavIndex(wavs, index_file)
+    assert index.duration('s1.wav') == 2.5
+    assert index.duration('s2.wav') == 1.0
+    assert not os.path.exists(index_file)
+    index.flush()
+    assert len(open(index_file, 'r').readlines()) == 2
+
+    # the index can be read by others
+    umask = os.umask(0)
+    os.umask(umask)
+    assert os.stat(index_file).st_mode & 0o777 == 0o666 & ~umask
+
+    # truncated or corrupted lines are ignored
+    with open(index_file, 'a') as fout:
+        fout.write('s3.wav\t44\t0.0\t1\t2\t16000\t0\tNONE\n')
+        fout.write('s4.wav\t44\t0.0\t1\t2\tbad\t0\tNONE\tnone\n')
+    assert len(WavIndex(wavs, index_file)) == 2
+
+    # no temporary file left when the index cannot be written
+    os.remove(index_file)
+    os.mkdir(index_file)
+    index.save(safe=True)
+    assert sorted(os.listdir(str(tmpdir))) == ['index.txt', 'wavs']
+
+
+def test_derived_views_cache():
+    c = synthetic_corpus('')
+    c.segments['s2-u1'] = ('s2.wav', 0, 1.0)
+
+    # repeated calls return the cached views
+    assert c.spk2utt() is c.spk2utt()
+    assert c.wav2utt() is c.wav2utt()
+    assert c.utt2duration() is c.utt2duration()
+    assert sorted(c.spks()) == ['s1', 's2']
+
+    # views are invalidated by changes in their source data
+    c.utt2spk['s3-u1'] = 's3'
+    assert sorted(c.spks()) == ['s1', 's2', 's3']
+
+    c.segments['s3-u1'] = ('s3.wav', 1.0, 3.0)
+    assert c.utt2duration()['s3-u1'] == 2.0
+    assert 's3.wav' in c.wav2utt()
+
+    c.utt2spk = {'s1-u1': 's1', 's1-u2': 's1'}
+    assert c.spks() == ['s1']
+
+    d = c.subcorpus(['s1-u1', 's1-u2'], validate=False)
+    assert d.utt2duration() == {'s1-u1': 1.5, 's1-u2': 0.623456789}
+
+
+@pytest.mark.parametrize('njobs', [1, 3])
+def test_validation(njobs, wav_corpus):
+    c = wav_corpus
+    c.segments['s2-u1'] = ('s2.wav', 0.0, 0.05)
+    validation = CorpusValidation(c, njobs=njobs)
+    meta = validation.validate()
+    assert sorted(meta.keys()) == ['s1.wav', 's2.wav']
+    assert validation._check_timestamps(meta) == (False, ['s2-u1'])
+
+    # utterances sharing a timestamp are only a warning
+    c.segments['s1-u3'] = ('s1.wav', 1.5, 2.0)
+    c.utt2spk['s1-u3'] = 's1'
+    c.text['s1-u3'] = u'hello'
+    assert validation._check_timestamps(meta) == (True, ['s2-u1'])
+    validation.validate(meta)
+
+    c.segments['s1-u3'] = ('s1.wav', 1.5, 2.6)
+    with pytest.raises(IOError) as err:
+        validation.validate(meta)
+    assert 'utterance s1-u3 is not whithin boudaries' in str(err)
+
+    c.segments['s1-u3'] = ('s1.wav', 1.5, 1.5)
+    with pytest.raises(IOError) as err:
+        validation.validate(meta)
+    assert 'utterance s1-u3 have a duration of 0' in str(err)
+
+    del c.segments['s1-u3']
+    with pytest.raises(IOError) as err:
+        validation.validate(meta)
+    assert 'segments and utt2spk are not consistent' in str(err)
+
+    c.segments['s1-u3'] = ('s1.wav', 1.5, 2.0)
+    c.utt2spk['s1-u3'] = 's2'
+    with pytest.raises(IOError) as err:
+        validation.validate(meta)
+    assert 'must be prefixed by the corresponding speaker-id' in str(err)
+
+
+def test_overlaps():
+    c = synthetic_corpus('')
+    assert c.overlaps() == {}
+
+    c.segments['s1-u3'] = ('s1.wav', 0.5, 1.0)
+    c.segments['s1-u4'] = ('s1.wav', 2.0, 3.0)
+    c.segments['s2-u2'] = ('s2.wav', 0.0, 1.0)
+    overlaps = c.overlaps()
+    assert overlaps.keys() == ['s1.wav']
+    assert [o[:2] for o in overlaps['s1.wav']] == [
+        ('s1-u1', 's1-u3'), ('s1-u2', 's1-u4')]
+    assert [o[2] for o in overlaps['s1.wav']] == pytest.approx(
+        [0.5, 0.123456789])
+
+    # a segment contained in another one, touching segments do not overlap
+    c.segments['s1-u5'] = ('s1.wav', 1.0, 1.25)
+    assert c.overlaps()['s1.wav'][:2] == [
+        ('s1-u1', 's1-u3', 0.5), ('s1-u1', 's1-u5', 0.25)]
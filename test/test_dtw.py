@@ -0,0 +1,152 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the abkhazia.utils.best_path_dtw module"""
+
+import random
+
+import numpy as np
+import pytest
+
+from abkhazia.utils import best_path_dtw
+
+
+def _matrix(alignment, list_phones, radius=None):
+    """Return the DTW matrix computed cell by cell
+
+    If `radius` is not None, the cells (i, j) out of the band |i *
+    xscale - j * yscale| <= radius are excluded, with the scale factors
+    of best_path_dtw.
+
+    """
+    n, m = len(alignment), len(list_phones)
+    longest = max(n, m) - 1.
+    dtw = np.full((n, m), np.inf)
+    dtw[0, 0] = 0
+    for i in range(1, n):
+        for j in range(1, m):
+            if radius is not None and abs(
+                    i * longest / (n - 1) - j * longest / (m - 1)) > radius:
+                continue
+            dtw[i, j] = int(alignment[i] != list_phones[j]) + min(
+                dtw[i - 1, j], dtw[i, j - 1], dtw[i - 1, j - 1])
+    return dtw
+
+
+def _cost(alignment, list_phones, path):
+    """Return the cost of a DTW `path`, raise if the path is not valid"""
+    i, j = len(alignment) - 1, len(list_phones) - 1
+    cost = 0
+    for move in path:
+        assert move in (best_path_dtw.UP, best_path_dtw.LEFT,
+                        best_path_dtw.DIAG)
+        cost += int(alignment[i] != list_phones[j])
+        i -= move != best_path_dtw.LEFT
+        j -= move != best_path_dtw.UP
+    # the first row and column are excluded but the cell (0, 0)
+    assert (i, j) == (0, 0)
+    return cost
+
+
+def _reference(alignment, list_phones):
+    """Return the best DTW path computed cell by cell"""
+    dtw = _matrix(alignment, list_phones)
+    i, j = len(alignment) - 1, len(list_phones) - 1
+    path = []
+    while i != 0 and j != 0:
+        options = [dtw[i - 1, j], dtw[i, j - 1], dtw[i - 1, j - 1]]
+        move = options.index(min(options))
+        path.append(move)
+        i -= move != best_path_dtw.LEFT
+        j -= move != best_path_dtw.UP
+    return path
+
+
+def _utterance(rand, nphones=None, nsymbols=5):
+    """Return random arguments for best_path_dtw.dtw"""
+    phones = ['p{}'.format(i) for i in range(nsymbols)]
+    list_phones = [rand.choice(phones)
+                   for _ in range(nphones or rand.randint(1, 30))]
+    word_pos = ['w{}'.format(i // 3) for i in range(len(list_phones))]
+
+    # the aligned phones are the lexicon ones with errors
+    alignment = []
+    for phone in list_phones:
+        if rand.random() < 0.1:
+            continue
+        alignment.extend([rand.choice(phones) if rand.random() < 0.1
+                          else phone] * rand.randint(1, 2))
+    alignment = alignment or [rand.choice(phones)]
+    utt_align = ['utt 0 1 {}'.format(p) for p in alignment]
+    return alignment, list_phones, word_pos, utt_align
+
+
+def test_empty():
+    assert best_path_dtw.dtw([], ['a'], ['w'], []) == []
+    assert best_path_dtw.dtw(['a'], [], [], ['utt 0 1 a']) == []
+
+
+def test_reference():
+    rand = random.Random(0)
+    for _ in range(200):
+        alignment, list_phones, _, _ = _utterance(rand)
+        path = best_path_dtw.best_paths(
+            [best_path_dtw.encode(alignment, list_phones)])[0]
+        assert path == _reference(alignment, list_phones)
+
+
+def test_words():
+    alignment = ['a', 'a', 'b', 'c', 'd', 'd']
+    list_phones = ['a', 'b', 'c', 'd']
+    word_pos = ['w1', 'w1', 'w2', 'w2']
+    utt_align = ['utt 0 1 {}'.format(p) for p in alignment]
+    assert best_path_dtw.dtw(alignment, list_phones, word_pos, utt_align) == [
+        'utt 0 1 a w1', 'utt 0 1 a', 'utt 0 1 b',
+        'utt 0 1 c w2', 'utt 0 1 d', 'utt 0 1 d']
+
+
+@pytest.mark.parametrize('band', [None, 3, 1000])
+def test_batch(band):
+    rand = random.Random(0)
+    utterances = [_utterance(rand) for _ in range(100)]
+    assert best_path_dtw.word_alignments(
+        utterances, band=band, max_cells=5000) == [
+            best_path_dtw.dtw(*utt, band=band) for utt in utterances]
+
+
+@pytest.mark.parametrize('band', [1, 5, 30])
+def test_band(band):
+    rand = random.Random(0)
+    for _ in range(10):
+        alignment, list_phones, _, _ = _utterance(
+            rand, nphones=rand.randint(20, 60), nsymbols=40)
+        path = best_path_dtw.best_paths(
+            [best_path_dtw.encode(alignment, list_phones)], band=band)[0]
+        cost = _cost(alignment, list_phones, path)
+
+        # the path is not better than the full DTW and at least as good
+        # as the best one in the band (a bit narrowed, so that rounding
+        # errors on the band limits do not matter)
+        n, m = len(alignment), len(list_phones)
+        radius = max(band, np.ceil(
+            (max(n, m) - 1.) / (min(n, m) - 1) / 2.) + 1) - 1e-6
+        assert _matrix(alignment, list_phones)[-1, -1] <= cost
+        assert cost <= _matrix(alignment, list_phones, radius)[-1, -1]
+
+
+def test_single_phone():
+    # the whole alignment is kept when there is a single lexicon phone
+    utt_align = ['utt 0 1 SIL', 'utt 1 2 a', 'utt 2 3 SIL']
+    assert best_path_dtw.dtw(['SIL', 'a', 'SIL'], ['a'], ['w'], utt_align) == [
+        'utt 0 1 SIL w', 'utt 1 2 a', 'utt 2 3 SIL']
@@ -15,12 +15,16 @@
 """Test of the abkhazia.models.features module"""
 
 import h5features
+import numpy as np
 import os
 import pytest
+import wave
 
 import abkhazia.features as features
+import abkhazia.features.numpy_features as numpy_features
 import abkhazia.utils as utils
 import abkhazia.kaldi.ark as ark
+from abkhazia.kaldi import kaldi_path
 from .conftest import assert_no_expr_in_log
 
 params = [(pitch, ftype)
@@ -83,3 +87,236 @@ def test_features(pitch, ftype, corpus, tmpdir):
     assert len(times.keys()) == len(subcorpus.utts())
     for t, c in zip(times.keys(), subcorpus.utts()):
         assert t == c
+
+
+def _sine_wav(filename, duration=1.0, freq=1000, rate=16000, noise=0,
+              nchannels=1, width=2):
+    """Write a sine wave with optional white `noise` in `filename`"""
+    time = np.arange(int(duration * rate)) / float(rate)
+    signal = 8000 * np.sin(2 * np.pi * freq * time)
+    if noise:
+        signal += noise * np.random.RandomState(0).standard_normal(
+            signal.shape)
+    signal = np.repeat(signal.astype('<i2'), nchannels)
+    if width == 1:
+        signal = (signal // 256 + 128).astype(np.uint8)
+
+    fwav = wave.open(filename, 'w')
+    fwav.setnchannels(nchannels)
+    fwav.setsampwidth(width)
+    fwav.setframerate(rate)
+    fwav.writeframes(signal.tostring())
+    fwav.close()
+
+
+@pytest.mark.parametrize('ftype', ['mfcc', 'fbank', 'plp'])
+def test_numpy_extractor(ftype, tmpdir):
+    wav = str(tmpdir.join('sine.wav'))
+    _sine_wav(wav)
+
+    extractor = numpy_features.FeaturesExtractor(ftype, {'use-energy': False})
+    feats = extractor.compute(numpy_features.read_wav(wav))
+
+    # 25ms frames every 10ms with snip edges, as in Kaldi
+    assert feats.shape == (1 + (16000 - 400) // 160, extractor.dim())
+    assert feats.dtype == np.float32
+    assert np.all(np.isfinite(feats))
+
+    # dithering is deterministic
+    assert np.array_equal(
+        feats, extractor.compute(numpy_features.read_wav(wav)))
+
+
+def _kaldi_features(ftype, wav, options, tmpdir):
+    """Return the features of `wav` computed by Kaldi, skip if no Kaldi"""
+    binary = os.path.join(
+        utils.config.get('kaldi', 'kaldi-directory'), 'src', 'featbin',
+        'compute-{}-feats'.format(ftype))
+    if not os.path.isfile(binary):
+        pytest.skip('Kaldi is not installed')
+
+    scp, arkfile = str(tmpdir.join('wav.scp')), str(tmpdir.join('feats.ark'))
+    open(scp, 'w').write('utt {}\n'.format(wav))
+    utils.jobs.run(
+        '{} {} scp:{} ark:{}'.format(binary, ' '.join(
+            '--{}={}'.format(k, v) for k, v in sorted(options.items())),
+            scp, arkfile),
+        stdout=open(os.devnull, 'w').write, env=kaldi_path())
+    return ark.ark_to_dict(arkfile)['utt']
+
+
+@pytest.mark.parametrize('ftype', ['mfcc', 'fbank', 'plp'])
+def test_numpy_kaldi_parity(ftype, tmpdir):
+    wav = str(tmpdir.join('sine.wav'))
+    _sine_wav(wav, freq=440, noise=500)
+
+    # no dithering to compare the same signals
+    options = {'dither': 0}
+    kaldi = _kaldi_features(ftype, wav, options, tmpdir)
+    feats = numpy_features.FeaturesExtractor(ftype, options).compute(
+        numpy_features.read_wav(wav))
+
+    assert feats.shape == kaldi.shape
+    assert np.allclose(feats, kaldi, rtol=1e-3, atol=1e-3)
+
+
+def test_numpy_read_wav(tmpdir):
+    wav = str(tmpdir.join('sine.wav'))
+    _sine_wav(wav)
+    assert numpy_features.read_wav(wav, 16000).shape == (16000,)
+
+    for params in ({'rate': 44100}, {'nchannels': 2}, {'width': 1}):
+        _sine_wav(wav, **params)
+        with pytest.raises(IOError):
+            numpy_features.read_wav(wav, 16000)
+
+
+def test_numpy_fbank_peak(tmpdir):
+    wav = str(tmpdir.join('sine.wav'))
+    _sine_wav(wav, freq=1000)
+
+    extractor = numpy_features.FeaturesExtractor('fbank')
+    feats = extractor.compute(numpy_features.read_wav(wav))
+
+    # the 1kHz energy is in the mel bank centered the closest to 1kHz
+    mel = 1127 * np.log(1 + np.array([20., 1000., 8000.]) / 700)
+    center = (mel[1] - mel[0]) / (mel[2] - mel[0]) * 24 - 1
+    assert abs(feats.mean(axis=0).argmax() - center) <= 1
+
+
+def test_numpy_options():
+    extractor = numpy_features.FeaturesExtractor(
+        'mfcc', {'num-ceps': '5', 'use-energy': 'true'})
+    assert extractor.dim() == 5
+
+    with pytest.raises(IOError):
+        numpy_features.FeaturesExtractor('mfcc', {'vtln-warp': 1})
+
+    with pytest.raises(IOError):
+        numpy_features.FeaturesExtractor('mfcc', {'use-energy': 'yes'})
+
+
+def test_numpy_compute_job(tmpdir):
+    wav = str(tmpdir.join('sine.wav'))
+    _sine_wav(wav, duration=2.0)
+    arkfile, scpfile = str(tmpdir.join('f.ark')), str(tmpdir.join('f.scp'))
+
+    numpy_features.compute_job(
+        numpy_features.FeaturesExtractor('mfcc'),
+        [('u1', wav, 0.0, 1.0), ('u2', wav, None, None),
+         ('u3', wav, 1.0, 1.01)],
+        arkfile, scpfile)
+
+    # u3 is too short to have a frame and is ignored
+    with ark.ScpReader(scpfile) as reader:
+        feats = dict(reader)
+    assert {utt: f.shape for utt, f in feats.items()} == {
+        'u1': (98, 13), 'u2': (198, 13)}
+
+    # the dithering does not depend on the jobs
+    arkfile, scpfile = str(tmpdir.join('g.ark')), str(tmpdir.join('g.scp'))
+    numpy_features.compute_job(
+        numpy_features.FeaturesExtractor('mfcc'),
+        [('u2', wav, None, None)], arkfile, scpfile)
+    with ark.ScpReader(scpfile) as reader:
+        assert np.array_equal(dict(reader)['u2'], feats['u2'])
+
+
+@pytest.mark.parametrize('ftype', ['mfcc', 'fbank', 'plp'])
+def test_features_numpy(ftype, corpus, tmpdir):
+    output_dir = str(tmpdir.mkdir('feats'))
+    flog = os.path.join(output_dir, 'feats.log')
+    log = utils.logger.get_log(flog)
+    subcorpus = corpus.subcorpus(corpus.utts()[0:3])
+
+    nbc = 3
+    feat = features.Features(subcorpus, output_dir, log=log)
+    feat.type = ftype
+    feat.njobs = 2
+    feat.backend = 'numpy'
+    feat.use_cmvn = True
+    feat.delta_order = 1
+    feat.features_options.append(
+        ('num-ceps' if ftype in ('mfcc', 'plp') else 'num-mel-bins', nbc))
+    feat.compute()
+
+    assert_no_expr_in_log(flog, 'error')
+    features.Features.check_features(output_dir, cmvn=True)
+
+    feats = dict(ark.ScpReader(os.path.join(output_dir, 'feats.scp')).read())
+    assert sorted(feats.keys()) == sorted(subcorpus.utts())
+    assert all(f.shape[1] == 2 * nbc for f in feats.values())
+
+    cmvn = dict(ark.ScpReader(os.path.join(output_dir, 'cmvn.scp')).read())
+    assert sorted(cmvn.keys()) == sorted(subcorpus.spks())
+    assert sum(s[0, -1] for s in cmvn.values()) == sum(
+        f.shape[0] for f in feats.values())
+
+
+def _kaldi_deltas(features, order, window=2):
+    """Direct port of the Kaldi DeltaFeatures::Process loops"""
+    scales = [[1.0]]
+    for i in range(1, order + 1):
+        prev = scales[-1]
+        prev_offset = (len(prev) - 1) // 2
+        cur = [0.0] * (len(prev) + 2 * window)
+        for j in range(-window, window + 1):
+            for k in range(-prev_offset, prev_offset + 1):
+                cur[j + k + prev_offset + window] += (
+                    j * prev[k + prev_offset] / 10.0)
+        scales.append(cur)
+
+    nframes, dim = features.shape
+    output = np.zeros((nframes, dim * (order + 1)))
+    for frame in range(nframes):
+        for i, scale in enumerate(scales):
+            offset = (len(scale) - 1) // 2
+            for j in range(-offset, offset + 1):
+                source = min(max(frame + j, 0), nframes - 1)
+                output[frame, i * dim:(i + 1) * dim] += (
+                    scale[j + offset] * features[source])
+    return output
+
+
+@pytest.mark.parametrize('order', [0, 1, 2, 3])
+def test_add_deltas(order):
+    feats = np.random.RandomState(0).randn(12, 4).astype(np.float32)
+    deltas = numpy_features.add_deltas(feats, order)
+
+    assert deltas.shape == (12, 4 * (order + 1))
+    assert deltas.dtype == np.float32
+    assert np.allclose(deltas, _kaldi_deltas(feats, order), atol=1e-5)
+
+
+def test_delta_cmvn_job(tmpdir):
+    rand = np.random.RandomState(0)
+    feats = {'s1-u1': rand.randn(10, 3).astype(np.float32),
+             's1-u2': rand.randn(5, 3).astype(np.float32),
+             's2-u1': rand.randn(7, 3).astype(np.float32)}
+    utt2spk = {utt: utt.split('-')[0] for utt in feats}
+
+    arkfile, scpfile = str(tmpdir.join('f.ark')), str(tmpdir.join('f.scp'))
+    ark.dict_to_ark(arkfile, feats, format='binary', scp=scpfile)
+
+    stats = numpy_features.delta_cmvn_job(arkfile, scpfile, 2, utt2spk)
+
+    # stats are computed on the features without deltas
+    spk1 = np.vstack((feats['s1-u1'], feats['s1-u2'])).astype(np.float64)
+    assert sorted(stats.keys()) == ['s1', 's2']
+    assert stats['s1'][0, -1] == 15 and stats['s1'][1, -1] == 0
+    assert np.allclose(stats['s1'][0, :-1], spk1.sum(axis=0))
+    assert np.allclose(stats['s1'][1, :-1], (spk1 ** 2).sum(axis=0))
+
+    # the ark has been rewritten with deltas
+    assert sorted(os.listdir(str(tmpdir))) == ['f.ark', 'f.scp']
+    with ark.ScpReader(scpfile) as reader:
+        for utt, deltas in reader:
+            assert np.allclose(
+                deltas, numpy_features.add_deltas(feats[utt], 2))
+
+
+def test_features_numpy_pitch(corpus, tmpdir):
+    feat = features.Features(
+        corpus, str(tmpdir.mkdir('feats')), use_pitch=True, backend='numpy')
+    with pytest.raises(IOError):
+        feat.create()
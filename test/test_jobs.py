@@ -0,0 +1,88 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the abkhazia.utils.jobs module"""
+
+import time
+
+import pytest
+
+import abkhazia.utils.jobs as jobs
+
+
+def test_run():
+    output = []
+    job = jobs.run('echo hello', stdout=output.append)
+    assert ''.join(output) == 'hello\n'
+    assert job.status == 'done'
+    assert job.exitcode == 0
+    assert job.wall_time >= 0 and job.maxrss > 0
+    assert sorted(job.usage.keys()) == [
+        'maxrss', 'read_bytes', 'sys', 'user', 'wall', 'write_bytes']
+
+
+def test_run_errors():
+    with pytest.raises(RuntimeError) as err:
+        jobs.run('false')
+    assert 'returned with 1' in str(err.value)
+
+    jobs.run('false', returncode=1)
+
+    with pytest.raises(OSError):
+        jobs.run('a_command_that_does_not_exist')
+
+
+def test_timeout():
+    start = time.time()
+    with pytest.raises(RuntimeError) as err:
+        jobs.run('sleep 10', timeout=0.2)
+    assert 'timed out' in str(err.value)
+    assert time.time() - start < 5
+
+
+def test_concurrency():
+    output = []
+    start = time.time()
+    with jobs.JobRunner(njobs=3, stdout=output.append) as runner:
+        done = runner.map(['sh -c "sleep 0.3; echo {}"'.format(i)
+                           for i in range(6)])
+    assert time.time() - start < 1.5
+    assert [job.status for job in done] == ['done'] * 6
+    assert sorted(''.join(output).split()) == [str(i) for i in range(6)]
+
+
+def test_cancel_on_error():
+    with jobs.JobRunner(njobs=2) as runner:
+        submitted = [runner.submit(command) for command in (
+            'sleep 10', 'sh -c "exit 3"', 'sleep 10')]
+        with pytest.raises(RuntimeError):
+            runner.wait()
+
+    assert [job.status for job in submitted] == [
+        'cancelled', 'failed', 'cancelled']
+    assert submitted[1].exitcode == 3
+
+
+def test_cancel():
+    runner = jobs.JobRunner(njobs=1)
+    try:
+        first = runner.submit('sleep 10')
+        second = runner.submit('echo never')
+        runner.cancel()
+        for job in (first, second):
+            with pytest.raises(RuntimeError):
+                job.wait()
+            assert job.status == 'cancelled'
+    finally:
+        runner.close()
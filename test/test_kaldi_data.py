@@ -0,0 +1,118 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the abkhazia.kaldi.KaldiData class"""
+
+import os
+
+import pytest
+
+from abkhazia.corpus import Corpus
+from abkhazia.kaldi import KaldiData, Abkhazia2Kaldi
+
+
+def _save(corpus, tmpdir):
+    corpus_dir = os.path.join(str(tmpdir), 'corpus')
+    corpus.save(corpus_dir, copy_wavs=False)
+    return corpus_dir
+
+
+def test_shared(tmpdir, wav_corpus):
+    corpus_dir = _save(wav_corpus, tmpdir)
+    corpus = Corpus.load(corpus_dir)
+
+    data = KaldiData.for_corpus(corpus, str(tmpdir.join('default')))
+    assert data.directory == os.path.join(corpus_dir, 'cache', 'kaldi')
+
+    path = data.path()
+    assert sorted(os.listdir(os.path.join(path, 'data'))) == [
+        'segments', 'spk2utt', 'text', 'utt2spk', 'wav.scp']
+    assert sorted(data.corpus.utts()) == sorted(corpus.utts())
+
+    # the recipes link or copy the shared data, built only once
+    mtime = os.path.getmtime(os.path.join(path, 'data', 'text'))
+    for name in ('a', 'b'):
+        a2k = Abkhazia2Kaldi(corpus, str(tmpdir.join(name)), name=name)
+        text = a2k.setup_text()
+        lexicon = a2k.setup_lexicon()
+        assert not os.path.islink(text)
+        assert open(text).read() == open(
+            os.path.join(path, 'data', 'text')).read()
+        assert os.path.realpath(lexicon) == os.path.realpath(
+            os.path.join(path, 'dict', 'lexicon.txt'))
+
+        # the phone lexicon does not overwrite the shared one
+        a2k.setup_phones()
+        a2k.setup_silences()
+        a2k.setup_phone_lexicon()
+        assert not os.path.islink(lexicon)
+        assert 'hello' in open(
+            os.path.join(path, 'dict', 'lexicon.txt')).read()
+    assert os.listdir(data.directory) == [os.path.basename(path)]
+    assert os.path.getmtime(os.path.join(path, 'data', 'text')) == mtime
+
+
+def test_versions(tmpdir, wav_corpus):
+    corpus_dir = _save(wav_corpus, tmpdir)
+    corpus = Corpus.load(corpus_dir)
+    first = KaldiData.for_corpus(corpus, None).path()
+
+    # a modified corpus has its own version
+    corpus.text['s1-u1'] = 'hello'
+    data = KaldiData.for_corpus(corpus, None)
+    second = data.path()
+    assert first != second
+    assert sorted(os.listdir(data.directory)) == sorted(
+        os.path.basename(p) for p in (first, second))
+
+    # the recently used versions are kept, then only the most
+    # recently used ones
+    KaldiData.max_versions, max_versions = 1, KaldiData.max_versions
+    try:
+        corpus.text['s1-u1'] = 'world'
+        KaldiData.for_corpus(corpus, None).path()
+        assert len(os.listdir(data.directory)) == 3
+
+        # make the versions used long ago
+        for key in os.listdir(data.directory):
+            past = os.path.getmtime(data.directory) - 2 * data.evict_delay
+            os.utime(os.path.join(data.directory, key, 'manifest.json'),
+                     (past, past))
+        corpus.text['s1-u1'] = 'world world'
+        fourth = KaldiData.for_corpus(corpus, None).path()
+        assert os.listdir(data.directory) == [os.path.basename(fourth)]
+    finally:
+        KaldiData.max_versions = max_versions
+
+
+def test_read_only(tmpdir, wav_corpus):
+    corpus_dir = _save(wav_corpus, tmpdir)
+    corpus = Corpus.load(corpus_dir)
+
+    # the data falls back to the default directory when the cache
+    # cannot be written (a file in place of the directory here, as
+    # permissions are not enforced for root)
+    directory = os.path.join(corpus_dir, 'cache', 'kaldi')
+    if not os.path.isdir(os.path.dirname(directory)):
+        os.makedirs(os.path.dirname(directory))
+    open(directory, 'w').close()
+
+    default = str(tmpdir.join('default'))
+    data = KaldiData.for_corpus(corpus, default)
+    assert os.path.dirname(data.path()) == default
+    assert os.path.isfile(data.path('data', 'text'))
+
+    # without fallback the error is raised
+    with pytest.raises(OSError):
+        KaldiData(corpus, directory).path()
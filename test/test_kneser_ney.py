@@ -0,0 +1,149 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the abkhazia.language.kneser_ney module"""
+
+import collections
+
+import numpy as np
+import pytest
+
+import abkhazia.language.kneser_ney as kn
+from abkhazia.language.arpa import ARPALanguageModel
+from .conftest import random_sentences
+
+
+def _reference(sentences, order):
+    """Return interpolated modified Kneser-Ney probabilities
+
+    A direct implementation of the textbook formulas, as a dict
+    ngram -> probability of its last word given the others.
+
+    """
+    counts = collections.defaultdict(collections.Counter)
+    for sentence in sentences:
+        tokens = ['<s>'] + sentence + ['</s>']
+        for n in range(1, order + 1):
+            for i in range(len(tokens) - n + 1):
+                counts[n][tuple(tokens[i:i + n])] += 1
+
+    adjusted = {order: dict(counts[order])}
+    for n in range(1, order):
+        adjusted[n] = {
+            gram: count if gram[0] == '<s>' else len(
+                [e for e in counts[n + 1] if e[1:] == gram])
+            for gram, count in counts[n].items()}
+    del adjusted[1][('<s>',)]
+    adjusted[1].setdefault(('<unk>',), 0)
+
+    discounts = {n: (0,) + kn.discounts(np.asarray(adjusted[n].values()))
+                 for n in range(1, order + 1)}
+    nwords = len(adjusted[1])
+
+    def _prob(gram):
+        n = len(gram)
+        following = [c for g, c in adjusted[n].items() if g[:-1] == gram[:-1]]
+        lower = 1.0 / nwords if n == 1 else _prob(gram[1:])
+        if not following:
+            return lower
+
+        d = discounts[n]
+        total = float(sum(following))
+        gamma = sum(d[min(c, 3)] for c in following) / total
+        count = adjusted[n].get(gram, 0)
+        return (count - d[min(count, 3)]) / total + gamma * lower
+
+    return {gram: _prob(gram)
+            for n in range(1, order + 1) for gram in adjusted[n]}
+
+
+def test_count_ngrams():
+    words, counts = kn.count_ngrams([['a', 'b'], ['b']], 2, chunk_size=1)
+    assert words == ['<s>', '</s>', '<unk>', 'a', 'b']
+
+    def _decode(n):
+        return {tuple(words[w] for w in gram): count
+                for gram, count in zip(counts[n][0].tolist(), counts[n][1])}
+
+    assert _decode(1) == {
+        ('<s>',): 2, ('</s>',): 2, ('a',): 1, ('b',): 2}
+    assert _decode(2) == {
+        ('<s>', 'a'): 1, ('a', 'b'): 1, ('b', '</s>'): 2, ('<s>', 'b'): 1}
+
+
+def test_count_chunks():
+    # counting by chunks merges the same counts as at once
+    sentences = random_sentences()
+    words, counts = kn.count_ngrams(sentences, 3)
+    for chunk_size in (1, 7, 50):
+        words2, counts2 = kn.count_ngrams(sentences, 3, chunk_size=chunk_size)
+        assert words2 == words
+        for n in (1, 2, 3):
+            assert np.array_equal(counts2[n][0], counts[n][0])
+            assert np.array_equal(counts2[n][1], counts[n][1])
+
+
+def test_discounts():
+    counts = np.asarray([1] * 10 + [2] * 5 + [3] * 3 + [4] * 2 + [7])
+    y = 10. / (10 + 2 * 5)
+    assert np.allclose(
+        kn.discounts(counts),
+        (1 - 2 * y * 5 / 10., 2 - 3 * y * 3 / 5., 3 - 4 * y * 2 / 3.))
+
+    # undefined modified discounts
+    assert kn.discounts(np.asarray([1, 1, 2])) == (0.5, 0.5, 0.5)
+
+
+@pytest.mark.parametrize('order', [1, 2, 3, 4])
+def test_reference(order):
+    sentences = random_sentences()
+    reference = _reference(sentences, order)
+
+    words, counts = kn.count_ngrams(sentences, order, chunk_size=50)
+    model = kn.kneser_ney(words, counts, order)
+    for grams, logprob in zip(model.grams, model.probs):
+        for gram, prob in zip(grams.tolist(), 10 ** logprob.astype(float)):
+            gram = tuple(words[w] for w in gram)
+            if gram == ('<s>',):
+                assert prob < 1e-90
+            else:
+                assert prob == pytest.approx(reference[gram], rel=1e-5)
+
+
+@pytest.mark.parametrize('order', [2, 3])
+def test_arpa(order, tmpdir):
+    arpa = str(tmpdir.join('lm.arpa.gz'))
+    kn.estimate_arpa(iter(random_sentences()), arpa, order)
+
+    lm = ARPALanguageModel.load(arpa)
+    assert lm.order == order
+
+    # the probabilities sum to 1 in each context
+    vocab = [w for w in lm.words if w != '<s>']
+    for n in range(1, order):
+        for history in lm.grams[n - 1].tolist():
+            history = [lm.words[w] for w in history]
+            if history[-1] != '</s>':
+                assert sum(10 ** lm.logprob(w, history) for w in vocab) == (
+                    pytest.approx(1, abs=1e-4))
+
+
+def test_empty_and_short(tmpdir):
+    # no text at all, sentences shorter than the order
+    for sentences in ([], [[]], [['a'], ['a', 'b']]):
+        arpa = str(tmpdir.join('lm.arpa'))
+        kn.estimate_arpa(sentences, arpa, 5)
+        lm = ARPALanguageModel.load(arpa)
+        assert lm.logprob('</s>') is not None
+        assert lm.logprob('<s>') == -99
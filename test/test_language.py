@@ -28,11 +28,11 @@ orders = range(1, 4)
 params = [(l, o) for l in levels for o in orders]
 
 
-def test_srilm_path():
-    # test we can reach the ngram binary from SRILM in the Kaldi
-    # environment (problematic because it's change from Linux to Mac)
+def test_fstcompile_path():
+    # test we can reach the fstcompile binary from OpenFst in the
+    # Kaldi environment, the language model no longer needs SRILM.
     # This raises RuntimeError if failing
-    utils.jobs.run('which ngram', env=kaldi.path.kaldi_path())
+    utils.jobs.run('which fstcompile', env=kaldi.path.kaldi_path())
 
 
 @pytest.mark.parametrize('level, order', params)
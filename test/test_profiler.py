@@ -0,0 +1,53 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the abkhazia.utils.profiler module"""
+
+import json
+
+import pytest
+
+import abkhazia.utils.jobs as jobs
+from abkhazia.utils.profiler import Profiler
+
+
+def test_profiler(tmpdir):
+    profiler = Profiler()
+    with profiler.stage('first'):
+        profiler.add_job(jobs.run('sleep 0.1', stdout=lambda _: None))
+
+    with pytest.raises(ValueError):
+        with profiler.stage('second'):
+            raise ValueError
+
+    assert [s['name'] for s in profiler.stages] == ['first', 'second']
+    assert [s['status'] for s in profiler.stages] == ['done', 'failed']
+    assert profiler.stages[0]['wall'] >= 0.1
+    assert profiler.stages[0]['maxrss'] > 0
+
+    command = profiler.commands[0]
+    assert command['stage'] == 'first'
+    assert command['command'] == 'sleep 0.1'
+    assert command['status'] == 'done'
+    assert command['wall'] >= 0.1
+
+    # save, load back and summarize
+    filename = str(tmpdir.join('profile.json'))
+    profiler.save(filename)
+    assert sorted(json.load(open(filename, 'r')).keys()) == [
+        'commands', 'stages']
+
+    summary = Profiler.load(filename).summary()
+    assert 'second (failed)' in summary
+    assert 'sleep 0.1' in summary
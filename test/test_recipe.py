@@ -0,0 +1,84 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the AbstractRecipe class"""
+
+import os
+
+import pytest
+
+from abkhazia.abstract_recipe import AbstractRecipe
+
+
+class _Recipe(AbstractRecipe):
+    """A recipe with two stages, the second one failing on demand"""
+    name = 'dummy'
+
+    def __init__(self, corpus, output_dir):
+        super(_Recipe, self).__init__(corpus, output_dir)
+        self.use_cache = False
+        self.option = 1
+        self._fail = False
+        self._calls = []
+
+    def create(self):
+        self.check_parameters()
+        self._calls.append('create')
+
+    def run(self):
+        result = self._checkpoint('first', self._stage, 'first')
+        assert result == 'first done'
+        self._checkpoint('second', self._stage, 'second')
+
+    def _stage(self, name):
+        self._calls.append(name)
+        if name == 'second' and self._fail:
+            raise RuntimeError('second failed')
+        return name + ' done'
+
+
+def test_resume(tmpdir, wav_corpus):
+    corpus = wav_corpus
+    output_dir = str(tmpdir.join('output'))
+
+    # the second stage fails, the recipe is kept
+    recipe = _Recipe(corpus, output_dir)
+    recipe._fail = True
+    with pytest.raises(RuntimeError):
+        recipe.compute()
+    assert recipe._calls == ['create', 'first', 'second']
+    assert not recipe.delete_recipe
+    assert os.path.isfile(
+        os.path.join(recipe.recipe_dir, 'checkpoints.json'))
+
+    # resuming with other options is an error
+    recipe = _Recipe(corpus, output_dir)
+    recipe.resume = True
+    recipe.option = 2
+    with pytest.raises(IOError):
+        recipe.compute()
+    assert recipe._calls == []
+
+    # resuming runs only the failed stage
+    recipe = _Recipe(corpus, output_dir)
+    recipe.resume = True
+    recipe.delete_recipe = False
+    recipe.compute()
+    assert recipe._calls == ['second']
+
+    # without resume everything is computed again
+    recipe = _Recipe(corpus, output_dir)
+    recipe.delete_recipe = False
+    recipe.compute()
+    assert recipe._calls == ['create', 'first', 'second']